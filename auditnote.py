@@ -1,39 +1,186 @@
-import streamlit as st
-st.set_page_config(page_title="Ứng dụng Đánh giá ISO", layout="wide")
+import os
+import sys
+import time
+import functools
+import threading
+
+class _HeadlessCache:
+    """Thay cho st.cache_resource/st.cache_data: nhớ kết quả theo đối số, có ttl và .clear()."""
+
+    def __call__(self, func=None, *, ttl=None, **kwargs):
+        if func is None:
+            return lambda f: self(f, ttl=ttl)
+        entries = {}
+
+        @functools.wraps(func)
+        def cached(*args, **kw):
+            key = (args, tuple(sorted(kw.items())))
+            try:
+                hit = entries.get(key)
+            except TypeError:  # đối số không hash được: không cache
+                return func(*args, **kw)
+            if hit is not None and (ttl is None or time.monotonic() - hit[0] < ttl):
+                return hit[1]
+            value = func(*args, **kw)
+            entries[key] = (time.monotonic(), value)
+            return value
+        cached.clear = entries.clear
+        return cached
+
+class _HeadlessStreamlit:
+    """Phần API Streamlit mà lớp dữ liệu và xuất báo cáo dùng, khi chạy bằng dòng lệnh."""
+
+    cache_resource = _HeadlessCache()
+    cache_data = _HeadlessCache()
+
+    def __init__(self):
+        self._secrets = None
+
+    @property
+    def secrets(self):
+        if self._secrets is None:
+            self._secrets = {}
+            for path in (os.path.join(".streamlit", "secrets.toml"),
+                         os.path.expanduser(os.path.join("~", ".streamlit", "secrets.toml"))):
+                if os.path.exists(path):
+                    import tomllib
+                    with open(path, "rb") as f:
+                        self._secrets = tomllib.load(f)
+                    break
+        return self._secrets
+
+    def __getattr__(self, name):
+        if name in ("error", "warning", "info", "success"):
+            return lambda body, *args, **kwargs: print(f"[{name}] {body}", file=sys.stderr)
+        raise AttributeError(f"st.{name} không dùng được khi chạy bằng dòng lệnh")
+
+# `python auditnote.py <lệnh>` (cron, batch) chạy không cần Streamlit; tiến
+# trình con của lệnh report nhận AUDITNOTE_HEADLESS=1
+HEADLESS = os.environ.get("AUDITNOTE_HEADLESS") == "1" or (
+    __name__ == "__main__" and "streamlit" not in sys.modules
+)
+if HEADLESS:
+    st = _HeadlessStreamlit()
+else:
+    import streamlit as st
+    st.set_page_config(page_title="Ứng dụng Đánh giá ISO", layout="wide")
 
 import pandas as pd
 import numpy as np
+# Bảng đọc từ sheet được cache và dùng chung giữa các phiên: bản sao nông chỉ
+# thực sự sao chép khi có người ghi vào (copy-on-write)
+pd.set_option("mode.copy_on_write", True)
 import gspread
 import hashlib
-import time
-import os
 import re
 import io
+import copy
 import json
 import base64
+import hmac
+import abc
+import asyncio
+import pickle
+import builtins
+import collections
+import sqlite3
+import tempfile
+import math
+import heapq
+import unicodedata
+import uuid
+import http.server
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-import plotly.express as px
-from PIL import Image
-import pillow_heif
 import requests
+import importlib
+import importlib.util
+
+# ------------ Thư viện nặng: import lười ------------
+class LazyNames:
+    """Mặt tiền cho các tên của thư viện nặng, chỉ import ở lần dùng đầu tiên.
 
-# Import libraries for PDF and Word export
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image as RLImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-try:
-    from docx import Document
-    from docx.shared import Inches, Pt, RGBColor
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    DOCX_AVAILABLE = True
-except ImportError:
-    DOCX_AVAILABLE = False
+    Mỗi tên trỏ tới "module.thuộc_tính" (hoặc một module con); sau lần tra đầu
+    giá trị được gắn thẳng lên đối tượng nên các lần sau không qua __getattr__.
+    Thư viện xuất báo cáo, xử lý ảnh và Drive chỉ cần khi xuất/upload, nên khởi
+    động tiến trình và các trang không dùng đến chúng không phải trả chi phí import.
+    ``on_import(facade)`` (nếu có) chạy một lần, trước khi trả về tên đầu tiên:
+    chỗ cấu hình thư viện cho cả tiến trình.
+    """
+
+    def __init__(self, on_import=None, **names):
+        self._names = names
+        self._on_import = on_import
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        try:
+            path = self._names[attr]
+        except KeyError:
+            raise AttributeError(attr) from None
+        if self._on_import is not None:
+            with self._lock:
+                hook, self._on_import = self._on_import, None
+                if hook is not None:
+                    hook(self)
+        module_name, _, name = path.rpartition(".")
+        try:
+            value = getattr(importlib.import_module(module_name), name)
+        except (ValueError, AttributeError):  # module cấp cao nhất, hoặc module con chưa được import
+            value = importlib.import_module(path)
+        setattr(self, attr, value)
+        return value
+
+def _configure_reportlab(pdf):
+    # Luồng nhị phân thay cho ASCII85: ảnh không phình thêm 25% và không tốn thời gian mã hóa
+    pdf.rl_config.useA85 = 0
+
+pdf = LazyNames(
+    on_import=_configure_reportlab,
+    rl_config="reportlab.rl_config",
+    A4="reportlab.lib.pagesizes.A4",
+    landscape="reportlab.lib.pagesizes.landscape",
+    SimpleDocTemplate="reportlab.platypus.SimpleDocTemplate",
+    Paragraph="reportlab.platypus.Paragraph",
+    Spacer="reportlab.platypus.Spacer",
+    Table="reportlab.platypus.Table",
+    TableStyle="reportlab.platypus.TableStyle",
+    Image="reportlab.platypus.Image",
+    getSampleStyleSheet="reportlab.lib.styles.getSampleStyleSheet",
+    ParagraphStyle="reportlab.lib.styles.ParagraphStyle",
+    colors="reportlab.lib.colors",
+    pdfmetrics="reportlab.pdfbase.pdfmetrics",
+    TTFont="reportlab.pdfbase.ttfonts.TTFont",
+)
+word = LazyNames(
+    Document="docx.Document",
+    Inches="docx.shared.Inches",
+    Pt="docx.shared.Pt",
+    WD_ALIGN_PARAGRAPH="docx.enum.text.WD_ALIGN_PARAGRAPH",
+    Image="docx.image.image.Image",
+    RT="docx.opc.constants.RELATIONSHIP_TYPE",
+    PackURI="docx.opc.packuri.PackURI",
+    OxmlElement="docx.oxml.OxmlElement",
+    qn="docx.oxml.ns.qn",
+    CT_Inline="docx.oxml.shape.CT_Inline",
+    ImagePart="docx.parts.image.ImagePart",
+    Paragraph="docx.text.paragraph.Paragraph",
+)
+imaging = LazyNames(
+    Image="PIL.Image",
+    pillow_heif="pillow_heif",
+)
+google_drive = LazyNames(
+    build="googleapiclient.discovery.build",
+    MediaIoBaseUpload="googleapiclient.http.MediaIoBaseUpload",
+    HttpError="googleapiclient.errors.HttpError",
+)
+
+# Kiểm tra có cài python-docx mà không import
+DOCX_AVAILABLE = importlib.util.find_spec("docx") is not None
+if not DOCX_AVAILABLE:
     st.warning("Thư viện python-docx không khả dụng. Chức năng xuất Word sẽ bị hạn chế.")
 
 # Predefined constants for ISO audit
@@ -81,26 +228,68 @@ AUDIT_RESULTS = {
     "CM": "Phù hợp"
 }
 
+# Cấu trúc cột của các bảng dữ liệu
+AUDITORS_HEADER = ["fullname", "position", "email", "password", "last_login"]
+NOTES_HEADER = [
+    "company", "address", "department", "person", "audit_time",
+    "frame_id", "panel_id", "clause", "clause_name", "requirements",
+    "evidence", "image_url", "result", "auditor", "timestamp", "id"
+]
+NOTE_ID_COL = NOTES_HEADER.index("id") + 1
+# Cột văn bản dài của Notes: chỉ tải khi người dùng mở hoặc xuất các dòng đó
+NOTE_TEXT_COLUMNS = ("requirements", "evidence")
+PARTICIPANTS_HEADER = ["company", "frame_id", "fullname", "position", "role"]
+IMAGES_HEADER = ["sha256", "file_id", "name", "size", "timestamp"]
+
+# Mọi bảng nằm chung một spreadsheet để đọc bằng một lời gọi values_batch_get.
+# Mỗi bảng: khóa -> (tên worksheet, tiêu đề, workbook cũ dùng để chuyển dữ liệu)
+DB_NAME = "AuditNote_DB"
+TABLES = {
+    "auditors": ("Auditors", AUDITORS_HEADER, "Auditors_DB"),
+    "notes": ("Notes", NOTES_HEADER, "Audit_Notes"),
+    "participants": ("Participants", PARTICIPANTS_HEADER, "Audit_Participants"),
+    "images": ("Images", IMAGES_HEADER, None),
+}
+
 # ------------ Cấu hình logo 3×3 cm ~ 113×113 px ------------
 LOGO_WIDTH, LOGO_HEIGHT = int(3/2.54*96), int(3/2.54*96)
-def display_logos():
-    """Tự động tìm và hiển thị logo1.*, logo2.* và logo3.* với đa định dạng."""
-    c1, c2, c3, c4, c5 = st.columns(5)
-    for col, base in ((c1, "logo1"), (c3, "logo2"), (c5, "logo3")):
+LOGO_BASES = ("logo1", "logo2", "logo3")
+
+@st.cache_resource
+def logo_images():
+    """Tìm, giải mã và thu nhỏ logo một lần mỗi tiến trình: {base: (đường dẫn, PNG hoặc lỗi)}."""
+    logos = {}
+    for base in LOGO_BASES:
         found = None
         for ext in ("png","jpg","jpeg","gif"):
             path = f"{base}.{ext}"
             if os.path.exists(path):
                 found = path
                 break
-        if found:
-            try:
-                img = Image.open(found).resize((LOGO_WIDTH, LOGO_HEIGHT))
-                col.image(img)
-            except Exception as e:
-                col.error(f"Lỗi đọc {found}: {e}")
-        else:
+        if found is None:
+            logos[base] = (None, None)
+            continue
+        try:
+            img = imaging.Image.open(found).resize((LOGO_WIDTH, LOGO_HEIGHT))
+            buf = io.BytesIO()
+            img.save(buf, format="PNG")
+            logos[base] = (found, buf.getvalue())
+        except Exception as e:
+            logos[base] = (found, e)
+    return logos
+
+def display_logos():
+    """Hiển thị logo1.*, logo2.* và logo3.* (png/jpg/jpeg/gif) từ cache đã thu nhỏ."""
+    c1, c2, c3, c4, c5 = st.columns(5)
+    logos = logo_images()
+    for col, base in zip((c1, c3, c5), LOGO_BASES):
+        found, image = logos[base]
+        if found is None:
             col.warning(f"Thiếu {base}.(png/jpg/jpeg/gif)")
+        elif isinstance(image, Exception):
+            col.error(f"Lỗi đọc {found}: {image}")
+        else:
+            col.image(image)
 
 # ------------ Thiết lập Google Sheets ------------
 SCOPE = ["https://www.googleapis.com/auth/spreadsheets",
@@ -112,132 +301,1446 @@ def retry(func, tries=5, delay=1, mult=2):
             return func()
         except gspread.exceptions.APIError as e:
             if "429" in str(e) and i < tries-1:
+                metrics().inc("auditnote_rate_limit_retries_total")
                 st.warning(f"Giới hạn tốc độ, thử lại sau {delay}s…")
                 time.sleep(delay)
                 delay *= mult
             else:
                 raise
 
+# ------------ Đo lường (metrics) ------------
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_HELP = {
+    "auditnote_remote_call_seconds": "Thời gian các lời gọi Google Sheets/Drive và tải ảnh",
+    "auditnote_remote_errors_total": "Số lời gọi từ xa bị lỗi",
+    "auditnote_rate_limit_retries_total": "Số lần thử lại do lỗi 429",
+    "auditnote_export_phase_seconds": "Thời gian từng pha khi xuất báo cáo",
+}
+
+class Metrics:
+    """Histogram thời gian và bộ đếm theo (tên, nhãn), dùng chung cho cả tiến trình."""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = defaultdict(float)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist["buckets"][i] += 1
+                    break
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def quantile(self, hist, q):
+        """Ước lượng phân vị từ bucket (nội suy tuyến tính như histogram_quantile)."""
+        rank = q * hist["count"]
+        seen, lower = 0, 0.0
+        for bound, n in zip(self.buckets, hist["buckets"]):
+            if n and seen + n >= rank:
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        """Danh sách dòng tóm tắt (dùng cho bảng trong trang admin)."""
+        with self._lock:
+            histograms = {k: dict(v, buckets=list(v["buckets"])) for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+        rows = []
+        for (name, labels), hist in sorted(histograms.items()):
+            rows.append({
+                "metric": name,
+                **dict(labels),
+                "count": hist["count"],
+                "mean_ms": round(1000 * hist["sum"] / hist["count"], 1) if hist["count"] else 0.0,
+                "p50_ms": round(1000 * self.quantile(hist, 0.5), 1),
+                "p95_ms": round(1000 * self.quantile(hist, 0.95), 1),
+                "total_s": round(hist["sum"], 3),
+            })
+        for (name, labels), value in sorted(counters.items()):
+            rows.append({"metric": name, **dict(labels), "count": value})
+        return rows
+
+    def to_prometheus(self):
+        """Định dạng Prometheus text exposition 0.0.4."""
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        with self._lock:
+            histograms = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines, declared = [], set()
+        for (name, labels), hist in histograms:
+            if name not in declared:
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                declared.add(name)
+            cumulative = 0
+            for bound, n in zip(self.buckets, hist["buckets"]):
+                cumulative += n
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {hist['count']}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {hist['sum']}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {hist['count']}")
+        for (name, labels), value in counters:
+            if name not in declared:
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{fmt_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
 @st.cache_resource
-def gclient():
+def metrics():
+    return Metrics()
+
+@contextmanager
+def remote_call(op, target=""):
+    """Đo một lời gọi từ xa; lỗi được đếm riêng rồi ném lại."""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        metrics().inc("auditnote_remote_errors_total", op=op, target=target)
+        raise
+    finally:
+        metrics().observe("auditnote_remote_call_seconds", time.perf_counter() - start,
+                          op=op, target=target, status=status)
+
+class PhaseTimer:
+    """Cộng dồn thời gian theo pha của một lần xuất báo cáo.
+
+    ``switch`` chuyển pha hiện tại; ``phase`` là pha lồng tạm dừng pha ngoài
+    (ví dụ tải ảnh giữa lúc dựng bố cục). ``record`` ghi tổng mỗi pha vào metrics.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.totals = defaultdict(float)
+        self._stack = []
+        self._mark = time.perf_counter()
+
+    def _lap(self):
+        now = time.perf_counter()
+        if self._stack:
+            self.totals[self._stack[-1]] += now - self._mark
+        self._mark = now
+
+    def switch(self, name):
+        self._lap()
+        if self._stack:
+            self._stack[-1] = name
+        else:
+            self._stack.append(name)
+
+    @contextmanager
+    def phase(self, name):
+        self._lap()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._lap()
+            self._stack.pop()
+
+    def record(self):
+        self._lap()
+        self._stack.clear()
+        for phase, seconds in self.totals.items():
+            metrics().observe("auditnote_export_phase_seconds", seconds, format=self.kind, phase=phase)
+
+class InstrumentedProxy:
+    """Bọc client/spreadsheet/worksheet của gspread để đo mọi lời gọi phương thức."""
+
+    def __init__(self, target, name=None):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_name", name or getattr(target, "title", type(target).__name__))
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if isinstance(value, (gspread.Spreadsheet, gspread.Worksheet)):
+            return InstrumentedProxy(value)
+        if attr.startswith("_") or not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            with remote_call(attr, self._name):
+                result = value(*args, **kwargs)
+            if isinstance(result, (gspread.Spreadsheet, gspread.Worksheet)):
+                return InstrumentedProxy(result)
+            if isinstance(result, list) and result and isinstance(result[0], gspread.Worksheet):
+                return [InstrumentedProxy(ws) for ws in result]
+            return result
+        return call
+
+    def __setattr__(self, attr, value):
+        setattr(self._target, attr, value)
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/ready":
+            # 200 khi warm-up trong tiến trình đã xong, 503 trong lúc đang làm nóng.
+            # Chỉ có sau phiên đầu tiên: probe lúc khởi động dùng lệnh warm-up (xem README)
+            state = warm_up()
+            ready = state is None or state.ready.is_set()
+            body = json.dumps({"ready": ready, "steps": state.results if state else {}}).encode("utf-8")
+            self.send_response(200 if ready else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics().to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@st.cache_resource
+def metrics_server():
+    """Mở endpoint /metrics nếu đặt AUDITNOTE_METRICS_PORT (một lần mỗi tiến trình)."""
+    port = os.environ.get("AUDITNOTE_METRICS_PORT")
+    if not port:
+        return None
+    server = http.server.ThreadingHTTPServer(
+        (os.environ.get("AUDITNOTE_METRICS_HOST", "127.0.0.1"), int(port)), _MetricsHandler
+    )
+    threading.Thread(target=server.serve_forever, name="auditnote-metrics", daemon=True).start()
+    return server
+
+# ------------ Profiling (tùy chọn) ------------
+# AUDITNOTE_PROFILE=cprofile|sample bật cho cả tiến trình; admin bật riêng cho phiên
+# của mình ở sidebar. Khi tắt, mỗi lần chạy chỉ tốn một lần kiểm tra cờ.
+PROFILE_MODES = ("cprofile", "sample")
+PROFILE_ENV = os.environ.get("AUDITNOTE_PROFILE", "").strip().lower()
+PROFILE_TOP = 15
+PROFILE_KEEP = 30  # số hồ sơ giữ lại, trong profile_log() và trong thư mục
+_profiling = threading.local()
+
+class StackSampler:
+    """Lấy mẫu stack của một luồng mỗi ``interval`` giây, gom thành folded stacks."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="auditnote-sampler", daemon=True)
+
+    @staticmethod
+    def _label(code):
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        """Định dạng của flamegraph.pl / speedscope / inferno: ``a;b;c số_mẫu``."""
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def top(self, n=PROFILE_TOP):
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return [
+            {"function": name, "self_s": round(own[name] * self.interval, 3),
+             "total_s": round(total[name] * self.interval, 3), "samples": own[name]}
+            for name, _ in own.most_common(n)
+        ]
+
+def cprofile_top(profile, n=PROFILE_TOP):
+    import pstats
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)[:n]
+    return [
+        {"function": f"{func} ({os.path.basename(path)}:{line})", "self_s": round(tt, 3),
+         "total_s": round(ct, 3), "calls": nc}
+        for (path, line, func), (cc, nc, tt, ct, callers) in rows
+    ]
+
+@st.cache_resource
+def profile_log():
+    """Các hồ sơ gần nhất của tiến trình (mới nhất ở cuối)."""
+    from collections import deque
+    return deque(maxlen=PROFILE_KEEP)
+
+def profile_dir():
+    path = os.environ.get("AUDITNOTE_PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "auditnote_profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def prune_profiles(keep=PROFILE_KEEP):
+    """Xóa các file hồ sơ cũ, chỉ giữ ``keep`` file mới nhất và các file profile_log() còn nhắc tới.
+
+    Tên file bắt đầu bằng thời điểm ghi nên thứ tự tên là thứ tự thời gian;
+    thư mục có thể dùng chung giữa các tiến trình (replica, lệnh report).
+    """
+    directory = profile_dir()
+    listed = {entry["path"] for entry in profile_log()}
+    names = sorted(name for name in os.listdir(directory) if name.endswith((".prof", ".folded")))
+    for name in names[:-keep] if keep else names:
+        path = os.path.join(directory, name)
+        if path not in listed:
+            try:
+                os.remove(path)
+            except OSError:  # tiến trình khác vừa xóa
+                pass
+
+def profiling_mode():
+    """Chế độ profiling của lần chạy này: biến môi trường, hoặc lựa chọn của admin trong phiên."""
+    if PROFILE_ENV in PROFILE_MODES:
+        return PROFILE_ENV
+    if script_run_ctx() is not None:
+        return st.session_state.get("profile_mode")
+    return None
+
+@contextmanager
+def profiled(label):
+    """Ghi hồ sơ của khối lệnh ra file (.prof hoặc .folded) nếu profiling đang bật."""
+    mode = profiling_mode()
+    if mode not in PROFILE_MODES or getattr(_profiling, "active", False):
+        yield
+        return
+    _profiling.active = True
+    if mode == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Python 3.12+: phiên khác đang giữ profiler duy nhất
+            mode = "sample"
+    if mode == "sample":
+        profiler = StackSampler(threading.get_ident())
+        profiler.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _profiling.active = False
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        if mode == "cprofile":
+            profiler.disable()
+            path = os.path.join(profile_dir(), f"{stamp}_{label}_{os.getpid()}.prof")
+            profiler.dump_stats(path)
+            top = cprofile_top(profiler)
+        else:
+            profiler.stop()
+            path = os.path.join(profile_dir(), f"{stamp}_{label}_{os.getpid()}.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.folded())
+            top = profiler.top()
+        profile_log().append({"label": label, "mode": mode, "seconds": round(seconds, 3),
+                              "path": path, "top": top, "when": stamp})
+        prune_profiles()
+
+def profile_calls(label):
+    """Decorator: mỗi lần gọi hàm là một hồ sơ riêng (trừ khi đã nằm trong hồ sơ của rerun)."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiling_mode():
+                return func(*args, **kwargs)
+            with profiled(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def service_credentials():
     if os.path.exists("credentials.json"):
-        creds = Credentials.from_service_account_file("credentials.json", scopes=SCOPE)
-    else:
-        creds = Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"], scopes=SCOPE
-        )
-    return gspread.authorize(creds)
+        return Credentials.from_service_account_file("credentials.json", scopes=SCOPE)
+    return Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"], scopes=SCOPE
+    )
+
+@st.cache_resource
+def gclient():
+    return InstrumentedProxy(gspread.authorize(service_credentials()), "client")
 
 def get_gdrive_service(_credentials):
     try:
-        service = build('drive', 'v3', credentials=_credentials)
+        service = google_drive.build('drive', 'v3', credentials=_credentials)
         return service
     except Exception as e:
         st.error(f"🔥 Lỗi kết nối Google Drive: {e}")
         return None
 
-def ensure_header(ws, header):
-    cur = [c.lower() for c in ws.row_values(1)]
+_drive_local = threading.local()
+
+def drive_service():
+    """Drive service của luồng hiện tại (httplib2 không an toàn khi dùng chung giữa các luồng)."""
+    service = getattr(_drive_local, "service", None)
+    if service is None:
+        service = _drive_local.service = google_drive.build('drive', 'v3', credentials=service_credentials())
+    return service
+
+def drive_folder_id():
+    return st.secrets["google_drive"]["folder_id"]
+
+def ensure_header(ws, header, current=None):
+    """Ghi lại dòng tiêu đề nếu khác ``header``; trả về True nếu đã sửa.
+
+    ``current`` là dòng tiêu đề đã đọc sẵn (bỏ qua một lần gọi row_values).
+    """
+    if current is None:
+        current = ws.row_values(1)
+    cur = [c.lower() for c in current]
     tgt = [h.lower() for h in header]
     if cur != tgt:
         ws.resize(rows=max(ws.row_count,1), cols=len(header))
-        ws.update(f"A1:{chr(64+len(header))}1", [header])
+        ws.update(f"A1:{col_letter(len(header))}1", [header])
+        return True
+    return False
+
+def backfill_note_ids(ws):
+    """Cấp id cho các dòng Notes chưa có (dữ liệu ghi trước khi có cột id)."""
+    id_col = col_letter(NOTE_ID_COL)
+    first_col, id_values = ws.batch_get(["A2:A", f"{id_col}2:{id_col}"])
+    ids = [r[0] if r else "" for r in id_values]
+    missing = [
+        {"range": f"{id_col}{i + 2}", "values": [[new_note_id()]]}
+        for i in range(len(first_col))
+        if i >= len(ids) or not ids[i]
+    ]
+    if missing:
+        ws.batch_update(missing)
+
+def migrate_legacy_table(cli, ws, title, legacy):
+    """Chép dữ liệu từ workbook cũ (``legacy``/``title``) sang worksheet mới.
+
+    Workbook cũ được giữ nguyên để có thể đối chiếu hoặc quay lại.
+    """
+    try:
+        values = cli.open(legacy).worksheet(title).get_all_values()
+    except (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound):
+        return 0
+    if not values:
+        return 0
+    width = max(len(r) for r in values)
+    ws.resize(rows=max(len(values), 1), cols=width)
+    ws.update(f"A1:{gspread.utils.rowcol_to_a1(len(values), width)}", values)
+    return len(values) - 1
 
 @st.cache_resource(ttl=3600)
 def gws():
     cli = gclient()
-    
-    # Auditors_DB
-    try: adb = cli.open("Auditors_DB")
-    except gspread.exceptions.SpreadsheetNotFound:
-        adb = cli.create("Auditors_DB")
-        adb.add_worksheet("Auditors", rows=10, cols=5)
-    
-    auditors_ws = adb.worksheet("Auditors")
-    ensure_header(auditors_ws, [
-        "fullname", "position", "email", "password", "last_login"
-    ])
-    
-    # Default auditor nếu cần
-    if len(auditors_ws.get_all_values()) == 1:
-        pw0 = hashlib.sha256("auditor123".encode()).hexdigest()
-        auditors_ws.append_row([
-            "Đánh giá viên", "Trưởng đoàn", "auditor@example.com", pw0, ""
-        ])
-    
-    # Audit_Notes
-    try: 
-        notes_wb = cli.open("Audit_Notes")
-        notes_ws = notes_wb.worksheet("Notes")
-    except gspread.exceptions.SpreadsheetNotFound:
-        notes_wb = cli.create("Audit_Notes")
-        notes_ws = notes_wb.sheet1
-        notes_ws.update_title("Notes")
-        ensure_header(notes_ws, [
-            "company", "address", "department", "person", "audit_time",
-            "frame_id", "panel_id", "clause", "clause_name", "requirements",
-            "evidence", "image_url", "result", "auditor", "timestamp"
-        ])
-    except gspread.exceptions.WorksheetNotFound:
-        notes_wb = cli.open("Audit_Notes")
-        notes_ws = notes_wb.add_worksheet("Notes", rows=1, cols=15)
-        ensure_header(notes_ws, [
-            "company", "address", "department", "person", "audit_time",
-            "frame_id", "panel_id", "clause", "clause_name", "requirements",
-            "evidence", "image_url", "result", "auditor", "timestamp"
-        ])
-    
-    # Audit_Participants
-    try: 
-        part_wb = cli.open("Audit_Participants") 
-        part_ws = part_wb.worksheet("Participants")
+
+    try:
+        db = cli.open(DB_NAME)
+        spare = None
     except gspread.exceptions.SpreadsheetNotFound:
-        part_wb = cli.create("Audit_Participants")
-        part_ws = part_wb.sheet1
-        part_ws.update_title("Participants")
-        ensure_header(part_ws, [
-            "company", "frame_id", "fullname", "position", "role"
-        ])
-    except gspread.exceptions.WorksheetNotFound:
-        part_wb = cli.open("Audit_Participants")
-        part_ws = part_wb.add_worksheet("Participants", rows=1, cols=5)
-        ensure_header(part_ws, [
-            "company", "frame_id", "fullname", "position", "role"
-        ])
-    
-    return {
-        "auditors": auditors_ws,
-        "notes_wb": notes_wb,
-        "notes": notes_ws,
-        "participants": part_ws
-    }
+        db = cli.create(DB_NAME)
+        spare = db.sheet1  # worksheet mặc định, dùng lại cho bảng đầu tiên
+    existing = {ws.title: ws for ws in db.worksheets()}
+
+    sheets = {}
+    for key, (title, header, legacy) in TABLES.items():
+        ws = existing.get(title)
+        if ws is None:
+            if spare is not None:
+                ws, spare = spare, None
+                ws.update_title(title)
+            else:
+                ws = db.add_worksheet(title, rows=1, cols=len(header))
+            # Lần đầu tạo bảng: chuyển dữ liệu từ workbook riêng lẻ trước đây
+            if legacy:
+                migrate_legacy_table(cli, ws, title, legacy)
+        sheets[key] = ws
+
+    # Kiểm tra tiêu đề (và dòng dữ liệu đầu) của mọi bảng trong một round trip
+    heads = db.values_batch_get([f"'{TABLES[k][0]}'!1:2" for k in sheets])["valueRanges"]
+    for key, vr in zip(sheets, heads):
+        rows = vr.get("values", [])
+        ws, header = sheets[key], TABLES[key][1]
+        # Sheet cũ chưa có cột id: thêm cột và cấp id cho các dòng hiện có
+        if ensure_header(ws, header, rows[0] if rows else []) and key == "notes" and len(rows) > 1:
+            backfill_note_ids(ws)
+        # Default auditor nếu cần
+        if key == "auditors" and len(rows) <= 1:
+            pw0 = hashlib.sha256("auditor123".encode()).hexdigest()
+            ws.append_row([
+                "Đánh giá viên", "Trưởng đoàn", "auditor@example.com", pw0, ""
+            ])
+
+    return {"db": db, "notes_wb": db, **sheets}
+
+# ------------ DataFrame Helpers ------------
+def _frame(values):
+    """DataFrame từ các dòng giá trị (dòng đầu là tiêu đề); dòng thiếu ô được bù ""."""
+    if len(values) <= 1:
+        cols = [c.lower() for c in values[0]] if values else []
+        return pd.DataFrame(columns=cols)
+    cols = [c.lower() for c in values[0]]
+    width = len(cols)
+    rows = [r[:width] + [""] * (width - len(r)) for r in values[1:]]
+    return pd.DataFrame(rows, columns=cols)
+
+def _df(ws):
+    return _frame(ws.get_all_values())
+
+# Kiểu dữ liệu khi nạp: cột lặp lại nhiều giá trị -> category; thời điểm ghi
+# nhận -> datetime64 (chỉ khi mọi ô đều parse được); chữ ngắn còn lại được
+# intern để các giá trị trùng dùng chung một đối tượng str.
+CATEGORY_COLUMNS = {
+    "company", "address", "department", "person", "audit_time", "frame_id",
+    "panel_id", "clause", "clause_name", "result", "auditor", "role", "position",
+}
+DATETIME_COLUMNS = {"timestamp": "%Y-%m-%d %H:%M:%S"}
+UNIQUE_COLUMNS = {"id", "password", "image_url"} | set(NOTE_TEXT_COLUMNS)
+
+def compact_frame(df):
+    """Áp dụng CATEGORY_COLUMNS/DATETIME_COLUMNS lên DataFrame vừa đọc từ sheet."""
+    for name in df.columns:
+        col = df[name]
+        if name in CATEGORY_COLUMNS:
+            df[name] = col.astype("category")
+        elif name in DATETIME_COLUMNS:
+            parsed = pd.to_datetime(col, format=DATETIME_COLUMNS[name], errors="coerce")
+            if not parsed.isna().any():
+                df[name] = parsed
+        elif name not in UNIQUE_COLUMNS:
+            df[name] = col.map(sys.intern)
+    return df
+
+def column_runs(header, columns):
+    """Các đoạn cột liên tiếp [(c0, c1)] (đánh số từ 1) phủ ``columns``."""
+    runs = []
+    for col in sorted(header.index(c) + 1 for c in columns):
+        if runs and runs[-1][1] == col - 1:
+            runs[-1][1] = col
+        else:
+            runs.append([col, col])
+    return runs
+
+def column_ranges(key, columns, first_row=1, last_row=None):
+    """Vùng A1 (kèm tên worksheet) của ``columns`` trong bảng ``key``, từng đoạn liên tiếp."""
+    title, header, _ = TABLES[key]
+    end = last_row or ""
+    return [
+        f"'{title}'!{col_letter(c0)}{first_row}:{col_letter(c1)}{end}"
+        for c0, c1 in column_runs(header, columns)
+    ]
+
+def join_column_ranges(key, columns, value_ranges):
+    """Ghép các vùng cột đọc theo ``column_ranges`` thành các dòng đầy đủ bề rộng."""
+    runs = column_runs(TABLES[key][1], columns)
+    blocks = [vr.get("values", []) for vr in value_ranges]
+    n_rows = max((len(b) for b in blocks), default=0)
+    rows = [[] for _ in range(n_rows)]
+    for (c0, c1), block in zip(runs, blocks):
+        width = c1 - c0 + 1
+        for i in range(n_rows):
+            part = block[i][:width] if i < len(block) else []
+            rows[i].extend(part + [""] * (width - len(part)))
+    return rows
+
+TABLE_COLUMNS = {
+    "auditors": AUDITORS_HEADER,
+    "notes": [c for c in NOTES_HEADER if c not in NOTE_TEXT_COLUMNS],
+    "participants": PARTICIPANTS_HEADER,
+}
+
+def read_columns(*projections):
+    """Đọc các bảng chỉ với những cột được yêu cầu, trong một lời gọi values_batch_get.
+
+    ``projections`` là các cặp (key, columns); trả về list DataFrame tương ứng.
+    """
+    ranges, spans = [], []
+    for key, columns in projections:
+        table_ranges = column_ranges(key, columns)
+        spans.append((key, columns, len(ranges), len(ranges) + len(table_ranges)))
+        ranges.extend(table_ranges)
+    value_ranges = gws()["db"].values_batch_get(ranges)["valueRanges"]
+    return [
+        _frame(join_column_ranges(key, columns, value_ranges[a:b]))
+        for key, columns, a, b in spans
+    ]
+
+# ------------ Cache dùng chung giữa các tiến trình ------------
+# Sau khoảng này ảnh chụp được kiểm tra lại bằng revision của spreadsheet
+# (một lời gọi metadata); chỉ tải lại khi revision đã đổi.
+SNAPSHOT_TTL = 60
+
+# Ảnh chụp chỉ được chứa các kiểu này: DataFrame đi qua parquet, Timestamp và
+# số numpy được đổi sang giá trị thường, phần còn lại qua pickle với danh sách
+# lớp cho phép, nên một file cache bị sửa không thể gọi hàm tùy ý khi giải nén.
+SNAPSHOT_BUILTINS = {"dict", "list", "set", "frozenset", "tuple", "bytearray", "int", "float", "str"}
+SNAPSHOT_COLLECTIONS = {"defaultdict", "Counter", "OrderedDict"}
+SNAPSHOT_CLASSES = {"NotesSearchIndex", "ResultAggregates", "NoteRowIndex"}
+
+class _SnapshotPickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        if isinstance(obj, pd.DataFrame):
+            buffer = io.BytesIO()
+            obj.to_parquet(buffer)
+            return ("parquet", buffer.getvalue())
+        if obj is pd.NaT:
+            return ("nat", None)
+        if isinstance(obj, pd.Timestamp):
+            return ("timestamp", obj.isoformat())
+        if isinstance(obj, np.generic):
+            return ("scalar", obj.item())
+        return None
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        kind, data = pid
+        if kind == "parquet":
+            return pd.read_parquet(io.BytesIO(data))
+        if kind == "nat":
+            return pd.NaT
+        if kind == "timestamp":
+            return pd.Timestamp(data)
+        if kind == "scalar":
+            return data
+        raise pickle.UnpicklingError(f"ảnh chụp không hợp lệ: {kind}")
+
+    def find_class(self, module, name):
+        if module == "builtins" and name in SNAPSHOT_BUILTINS:
+            return getattr(builtins, name)
+        if module == "collections" and name in SNAPSHOT_COLLECTIONS:
+            return getattr(collections, name)
+        if module == __name__ and name in SNAPSHOT_CLASSES:
+            return globals()[name]
+        raise pickle.UnpicklingError(f"ảnh chụp chứa kiểu không cho phép: {module}.{name}")
+
+def encode_snapshot(value):
+    buffer = io.BytesIO()
+    _SnapshotPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(value)
+    return buffer.getvalue()
+
+def decode_snapshot(payload):
+    return _SnapshotUnpickler(io.BytesIO(payload)).load()
+
+def private_path_error(path):
+    """Lý do ``path`` (nếu đã có) không an toàn để đọc ảnh chụp, hoặc None.
+
+    File phải thuộc người dùng của tiến trình và không ai khác ghi được.
+    """
+    if not hasattr(os, "getuid") or not os.path.exists(path):
+        return None
+    info = os.stat(path)
+    if info.st_uid != os.getuid():
+        return "không thuộc người dùng của tiến trình"
+    if info.st_mode & 0o022:
+        return "người dùng khác ghi được"
+    return None
+
+def snapshot_path():
+    """File SQLite của cache dùng chung: AUDITNOTE_CACHE_DB, mặc định trong thư mục cache riêng (0700)."""
+    path = os.environ.get("AUDITNOTE_CACHE_DB")
+    if path:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    directory = os.path.join(base, "auditnote")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return os.path.join(directory, "cache.sqlite")
+
+class SnapshotStore:
+    """Ảnh chụp dữ liệu dùng chung giữa các replica trên cùng máy (SQLite, WAL).
+
+    Mỗi khóa có một số phiên bản; ghi dữ liệu thì ``invalidate`` tăng phiên
+    bản và mọi tiến trình bỏ ảnh chụp cũ ở lần đọc kế tiếp. Trong tiến trình,
+    giá trị đã giải nén được giữ lại tới khi phiên bản đổi hoặc quá ``ttl``.
+    Ảnh chụp quá ``ttl`` mà revision nguồn (vd. modifiedTime) không đổi thì
+    được gia hạn thay vì tải lại. Khi nhiều tiến trình cùng lỡ cache, chỉ tiến
+    trình giữ lease tải dữ liệu, các tiến trình khác chờ ảnh chụp của nó.
+    """
+
+    LEASE_SECONDS = 30
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS snapshots (
+            key TEXT PRIMARY KEY, version INTEGER NOT NULL, fetched_at REAL NOT NULL, payload BLOB NOT NULL,
+            revision TEXT
+        );
+        CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL NOT NULL);
+    """
+
+    def __init__(self, path, namespace=""):
+        self._lock = threading.RLock()
+        self._local = {}
+        # Khóa trên SQLite gắn với spreadsheet: hai triển khai chung máy không đọc dữ liệu của nhau
+        self.namespace = namespace
+        try:
+            problem = None if path == ":memory:" else private_path_error(path)
+            if problem:
+                raise sqlite3.Error(f"file {problem}")
+            self._db = self._connect(path)
+            if path != ":memory:" and hasattr(os, "chmod"):
+                os.chmod(path, 0o600)
+            self.path = path
+        except (sqlite3.Error, OSError) as e:
+            # Không ghi được file (thư mục chỉ đọc...): vẫn chạy, chỉ không chia sẻ
+            st.warning(f"Không mở được cache dùng chung {path} ({e}); chỉ cache trong tiến trình.")
+            self._db = self._connect(":memory:")
+            self.path = ":memory:"
+
+    def _connect(self, path):
+        db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(self.SCHEMA)
+        columns = [row[1] for row in db.execute("PRAGMA table_info(snapshots)")]
+        if "revision" not in columns:  # file tạo bởi bản trước chưa có cột revision
+            db.execute("ALTER TABLE snapshots ADD COLUMN revision TEXT")
+        return db
+
+    def _sql(self, query, args=()):
+        with self._lock:
+            return self._db.execute(query, args).fetchall()
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}" if self.namespace else key
+
+    def version(self, key):
+        rows = self._sql("SELECT version FROM versions WHERE key = ?", (self._key(key),))
+        return rows[0][0] if rows else 0
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self._sql(
+                "INSERT INTO versions (key, version) VALUES (?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET version = version + 1", (self._key(key),)
+            )
+            with self._lock:
+                self._local.pop(key, None)
+
+    def _lookup(self, key):
+        """(fetched_at, revision, value) của ảnh chụp thuộc phiên bản hiện tại, hoặc None."""
+        version = self.version(key)
+        with self._lock:
+            local = self._local.get(key)
+        rows = self._sql("SELECT fetched_at, revision FROM snapshots WHERE key = ? AND version = ?",
+                         (self._key(key), version))
+        if local and local[0] == version:
+            # Tiến trình khác có thể vừa gia hạn ảnh chụp này
+            fetched_at = max(local[1], rows[0][0]) if rows else local[1]
+            return fetched_at, local[2], local[3]
+        if not rows:
+            return None
+        payload = self._sql("SELECT payload FROM snapshots WHERE key = ? AND version = ?",
+                            (self._key(key), version))
+        if not payload:
+            return None
+        try:
+            value = decode_snapshot(payload[0][0])
+        except Exception:  # ảnh chụp của bản cũ (pickle thường) hoặc hỏng: coi như lỡ cache
+            return None
+        with self._lock:
+            self._local[key] = (version, rows[0][0], rows[0][1], value)
+        return rows[0][0], rows[0][1], value
+
+    def peek(self, key, ttl=SNAPSHOT_TTL):
+        """Giá trị còn hạn của ``key`` (trong tiến trình hoặc từ SQLite), hoặc None."""
+        hit = self._lookup(key)
+        if hit and time.time() - hit[0] < ttl:
+            return hit[2]
+        return None
+
+    def put(self, key, value, version=None, fetched_at=None, revision=None):
+        """Lưu ảnh chụp cho phiên bản ``version`` (mặc định: phiên bản hiện tại)."""
+        version = self.version(key) if version is None else version
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        payload = encode_snapshot(value)
+        self._sql(
+            "INSERT OR REPLACE INTO snapshots (key, version, fetched_at, payload, revision) VALUES (?, ?, ?, ?, ?)",
+            (self._key(key), version, fetched_at, payload, revision),
+        )
+        with self._lock:
+            self._local[key] = (version, fetched_at, revision, value)
+
+    def _renew(self, key):
+        now = time.time()
+        version = self.version(key)
+        self._sql("UPDATE snapshots SET fetched_at = ? WHERE key = ? AND version = ?",
+                  (now, self._key(key), version))
+        with self._lock:
+            local = self._local.get(key)
+            if local and local[0] == version:
+                self._local[key] = (version, now) + local[2:]
+
+    def _claim(self, key):
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO leases (key, expires) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires = excluded.expires WHERE leases.expires < ?",
+                (self._key(key), now + self.LEASE_SECONDS, now),
+            )
+            return cur.rowcount > 0
+
+    def _release(self, key):
+        self._sql("DELETE FROM leases WHERE key = ?", (self._key(key),))
+
+    def _leased(self, key):
+        return bool(self._sql("SELECT 1 FROM leases WHERE key = ? AND expires >= ?", (self._key(key), time.time())))
+
+    def _wait(self, key, ttl):
+        """Chờ ảnh chụp của tiến trình giữ lease; None khi nên tự tải.
+
+        Dừng chờ ngay khi lease được trả (tải xong nhưng ảnh chụp đã cũ vì có
+        ghi chen giữa, hoặc tải lỗi) hay phiên bản đổi: ảnh chụp đang tải sẽ
+        không bao giờ khớp phiên bản hiện tại.
+        """
+        version = self.version(key)
+        deadline = time.time() + self.LEASE_SECONDS
+        while time.time() < deadline:
+            time.sleep(0.1)
+            value = self.peek(key, ttl)
+            if value is not None:
+                return value
+            if not self._leased(key) or self.version(key) != version:
+                return None
+        return None
+
+    def get(self, key, fetch, ttl=SNAPSHOT_TTL, revision=None):
+        """Giá trị của ``key``; gọi ``fetch()`` khi không có ảnh chụp hợp lệ.
+
+        ``revision`` (tùy chọn) trả về nhãn phiên bản rẻ của nguồn dữ liệu; ảnh
+        chụp quá hạn nhưng cùng nhãn thì được gia hạn, không tải lại.
+        """
+        hit = self._lookup(key)
+        if hit and time.time() - hit[0] < ttl:
+            return hit[2]
+        current = None
+        if revision is not None:
+            current = revision()
+            if hit and hit[1] is not None and hit[1] == current:
+                self._renew(key)
+                return hit[2]
+        while not self._claim(key):
+            # Tiến trình khác đang tải: chờ ảnh chụp của nó thay vì tải lần nữa
+            value = self._wait(key, ttl)
+            if value is not None:
+                return value
+        version = self.version(key)  # đọc trước khi tải: ghi chen giữa sẽ làm ảnh chụp này cũ
+        fetched_at = time.time()
+        try:
+            value = fetch()
+        finally:
+            self._release(key)
+        # revision đọc trước khi tải: thay đổi trong lúc tải sẽ bị phát hiện ở lần kiểm tra sau
+        self.put(key, value, version, fetched_at, current)
+        return value
+
+@st.cache_resource
+def snapshots():
+    return SnapshotStore(snapshot_path(), namespace=gws()["db"].id)
+
+def sheet_revision():
+    """modifiedTime của AuditNote_DB trên Drive: một lời gọi metadata, không tải dữ liệu."""
+    return gws()["db"].get_lastUpdateTime()
+
+def load_tables():
+    """Đọc Auditors/Notes/Participants trong một lời gọi values_batch_get.
+
+    Notes chỉ gồm các cột nhẹ (TABLE_COLUMNS); văn bản dài lấy qua note_texts().
+    Kết quả nằm trong SnapshotStore, dùng chung cho mọi phiên và mọi replica;
+    các hàm df_* trả về bản sao nông (copy-on-write) nên người gọi không làm
+    hỏng cache.
+    """
+    def fetch():
+        frames = read_columns(*TABLE_COLUMNS.items())
+        return {key: stamp_snapshot(compact_frame(df)) for key, df in zip(TABLE_COLUMNS, frames)}
+    return snapshots().get("tables", fetch, revision=sheet_revision)
+
+def stamp_snapshot(df):
+    """Gắn nhãn lần tải (``attrs["snapshot"]``, giữ qua copy) để NotesIndex bỏ qua ảnh chụp đã đối chiếu."""
+    df.attrs["snapshot"] = uuid.uuid4().hex
+    return df
+
+def load_notes_full():
+    """Bảng Notes đủ mọi cột (chỉ dùng để dựng chỉ mục tìm kiếm toàn văn)."""
+    fetch = lambda: stamp_snapshot(compact_frame(read_columns(("notes", NOTES_HEADER))[0]))
+    return snapshots().get("notes_full", fetch, revision=sheet_revision)
+
+def df_auditors():   return load_tables()["auditors"].copy(deep=False)
+def df_notes():      return load_tables()["notes"].copy(deep=False)
+def df_participants(): return load_tables()["participants"].copy(deep=False)
+
+def clear_tables():
+    snapshots().invalidate("tables", "notes_full")
+
+# Ghi vào bảng nào cũng làm mới cả ba: lần đọc sau vẫn chỉ là một round trip
+df_auditors.clear = df_notes.clear = df_participants.clear = clear_tables
+
+# ------------ Utilities ------------
+hash_pw = lambda x: hashlib.sha256(x.encode()).hexdigest()
+verify_pw = lambda s, p: s.strip() == hash_pw(p.strip())
+sheet_name = lambda em: re.sub(r'[^A-Za-z0-9_-]', '_', em)[:100]
+col_letter = lambda col: gspread.utils.rowcol_to_a1(1, col)[:-1]
+
+# ------------ Chỉ mục dẫn xuất từ Notes: tìm kiếm, thống kê ------------
+SEARCH_FIELDS = {
+    "requirements": 1.0,
+    "evidence": 1.0,
+    "clause_name": 2.0,
+    "department": 1.5,
+    "person": 1.5
+}
+_TOKEN_RE = re.compile(r"\w+")
+_COMBINING_RE = re.compile("[\u0300-\u036f]")
+
+def fold_diacritics(text):
+    """Chữ thường, bỏ dấu tiếng Việt: "Đánh giá" -> "danh gia"."""
+    text = unicodedata.normalize("NFD", str(text).lower())
+    return _COMBINING_RE.sub("", text).replace("đ", "d")
+
+def search_tokens(text):
+    return _TOKEN_RE.findall(fold_diacritics(text))
+
+class NotesIndex(abc.ABC):
+    """Cấu trúc dẫn xuất từ bảng Notes, cập nhật tăng dần theo id ghi chép.
+
+    ``sync`` đối chiếu ảnh chụp Notes với các id và chữ ký nội dung đã biết:
+    dòng mới được thêm, dòng đã mất được bỏ, dòng bị sửa được cập nhật (kể cả
+    thay đổi từ replica khác hay trên giao diện Sheets). Cùng một ảnh chụp
+    (``attrs["snapshot"]``) thì không phải đối chiếu lại. ``append``,
+    ``remove`` và ``replace`` cập nhật ngay theo thao tác ghi của chính tiến
+    trình, nên không phải đợi cache ``df_notes`` hết hạn; ảnh chụp cũ chưa có
+    các thay đổi đó không làm mất chúng.
+    """
+
+    version = None  # phiên bản Notes của ảnh chụp dùng chung (xem search_index)
+    ORDERED = False  # chỉ mục phụ thuộc thứ tự dòng trên sheet
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def adopt(self, other):
+        """Nhận trạng thái của một chỉ mục đã dựng sẵn (ảnh chụp dùng chung)."""
+        with self._lock:
+            self.__dict__.update(other.__getstate__())
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.synced = False
+        self._clear()
+
+    @abc.abstractmethod
+    def _add(self, note_id, row):
+        """Thêm một dòng vào cấu trúc dẫn xuất."""
+
+    @abc.abstractmethod
+    def _remove(self, note_id):
+        """Bỏ một dòng đã thêm."""
+
+    @abc.abstractmethod
+    def _reset(self):
+        """Khởi tạo cấu trúc dẫn xuất rỗng."""
+
+    def _replace(self, note_id, row):
+        self._remove(note_id)
+        self._add(note_id, row)
+
+    def _clear(self):
+        self.source = None
+        # id -> chữ ký nội dung theo thứ tự thêm; None: dòng do tiến trình này ghi
+        self.signatures = {}
+        self.pending = set()
+        self.deleted = set()
+        self._reset()
+
+    @staticmethod
+    def _signature(row):
+        return hash(tuple(row.values()))
+
+    def _in_order(self, order):
+        """Các id đã biết giữ nguyên thứ tự và mọi id mới nằm sau chúng."""
+        signatures, seen_new = self.signatures, False
+        for note_id in order:
+            if note_id in signatures:
+                if seen_new:
+                    return False
+            elif note_id not in self.deleted:
+                seen_new = True
+        present = set(order)
+        return [i for i in order if i in signatures] == [i for i in signatures if i in present]
+
+    def sync(self, notes_df, rebuild=False):
+        """Đồng bộ với DataFrame Notes; trả về True nếu chỉ mục thay đổi."""
+        source = notes_df.attrs.get("snapshot")
+        with self._lock:
+            if rebuild:
+                self._clear()
+            elif source is not None and source == self.source:
+                self.synced = True
+                return False
+            current = {}
+            for pos, row in enumerate(notes_df.to_dict("records")):
+                current[note_id_of(row, pos)] = row
+            # Dòng vừa xóa ở tiến trình này: bỏ qua tới khi ảnh chụp không còn nó
+            self.deleted &= current.keys()
+            changed = False
+            if self.ORDERED and not self._in_order(current):
+                pending = self.pending
+                self._clear()
+                self.pending = pending
+                changed = True
+            for note_id in [i for i in self.signatures if i not in current and i not in self.pending]:
+                del self.signatures[note_id]
+                self._remove(note_id)
+                changed = True
+            for note_id, row in current.items():
+                if note_id in self.deleted:
+                    continue
+                signature = self._signature(row)
+                if note_id not in self.signatures:
+                    self._add(note_id, row)
+                    changed = True
+                elif self.signatures[note_id] not in (None, signature):
+                    self._replace(note_id, row)
+                    changed = True
+                self.signatures[note_id] = signature
+                self.pending.discard(note_id)
+            self.source = source
+            self.synced = True
+            return changed
+
+    def append(self, row):
+        """Cập nhật với một dòng vừa được append vào sheet."""
+        with self._lock:
+            if not self.synced or row["id"] in self.signatures:
+                return  # lần sync đầu tiên sẽ đọc dòng này từ sheet
+            self.signatures[row["id"]] = None
+            self.pending.add(row["id"])
+            self._add(row["id"], row)
+
+    def remove(self, note_id):
+        """Cập nhật khi một dòng vừa bị xóa khỏi sheet."""
+        with self._lock:
+            if note_id not in self.signatures:
+                return
+            del self.signatures[note_id]
+            self._remove(note_id)
+            if note_id in self.pending:
+                self.pending.discard(note_id)
+            else:
+                self.deleted.add(note_id)
+
+    def replace(self, row):
+        """Cập nhật khi nội dung một dòng vừa được sửa trên sheet."""
+        with self._lock:
+            if row["id"] in self.signatures:
+                self._replace(row["id"], row)
+                self.signatures[row["id"]] = None
+
+class NotesSearchIndex(NotesIndex):
+    """Chỉ mục ngược (BM25) trên các cột văn bản của bảng Notes."""
+
+    k1 = 1.2
+    b = 0.75
+
+    def _reset(self):
+        self.postings = defaultdict(dict)
+        self.doc_len = {}
+        self.docs = {}
+        self.total_len = 0.0
+
+    @staticmethod
+    def _weights(row):
+        weights = defaultdict(float)
+        for field, weight in SEARCH_FIELDS.items():
+            for token in search_tokens(row.get(field, "")):
+                weights[token] += weight
+        return weights
+
+    def _add(self, doc_id, row):
+        weights = self._weights(row)
+        for token, tf in weights.items():
+            self.postings[token][doc_id] = tf
+        length = sum(weights.values())
+        self.doc_len[doc_id] = length
+        self.total_len += length
+        self.docs[doc_id] = row
+
+    def _remove(self, doc_id):
+        for token in self._weights(self.docs.pop(doc_id)):
+            postings = self.postings[token]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[token]
+        self.total_len -= self.doc_len.pop(doc_id)
+
+    def doc(self, doc_id):
+        """Bản sao dòng đã lập chỉ mục của ``doc_id`` (đọc dưới khóa), hoặc None."""
+        with self._lock:
+            row = self.docs.get(doc_id)
+            return None if row is None else dict(row)
+
+    def search(self, query, limit=20, company=None):
+        """Trả về [(score, row)] xếp theo số từ khớp rồi điểm BM25."""
+        terms = set(search_tokens(query))
+        if not terms:
+            return []
+        with self._lock:
+            n_docs = len(self.doc_len)
+            if not n_docs:
+                return []
+            avg_len = self.total_len / n_docs or 1.0
+            base, per_len = self.k1 * (1 - self.b), self.k1 * self.b / avg_len
+            doc_len = self.doc_len
+            scores = defaultdict(float)
+            matched = defaultdict(int)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                gain = idf * (self.k1 + 1)
+                for doc_id, tf in postings.items():
+                    scores[doc_id] += gain * tf / (tf + base + per_len * doc_len[doc_id])
+                    matched[doc_id] += 1
+            if company is not None:
+                scores = {d: s for d, s in scores.items() if self.docs[d].get("company") == company}
+            best = heapq.nlargest(limit, scores, key=lambda d: (matched[d], scores[d]))
+            return [(scores[d], self.docs[d]) for d in best]
+
+class ResultAggregates(NotesIndex):
+    """Số NCA/NCB/PI/CM theo (company, frame_id, panel_id, clause).
+
+    Mỗi dòng cập nhật bộ đếm của cả bốn tiền tố khóa, nên thêm/xóa một mục là
+    O(1) và đọc thống kê của công ty, khung hay panel chỉ là một lần tra dict.
+    """
+
+    KEY_FIELDS = ("company", "frame_id", "panel_id", "clause")
+
+    def _reset(self):
+        self.counts = defaultdict(Counter)
+        self.entries = {}
+
+    def _update(self, key, result, delta):
+        for depth in range(1, len(key) + 1):
+            self.counts[key[:depth]][result] += delta
+
+    def _add(self, note_id, row):
+        key = tuple(str(row.get(f, "")) for f in self.KEY_FIELDS)
+        self.entries[note_id] = (key, row.get("result"))
+        self._update(key, row.get("result"), 1)
+
+    def _remove(self, note_id):
+        key, result = self.entries.pop(note_id)
+        self._update(key, result, -1)
+
+    def counts_for(self, company, frame_id=None, panel_id=None, clause=None):
+        """{"NCA": n, "NCB": n, "PI": n, "CM": n} cho tiền tố khóa đã cho."""
+        key = []
+        for part in (company, frame_id, panel_id, clause):
+            if part is None:
+                break
+            key.append(str(part))
+        with self._lock:
+            counter = self.counts.get(tuple(key), {})
+            return {r: counter.get(r, 0) for r in AUDIT_RESULTS}
+
+class NoteRowIndex(NotesIndex):
+    """Ánh xạ id ghi chép -> số dòng trên sheet, đúng sau mọi append/xóa.
+
+    Mỗi id giữ một "ô" cố định theo thứ tự trên sheet; cây Fenwick đếm số ô
+    còn sống, nên số dòng = 1 (tiêu đề) + số ô sống tính đến ô của id. Thêm,
+    xóa và tra cứu đều O(log n), không phải dịch lại chỉ mục khi xóa dòng.
+    """
+
+    ORDERED = True
+
+    def _reset(self):
+        self.slots = {}
+        self.live = bytearray()
+        self.tree = [0]
+
+    def _prefix(self, i):
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _add(self, note_id, row):
+        i = len(self.live) + 1
+        self.slots[note_id] = i - 1
+        self.live.append(1)
+        # Nút Fenwick mới phủ đoạn (i - lowbit(i), i]
+        self.tree.append(1 + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+
+    def _remove(self, note_id):
+        slot = self.slots.pop(note_id)
+        self.live[slot] = 0
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] -= 1
+            i += i & -i
+
+    def _replace(self, note_id, row):
+        pass  # sửa nội dung không đổi vị trí dòng
+
+    def sheet_row(self, note_id):
+        with self._lock:
+            slot = self.slots.get(note_id)
+            return None if slot is None else 1 + self._prefix(slot + 1)
+
+@st.cache_resource
+def notes_search_index():
+    return NotesSearchIndex()
+
+@st.cache_resource
+def result_aggregates():
+    return ResultAggregates()
+
+@st.cache_resource
+def note_row_index():
+    return NoteRowIndex()
+
+def note_indexes():
+    return (notes_search_index(), result_aggregates(), note_row_index())
+
+def sync_note_indexes(notes_df, rebuild=False):
+    """Đồng bộ chỉ mục thống kê/vị trí với bảng Notes (cột nhẹ) vừa đọc.
+
+    Chỉ mục tìm kiếm cần văn bản dài nên đồng bộ riêng qua search_index();
+    khi dựng lại, nó chỉ được dựng lại nếu đã từng được dùng.
+    """
+    result_aggregates().sync(notes_df, rebuild)
+    note_row_index().sync(notes_df, rebuild)
+    if rebuild and notes_search_index().synced:
+        notes_search_index().sync(load_notes_full(), rebuild=True)
+
+def search_index():
+    """Chỉ mục tìm kiếm đã đồng bộ (lần đầu tải toàn bộ văn bản của Notes)."""
+    index = notes_search_index()
+    store = snapshots()
+    if not index.synced:
+        # Replica khác đã dựng chỉ mục trên cùng phiên bản Notes thì dùng lại
+        shared = store.peek("search_index")
+        if shared is not None and shared.version == store.version("notes_full"):
+            index.adopt(shared)
+    version = store.version("notes_full")
+    if index.sync(load_notes_full()) and not index.pending:
+        index.version = version
+        store.put("search_index", index)
+    return index
+
+def append_to_note_indexes(row):
+    for index in note_indexes():
+        index.append(row)
+    note_text_cache().put(row["id"], row)
+
+# ------------ Văn bản dài của ghi chép (tải lười) ------------
+class NoteTextCache:
+    """requirements/evidence theo id ghi chép, giới hạn số mục và thời gian sống."""
+
+    def __init__(self, maxsize=5000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, note_id):
+        with self._lock:
+            hit = self._items.get(note_id)
+            if hit is None or time.monotonic() - hit[0] > self.ttl:
+                return None
+            self._items.move_to_end(note_id)
+            return hit[1]
+
+    def put(self, note_id, row):
+        texts = {c: row.get(c, "") for c in NOTE_TEXT_COLUMNS}
+        with self._lock:
+            self._items[note_id] = (time.monotonic(), texts)
+            self._items.move_to_end(note_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, note_id):
+        with self._lock:
+            self._items.pop(note_id, None)
+
+@st.cache_resource
+def note_text_cache():
+    return NoteTextCache()
+
+def _row_spans(rows):
+    """Gộp các số dòng thành các đoạn liên tiếp [(r0, r1)]."""
+    spans = []
+    for row in sorted(set(rows)):
+        if spans and spans[-1][1] == row - 1:
+            spans[-1][1] = row
+        else:
+            spans.append([row, row])
+    return spans
+
+def _fetch_note_texts(ids, spans=None):
+    """Đọc văn bản dài (kèm cột id để đối chiếu) của các đoạn dòng, một round trip."""
+    text_and_id = list(NOTE_TEXT_COLUMNS) + ["id"]
+    n_runs = len(column_runs(NOTES_HEADER, text_and_id))
+    ranges = []
+    for r0, r1 in spans or [(2, None)]:
+        ranges.extend(column_ranges("notes", text_and_id, r0, r1))
+    value_ranges = gws()["db"].values_batch_get(ranges)["valueRanges"]
+    found = {}
+    for i in range(0, len(value_ranges), n_runs):
+        for values in join_column_ranges("notes", text_and_id, value_ranges[i:i + n_runs]):
+            row = dict(zip(text_and_id, values))
+            if row["id"] in ids:
+                found[row["id"]] = row
+    return found
+
+def note_texts(note_ids):
+    """{id: {"requirements": ..., "evidence": ...}} cho các ghi chép được mở/xuất.
+
+    Dòng trên sheet lấy từ NoteRowIndex, chỉ các đoạn dòng đó được đọc; cột id
+    đọc kèm để kiểm tra. Nếu có id không khớp (sheet vừa đổi), đọc lại cả hai
+    cột văn bản một lần.
+    """
+    cache = note_text_cache()
+    texts = {}
+    missing = set()
+    for note_id in note_ids:
+        hit = cache.get(note_id)
+        if hit is None:
+            missing.add(note_id)
+        else:
+            texts[note_id] = hit
+    if not missing:
+        return texts
 
-# ------------ DataFrame Helpers ------------
-def _df(ws):
-    data = ws.get_all_values()
-    if len(data) <= 1:
-        cols = [c.lower() for c in data[0]] if data else []
-        return pd.DataFrame(columns=cols)
-    return pd.DataFrame(data[1:], columns=[c.lower() for c in data[0]])
+    index = note_row_index()
+    if not index.synced:
+        sync_note_indexes(df_notes())
+    rows = [index.sheet_row(i) for i in missing]
+    found = {}
+    if all(rows):
+        found = _fetch_note_texts(missing, _row_spans(rows))
+    if len(found) < len(missing):
+        found.update(_fetch_note_texts(missing - set(found)))
+    for note_id, row in found.items():
+        cache.put(note_id, row)
+        texts[note_id] = cache.get(note_id)
+    return texts
 
-@st.cache_data(ttl=300)
-def df_auditors():   return _df(gws()["auditors"])
-@st.cache_data(ttl=300)
-def df_notes():      return _df(gws()["notes"])
-@st.cache_data(ttl=300)
-def df_participants(): return _df(gws()["participants"])
+# ------------ Sửa/xóa ghi chép theo id ------------
+def new_note_id():
+    return uuid.uuid4().hex
 
-# ------------ Utilities ------------
-hash_pw = lambda x: hashlib.sha256(x.encode()).hexdigest()
-verify_pw = lambda s, p: s.strip() == hash_pw(p.strip())
-sheet_name = lambda em: re.sub(r'[^A-Za-z0-9_-]', '_', em)[:100]
+def note_id_of(row, position):
+    """Id của dòng Notes; dòng cũ chưa có id dùng id tạm theo vị trí (không sửa/xóa được)."""
+    return row.get("id") or f"#{position}"
+
+def locate_note_row(ws, note_id):
+    """Số dòng của ghi chép trên sheet.
+
+    Vị trí lấy từ NoteRowIndex; ô id tại dòng đó được đọc lại để chắc chắn
+    trước khi ghi đè hay xóa (sheet có thể bị tiến trình khác thay đổi). Nếu
+    lệch, các chỉ mục được dựng lại từ dữ liệu mới rồi tra lại một lần.
+    """
+    index = note_row_index()
+    if not index.synced:
+        sync_note_indexes(df_notes())
+    for attempt in range(2):
+        row = index.sheet_row(note_id)
+        if row is not None and ws.cell(row, NOTE_ID_COL).value == note_id:
+            return row
+        df_notes.clear()
+        sync_note_indexes(df_notes(), rebuild=True)
+    return None
+
+def update_note(note_id, changes):
+    """Ghi các cột đã sửa của một ghi chép bằng một lời gọi batch_update."""
+    notes_ws = gws()["notes"]
+    row = locate_note_row(notes_ws, note_id)
+    if row is None:
+        return False
+    notes_ws.batch_update([
+        {"range": gspread.utils.rowcol_to_a1(row, NOTES_HEADER.index(field) + 1), "values": [[value]]}
+        for field, value in changes.items()
+    ])
+    notes_df = df_notes()
+    current = notes_df[notes_df["id"] == note_id].to_dict("records")
+    doc = notes_search_index().doc(note_id)
+    if current or doc:
+        updated = {**(current[0] if current else {}), **(doc or {}), **changes, "id": note_id}
+        for index in note_indexes():
+            index.replace(updated)
+    note_text_cache().discard(note_id)
+    df_notes.clear()
+    return True
+
+def delete_note(note_id):
+    """Xóa dòng của một ghi chép khỏi sheet."""
+    notes_ws = gws()["notes"]
+    row = locate_note_row(notes_ws, note_id)
+    if row is None:
+        return False
+    notes_ws.delete_rows(row)
+    for index in note_indexes():
+        index.remove(note_id)
+    note_text_cache().discard(note_id)
+    df_notes.clear()
+    return True
 
 # --- Image Handling ---
 def convert_heic_to_jpeg(file_object):
     try:
         file_object.seek(0)
-        heif_file = pillow_heif.read_heif(file_object.read())
-        image = Image.frombytes(
+        heif_file = imaging.pillow_heif.read_heif(file_object.read())
+        image = imaging.Image.frombytes(
             heif_file.mode,
             heif_file.size,
             heif_file.data,
@@ -251,40 +1754,325 @@ def convert_heic_to_jpeg(file_object):
         st.error(f"❌ Không thể chuyển .heic -> .jpg: {e}")
         return None
 
-def upload_image_to_drive(drive_service, file_object, folder_id):
-    if not drive_service or not file_object or not folder_id:
-        st.error("upload_image_to_drive: Đầu vào không hợp lệ")
-        return None
+class UploadedPhoto(io.BytesIO):
+    """Ảnh nhận qua API, cùng giao diện name/type/getvalue với file của st.file_uploader."""
+
+    def __init__(self, data, name, mime_type):
+        super().__init__(data)
+        self.name = name
+        self.type = mime_type
+
+class DriveImageIndex:
+    """Chỉ mục sha256 nội dung ảnh -> id file Drive, lưu ở worksheet Images.
+
+    Cùng một ảnh gắn cho nhiều mục (hoặc gửi lại form sau lỗi) chỉ được upload
+    một lần: lần sau dùng lại file đã có. Bảng đọc qua SnapshotStore nên mọi
+    replica dùng chung; trong tiến trình, các upload cùng nội dung chờ nhau theo
+    khóa (chia theo hash) để không cùng upload một ảnh.
+    """
+
+    LOCKS = 64
+
+    def __init__(self):
+        self._locks = [threading.Lock() for _ in range(self.LOCKS)]
+
+    def _load(self):
+        def fetch():
+            df = read_columns(("images", ["sha256", "file_id"]))[0]
+            return dict(zip(df["sha256"], df["file_id"]))
+        return snapshots().get("images", fetch, revision=sheet_revision)
+
+    def lookup(self, digest):
+        return self._load().get(digest)
+
+    def __len__(self):
+        return len(self._load())
+
+    @contextmanager
+    def claim(self, digest):
+        with self._locks[int(digest[:8], 16) % self.LOCKS]:
+            yield
+
+    def record(self, entries):
+        """Ghi [(digest, file_id, tên, kích thước)] bằng một append_rows."""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        gws()["images"].append_rows([list(entry) + [now] for entry in entries], value_input_option="RAW")
+        known = dict(self._load())
+        known.update((digest, file_id) for digest, file_id, _, _ in entries)
+        # Phiên bản mới cho replica khác; tiến trình này giữ luôn bảng đã cập nhật
+        snapshots().invalidate("images")
+        snapshots().put("images", known)
+
+@st.cache_resource
+def drive_image_index():
+    return DriveImageIndex()
+
+def drive_image_url(file_id):
+    return f"https://drive.google.com/uc?export=view&id={file_id}"
+
+# ------------ Quyền xem ảnh trên Drive ------------
+# "file": mở quyền cho từng ảnh (nhiều ảnh thì gộp trong một batch request);
+# "folder": thư mục upload được chia sẻ một lần, ảnh thừa hưởng quyền của thư mục.
+DRIVE_SHARING_MODES = ("file", "folder")
+DRIVE_BATCH_LIMIT = 100  # số request tối đa trong một batch của Drive API
+ANYONE_READER = {'type': 'anyone', 'role': 'reader'}
+
+def drive_sharing():
+    mode = os.environ.get("AUDITNOTE_DRIVE_SHARING", "file").strip().lower()
+    return mode if mode in DRIVE_SHARING_MODES else "file"
+
+@st.cache_resource
+def shared_drive_folders():
+    """Các thư mục đã kiểm tra là chia sẻ công khai trong tiến trình này."""
+    return set()
+
+def ensure_folder_shared(drive_service, folder_id):
+    shared = shared_drive_folders()
+    if folder_id in shared:
+        return
+    with remote_call("permissions.list", "drive"):
+        current = drive_service.permissions().list(fileId=folder_id, fields="permissions(type,role)").execute()
+    if not any(p.get("type") == "anyone" for p in current.get("permissions", [])):
+        with remote_call("permissions.create", "drive"):
+            drive_service.permissions().create(fileId=folder_id, body=ANYONE_READER).execute()
+    shared.add(folder_id)
+
+def share_drive_files(drive_service, file_ids, folder_id):
+    """Mở quyền xem cho các file vừa upload; trả về {file_id: lỗi} của những file thất bại."""
+    if not file_ids:
+        return {}
+    if drive_sharing() == "folder":
+        ensure_folder_shared(drive_service, folder_id)
+        return {}
+    if len(file_ids) == 1:
+        with remote_call("permissions.create", "drive"):
+            drive_service.permissions().create(fileId=file_ids[0], body=ANYONE_READER).execute()
+        return {}
+    errors = {}
+
+    def done(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+
+    for start in range(0, len(file_ids), DRIVE_BATCH_LIMIT):
+        batch = drive_service.new_batch_http_request(callback=done)
+        for file_id in file_ids[start:start + DRIVE_BATCH_LIMIT]:
+            batch.add(drive_service.permissions().create(fileId=file_id, body=ANYONE_READER), request_id=file_id)
+        with remote_call("permissions.batch", "drive"):
+            batch.execute()
+    return errors
+
+class DriveUploads:
+    """Ảnh mới của một lần gửi nhiều ảnh, chờ mở quyền xem và ghi vào DriveImageIndex.
+
+    ``store_image_on_drive(..., uploads=...)`` chỉ tạo file; ``commit`` mở quyền
+    cho cả lô (một batch request, hoặc không gọi gì khi thư mục đã chia sẻ) và
+    ghi chỉ mục bằng một append_rows. Ảnh trùng nội dung trong cùng lô dùng
+    chung một file.
+    """
+
+    def __init__(self, folder_id):
+        self.folder_id = folder_id
+        self.pending = {}  # digest -> (file_id, tên, kích thước)
+        self._lock = threading.Lock()
+
+    def lookup(self, digest):
+        with self._lock:
+            entry = self.pending.get(digest)
+        return entry[0] if entry else None
+
+    def add(self, digest, file_id, name, size):
+        with self._lock:
+            self.pending[digest] = (file_id, name, size)
+
+    def commit(self, drive_service):
+        """Trả về {URL: lỗi} của các ảnh không mở được quyền xem (không ghi vào chỉ mục)."""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        errors = share_drive_files(drive_service, [file_id for file_id, _, _ in pending.values()], self.folder_id)
+        shared = [(digest,) + entry for digest, entry in pending.items() if entry[0] not in errors]
+        if shared:
+            drive_image_index().record(shared)
+        return {drive_image_url(file_id): error for file_id, error in errors.items()}
+
+# ------------ Upload resumable theo từng phần ------------
+DRIVE_UPLOAD_RETRIES = 3  # số lần googleapiclient tự thử lại mỗi phần (lỗi 5xx/429/mạng)
+
+def upload_chunk_size():
+    """Cỡ mỗi phần upload (AUDITNOTE_UPLOAD_CHUNK_MB, mặc định 1 MB), làm tròn bội số 256 KB."""
+    mb = float(os.environ.get("AUDITNOTE_UPLOAD_CHUNK_MB") or 1)
+    return max(1, round(mb * 4)) * 256 * 1024
+
+class UploadSessions:
+    """Phiên upload resumable còn dở: URI phiên và số byte Drive đã xác nhận.
+
+    Lưu trong SQLite (cùng file với SnapshotStore) sau mỗi phần, nên khi mất
+    kết nối giữa chừng, lần gửi lại cùng ảnh (kể cả ở tiến trình khác) tiếp tục
+    từ byte cuối Drive đã nhận thay vì upload lại từ đầu.
+    """
+
+    MAX_AGE = 6 * 24 * 3600  # Drive giữ phiên resumable khoảng một tuần
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS uploads (
+            key TEXT PRIMARY KEY, uri TEXT NOT NULL, offset INTEGER NOT NULL, size INTEGER NOT NULL,
+            started REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        try:
+            self._db = self._connect(path)
+        except sqlite3.Error:
+            self._db = self._connect(":memory:")
+
+    def _connect(self, path):
+        db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        db.executescript(self.SCHEMA)
+        return db
+
+    def _sql(self, query, args=()):
+        with self._lock:
+            return self._db.execute(query, args).fetchall()
+
+    def get(self, key, size):
+        """(uri, offset) của phiên còn hạn cho đúng ``size`` byte, hoặc None."""
+        rows = self._sql("SELECT uri, offset FROM uploads WHERE key = ? AND size = ? AND started > ?",
+                         (key, size, time.time() - self.MAX_AGE))
+        return tuple(rows[0]) if rows else None
+
+    def save(self, key, uri, offset, size):
+        self._sql(
+            "INSERT INTO uploads (key, uri, offset, size, started) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET uri = excluded.uri, offset = excluded.offset, size = excluded.size",
+            (key, uri, offset, size, time.time()),
+        )
+
+    def drop(self, key):
+        self._sql("DELETE FROM uploads WHERE key = ?", (key,))
+
+@st.cache_resource
+def upload_sessions():
+    return UploadSessions(snapshots().path)
+
+def upload_status(request, size):
+    """Hỏi Drive phiên ``request.resumable_uri`` đã nhận bao nhiêu byte.
+
+    Gửi PUT rỗng với ``Content-Range: bytes */size``: 308 kèm ``Range: bytes=0-N``
+    là đã nhận N+1 byte (không có Range là 0), 200/201 là upload đã xong. Trả về
+    (số byte đã nhận, phản hồi cuối hoặc None); 404/410 (phiên hết hạn) và lỗi
+    khác được ném thành HttpError.
+    """
+    headers = {"Content-Range": f"bytes */{size}", "Content-Length": "0"}
+    with remote_call("upload.status", "drive"):
+        resp, content = request.http.request(request.resumable_uri, "PUT", headers=headers)
+    if resp.status in (200, 201):
+        return size, request.postproc(resp, content)
+    if resp.status != 308:
+        raise google_drive.HttpError(resp, content, uri=request.resumable_uri)
+    received = resp.get("range")
+    return (int(received.rsplit("-", 1)[1]) + 1 if received else 0), None
+
+def run_resumable_upload(request, media, session_key=None, progress=None):
+    """Gửi ``request`` (files().create với media resumable) từng phần; trả về phản hồi cuối.
 
+    Có ``session_key`` thì URI phiên và số byte đã xác nhận được lưu sau mỗi
+    phần, và một phiên đã lưu được tiếp tục. ``progress(tỉ lệ)`` được gọi sau
+    mỗi phần.
+    """
+    sessions = upload_sessions()
+    saved = sessions.get(session_key, media.size()) if session_key else None
+    response = None
+    if saved:
+        # Số byte đã lưu có thể cũ hơn phía Drive: hỏi lại trước khi gửi tiếp
+        request.resumable_uri = saved[0]
+        request.resumable_progress, response = upload_status(request, media.size())
+        metrics().inc("auditnote_upload_resumed_total")
+    while response is None:
+        with remote_call("upload.chunk", "drive"):
+            status, response = request.next_chunk(num_retries=DRIVE_UPLOAD_RETRIES)
+        if status is not None:
+            if session_key:
+                sessions.save(session_key, request.resumable_uri, status.resumable_progress, media.size())
+            if progress:
+                progress(status.progress())
+    if session_key:
+        sessions.drop(session_key)
+    if progress:
+        progress(1.0)
+    return response
+
+def store_image_on_drive(drive_service, file_object, folder_id, uploads=None, progress=None):
+    """Upload ảnh và mở quyền xem; trả về URL hoặc ném lỗi (dùng ngoài giao diện).
+
+    Ảnh có nội dung đã upload trước đó (theo DriveImageIndex) dùng lại file cũ;
+    upload dở dang của cùng nội dung được tiếp tục (UploadSessions). Với
+    ``uploads`` (DriveUploads), việc mở quyền và ghi chỉ mục để lại cho
+    ``uploads.commit``.
+    """
+    file_object.seek(0)
+    data = file_object.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+    index = drive_image_index()
+    with index.claim(digest):
+        file_id = index.lookup(digest) or (uploads.lookup(digest) if uploads is not None else None)
+        if file_id:
+            metrics().inc("auditnote_drive_dedup_hits_total")
+            return drive_image_url(file_id)
+        file_id = upload_new_image(drive_service, file_object, folder_id, f"{folder_id}:{digest}", progress)
+        if uploads is not None:
+            uploads.add(digest, file_id, file_object.name, len(data))
+        else:
+            share_drive_files(drive_service, [file_id], folder_id)
+            index.record([(digest, file_id, file_object.name, len(data))])
+    return drive_image_url(file_id)
+
+def upload_new_image(drive_service, file_object, folder_id, session_key=None, progress=None):
+    """Tạo file Drive cho ảnh (HEIC được chuyển sang JPEG); trả về id.
+
+    Upload resumable theo từng phần ``upload_chunk_size()`` (xem run_resumable_upload).
+    """
     file_ext = file_object.name.lower().split('.')[-1]
     file_name_no_ext = file_object.name.rsplit('.', 1)[0]
 
-    try:
-        if file_ext in ['heic', 'heif']:
-            converted_image = convert_heic_to_jpeg(file_object)
-            if not converted_image:
-                return None
-            media = MediaIoBaseUpload(converted_image, mimetype='image/jpeg', resumable=True)
-            new_filename = file_name_no_ext + ".jpg"
-            file_metadata = {'name': new_filename, 'parents': [folder_id]}
-        else:
-            file_object.seek(0)
-            media_content = io.BytesIO(file_object.getvalue())
-            media = MediaIoBaseUpload(media_content, mimetype=file_object.type, resumable=True)
-            file_metadata = {'name': file_object.name, 'parents': [folder_id]}
-
-        file = drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-        file_id = file.get('id')
-        if not file_id:
-            return None
+    if file_ext in ['heic', 'heif']:
+        converted_image = convert_heic_to_jpeg(file_object)
+        if not converted_image:
+            raise ValueError(f"không chuyển được ảnh HEIC {file_object.name}")
+        media = google_drive.MediaIoBaseUpload(converted_image, mimetype='image/jpeg',
+                                               chunksize=upload_chunk_size(), resumable=True)
+        new_filename = file_name_no_ext + ".jpg"
+        file_metadata = {'name': new_filename, 'parents': [folder_id]}
+    else:
+        file_object.seek(0)
+        media_content = io.BytesIO(file_object.getvalue())
+        media = google_drive.MediaIoBaseUpload(media_content, mimetype=file_object.type,
+                                               chunksize=upload_chunk_size(), resumable=True)
+        file_metadata = {'name': file_object.name, 'parents': [folder_id]}
 
-        permission = {'type': 'anyone', 'role': 'reader'}
-        drive_service.permissions().create(fileId=file_id, body=permission).execute()
+    request = drive_service.files().create(body=file_metadata, media_body=media, fields='id')
+    try:
+        file = run_resumable_upload(request, media, session_key, progress)
+    except google_drive.HttpError as e:
+        if not (session_key and e.resp.status in (404, 410)):
+            raise
+        # Phiên đã lưu hết hạn hoặc bị hủy phía Drive: upload lại từ đầu
+        upload_sessions().drop(session_key)
+        media.stream().seek(0)
+        request = drive_service.files().create(body=file_metadata, media_body=media, fields='id')
+        file = run_resumable_upload(request, media, session_key, progress)
+    file_id = file.get('id')
+    if not file_id:
+        raise ValueError("Drive không trả về id của file")
+    return file_id
 
-        # Trả về URL trực tiếp của ảnh
-        image_url = f"https://drive.google.com/uc?export=view&id={file_id}"
-        return image_url
+def upload_image_to_drive(drive_service, file_object, folder_id, progress=None):
+    if not drive_service or not file_object or not folder_id:
+        st.error("upload_image_to_drive: Đầu vào không hợp lệ")
+        return None
 
+    try:
+        return store_image_on_drive(drive_service, file_object, folder_id, progress=progress)
     except Exception as e:
         st.error(f"Lỗi khi upload ảnh: {e}")
         return None
@@ -332,38 +2120,13 @@ def page_login():
     col1, col2 = st.columns(2)
     
     if col1.button("Đăng nhập"):
-        auditors = df_auditors()
-        if email == "admin" and password == "admin123":
-            # Admin login for testing
-            st.session_state.user = {
-                "email": "admin",
-                "fullname": "Admin",
-                "position": "Administrator"
-            }
+        user, error = login_auditor(email, password)
+        if user:
+            st.session_state.user = user
             st.session_state.is_logged_in = True
             st.rerun()
-        elif not auditors.empty:
-            user = auditors[auditors['email'] == email]
-            if not user.empty:
-                stored_pw = user.iloc[0]['password']
-                if verify_pw(stored_pw, password):
-                    st.session_state.user = {
-                        "email": email,
-                        "fullname": user.iloc[0]['fullname'],
-                        "position": user.iloc[0]['position']
-                    }
-                    
-                    # Cập nhật thời gian đăng nhập
-                    auditor_idx = auditors[auditors['email'] == email].index[0] + 2
-                    gws()["auditors"].update_cell(auditor_idx, 5, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                    df_auditors.clear()
-                    
-                    st.session_state.is_logged_in = True
-                    st.rerun()
-                else:
-                    st.error("Mật khẩu không đúng!")
-            else:
-                st.error("Không tìm thấy email đánh giá viên!")
+        else:
+            st.error(error)
     
     if col2.button("Đăng ký"):
         st.session_state.show_register = True
@@ -400,6 +2163,30 @@ def page_login():
                         st.session_state.show_register = False
                         st.rerun()
 
+def login_auditor(email, password):
+    """Kiểm tra đăng nhập; trả về (user, lỗi) và ghi thời điểm đăng nhập khi thành công."""
+    if email == "admin" and password == "admin123":
+        # Admin login for testing
+        return {"email": "admin", "fullname": "Admin", "position": "Administrator"}, None
+    
+    auditors = df_auditors()
+    user = auditors[auditors['email'] == email] if not auditors.empty else auditors
+    if user.empty:
+        return None, "Không tìm thấy email đánh giá viên!"
+    if not verify_pw(user.iloc[0]['password'], password):
+        return None, "Mật khẩu không đúng!"
+    
+    # Cập nhật thời gian đăng nhập
+    auditor_idx = user.index[0] + 2
+    gws()["auditors"].update_cell(auditor_idx, 5, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    df_auditors.clear()
+    
+    return {
+        "email": email,
+        "fullname": user.iloc[0]['fullname'],
+        "position": user.iloc[0]['position']
+    }, None
+
 # ============ Trang Đổi Mật Khẩu ============
 def page_change_password():
     display_logos()
@@ -435,366 +2222,686 @@ def page_change_password():
         st.rerun()
 
 # --- Export Functions ---
-def get_download_link(file_content, file_name, display_text):
-    """Tạo download link cho các file được tạo."""
-    b64 = base64.b64encode(file_content).decode()
-    href = f'<a href="data:application/octet-stream;base64,{b64}" download="{file_name}" class="download-button">{display_text}</a>'
-    return href
-
 def process_image_for_export(image_url):
     """Xử lý URL hình ảnh để sử dụng trong export PDF và Word"""
     if not image_url:
         return None
     
     try:
-        response = requests.get(image_url)
-        img = Image.open(io.BytesIO(response.content))
+        with remote_call("image_fetch", "drive"):
+            response = requests.get(image_url)
+        img = imaging.Image.open(io.BytesIO(response.content))
         return img
     except Exception as e:
         st.error(f"Lỗi xử lý ảnh: {e}")
         return None
+
+# ------------ Ảnh tạm cho xuất báo cáo ------------
+# Ngân sách bộ nhớ (MB) của một lần xuất; không đặt thì giữ nguyên kích thước ảnh.
+EXPORT_MEMORY_ENV = "AUDITNOTE_EXPORT_MEMORY_MB"
+# Phần ngân sách dành cho ảnh nhúng: reportlab giữ cả đối tượng ảnh lẫn toàn bộ
+# file PDF trong bộ nhớ tới khi ghi, python-docx chỉ giữ dữ liệu ảnh.
+EXPORT_IMAGE_SHARE = {"pdf": 0.25, "docx": 0.4}
+EXPORT_JPEG_QUALITY = 75          # mặc định của Pillow, như trước khi ảnh được ghi ra file tạm
+EXPORT_JPEG_BYTES_PER_PIXEL = 0.25  # ước lượng (hơi dư) JPEG chất lượng 75 cho ảnh chụp
+EXPORT_MIN_IMAGE_SIDE = 160       # không thu nhỏ cạnh dài dưới mức này
+
+def export_memory_mb(memory_mb=None):
+    if memory_mb is None:
+        memory_mb = os.environ.get(EXPORT_MEMORY_ENV) or None
+    return float(memory_mb) if memory_mb else None
+
+def count_export_images(audit_data):
+    return sum(1 for item in audit_data if item['image_url'])
+
+class ExportImages:
+    """Ảnh bằng chứng của một lần xuất, ghi ra file JPEG tạm và tham chiếu theo đường dẫn.
+
+    Mỗi ảnh được tải, giải mã, thu nhỏ rồi ghi ra đĩa ngay, nên bộ nhớ chỉ giữ
+    một ảnh đã giải mã tại một thời điểm. Với ``memory_mb``, phần ngân sách dành
+    cho ảnh (``EXPORT_IMAGE_SHARE``) được chia đều cho ``count`` ảnh: ảnh lớn hơn phần của mình bị thu nhỏ
+    (JPEG giải mã thẳng ở tỉ lệ nhỏ qua ``draft``), vì thư viện PDF/Word vẫn giữ
+    dữ liệu ảnh đã nén tới khi ghi xong tài liệu.
+    """
+
+    def __init__(self, kind, count, memory_mb=None):
+        self.dir = tempfile.TemporaryDirectory(prefix="auditnote_export_")
+        self.count = 0
+        memory_mb = export_memory_mb(memory_mb)
+        self.image_bytes = None
+        if memory_mb and count:
+            self.image_bytes = int(memory_mb * 2**20 * EXPORT_IMAGE_SHARE[kind] / count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.dir.cleanup()
+
+    def _target_size(self, size, pixels=None):
+        width, height = size
+        if self.image_bytes is None:
+            return width, height
+        if pixels is None:
+            pixels = self.image_bytes / EXPORT_JPEG_BYTES_PER_PIXEL
+        ratio = min(1.0, math.sqrt(pixels / (width * height)))
+        ratio = max(ratio, min(1.0, EXPORT_MIN_IMAGE_SIDE / max(width, height)))
+        return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+    def add(self, image_url):
+        """Đường dẫn file JPEG tạm và kích thước gốc (px) của ảnh, hoặc None nếu không tải được.
+
+        Kích thước gốc dùng để dàn trang, nên ảnh bị thu nhỏ vẫn hiển thị như cũ.
+        """
+        img = process_image_for_export(image_url)
+        if img is None:
+            return None
+        path = os.path.join(self.dir.name, f"{self.count}.jpg")
+        self.count += 1
+        try:
+            size = img.size
+            target = self._target_size(size)
+            img.draft("RGB", target)  # chỉ có tác dụng với JPEG
+            img = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+            for attempt in range(3):
+                if img.size != target:
+                    img.thumbnail(target)
+                img.save(path, format='JPEG', quality=EXPORT_JPEG_QUALITY)
+                if self.image_bytes is None or os.path.getsize(path) <= self.image_bytes:
+                    break
+                # Ảnh nén kém hơn ước lượng: thu nhỏ tiếp theo tỉ lệ dung lượng thực tế
+                pixels = img.size[0] * img.size[1] * 0.9 * self.image_bytes / os.path.getsize(path)
+                target = self._target_size(img.size, pixels)
+                if target == img.size:
+                    break
+            return path, size
+        finally:
+            img.close()
+
+# ============ Bản ghi dạng cột cho xuất báo cáo ============
+NOTE_CATEGORICAL = ("company", "frame_id", "panel_id", "result")
+PARTICIPANT_CATEGORICAL = ("company", "frame_id", "role")
+
+class Record:
+    """Một dòng của RecordBatch, đọc như dict: ``record['clause']``."""
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.batch.value(name, self.index)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def time(self, name):
+        """Giá trị đã parse (datetime64) của một cột thời gian."""
+        return self.batch.times[name][self.index]
+
+    def to_dict(self):
+        return {name: self[name] for name in self.batch.fields}
+
+class RecordBatch:
+    """Bảng bản ghi dạng cột, dựng một lần từ DataFrame (không tạo dict mỗi dòng).
+
+    Cột phân loại lưu mã int32 cùng danh sách giá trị dùng chung; cột thời gian
+    có thêm mảng datetime64 đã parse; các cột còn lại giữ list str (tham chiếu
+    tới chính các chuỗi của DataFrame, không sao chép).
+    """
+
+    def __init__(self, fields, codes, categories, values, times):
+        self.fields = fields
+        self.codes = codes
+        self.categories = categories
+        self.values = values
+        self.times = times
+        column = next(iter(codes.values()), None)
+        self.length = len(column) if column is not None else len(next(iter(values.values()), ()))
+
+    @classmethod
+    def from_frame(cls, df, categorical=(), datetimes=()):
+        codes, categories, values, times = {}, {}, {}, {}
+        for name in df.columns:
+            col = df[name]
+            if name in categorical:
+                c, uniques = pd.factorize(col, sort=False)
+                codes[name] = c.astype(np.int32)
+                categories[name] = uniques.tolist()
+            else:
+                values[name] = col.tolist()
+            if name in datetimes:
+                times[name] = pd.to_datetime(col, errors="coerce").to_numpy()
+        return cls(list(df.columns), codes, categories, values, times)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Record(self, index)
+
+    def __iter__(self):
+        return (Record(self, i) for i in range(len(self)))
+
+    def value(self, name, index):
+        codes = self.codes.get(name)
+        if codes is not None:
+            code = codes[index]
+            return self.categories[name][code] if code >= 0 else ""
+        return self.values[name][index]
+
+    def column(self, name):
+        codes = self.codes.get(name)
+        if codes is not None:
+            cats = self.categories[name]
+            return [cats[c] if c >= 0 else "" for c in codes]
+        return self.values[name]
+
+    def set_column(self, name, values):
+        if name not in self.fields:
+            self.fields.append(name)
+        self.values[name] = list(values)
+
+    def take(self, indices):
+        """Bản ghi con theo vị trí, dùng chung danh sách giá trị phân loại."""
+        indices = np.asarray(indices, dtype=np.intp)
+        return RecordBatch(
+            list(self.fields),
+            {k: v[indices] for k, v in self.codes.items()},
+            self.categories,
+            {k: [v[i] for i in indices] for k, v in self.values.items()},
+            {k: v[indices] for k, v in self.times.items()},
+        )
+
+    def groups(self, name):
+        """[(giá trị, RecordBatch)] theo thứ tự xuất hiện đầu tiên của cột phân loại."""
+        codes = self.codes[name]
+        if not len(codes):
+            return []
+        order = np.argsort(codes, kind="stable")
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        parts = np.split(order, bounds)
+        parts.sort(key=lambda part: part[0])
+        cats = self.categories[name]
+        return [(cats[codes[part[0]]] if codes[part[0]] >= 0 else "", self.take(part)) for part in parts]
+
+    def value_counts(self, name):
+        codes = self.codes[name]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.categories[name]))
+        return dict(zip(self.categories[name], counts.tolist()))
+
+def group_records(records, field):
+    """[(giá trị, các bản ghi)] theo ``field``, giữ thứ tự xuất hiện; nhận RecordBatch hoặc list dict."""
+    if isinstance(records, RecordBatch):
+        return records.groups(field)
+    groups = {}
+    for item in records:
+        groups.setdefault(item[field], []).append(item)
+    return list(groups.items())
+
 # ============ Export Functions ============
-def export_to_pdf(company_name, audit_data, participants_data):
-    """Tạo file PDF từ dữ liệu audit."""
-    buffer = io.BytesIO()
-    
-    # Cố gắng đăng ký font hỗ trợ tiếng Việt nếu có
+def frame_result_counts(company_name, frame_id, frame_items, aggregates=None):
+    """Thống kê NCA/NCB/PI/CM của một khung, ưu tiên đọc từ ResultAggregates."""
+    if aggregates is not None and aggregates.synced:
+        return aggregates.counts_for(company_name, frame_id)
+    if isinstance(frame_items, RecordBatch):
+        counts = frame_items.value_counts('result')
+        return {r: counts.get(r, 0) for r in ('NCA', 'NCB', 'PI', 'CM')}
+    results = {'NCA': 0, 'NCB': 0, 'PI': 0, 'CM': 0}
+    for item in frame_items:
+        if item['result'] in results:
+            results[item['result']] += 1
+    return results
+
+@st.cache_resource
+def pdf_font():
+    """Đăng ký font hỗ trợ tiếng Việt (nếu có) một lần mỗi tiến trình; trả về tên font dùng được."""
     try:
-        pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
-        font_name = 'DejaVuSans'
-    except:
-        font_name = 'Helvetica'
-    
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
-    styles = getSampleStyleSheet()
-    
-    # Tạo style cho tiêu đề và nội dung
-    title_style = ParagraphStyle(
-        'Title',
-        parent=styles['Heading1'],
-        fontName=font_name,
-        fontSize=16,
-        alignment=1,
-        spaceAfter=12
-    )
+        pdf.pdfmetrics.registerFont(pdf.TTFont('DejaVuSans', 'DejaVuSans.ttf'))
+        return 'DejaVuSans'
+    except Exception:
+        return 'Helvetica'
+
+@profile_calls("export_pdf")
+def export_to_pdf(company_name, audit_data, participants_data, aggregates=None, output=None, memory_mb=None):
+    """Tạo file PDF từ dữ liệu audit.
+
+    Nếu có ``aggregates`` (ResultAggregates đã đồng bộ), thống kê mỗi khung được
+    đọc trực tiếp từ đó thay vì đếm lại các mục. Với ``output`` (đường dẫn), PDF
+    được ghi thẳng ra file và hàm trả về đường dẫn đó thay vì bytes. Ảnh được
+    ghi tạm ra đĩa theo ngân sách ``memory_mb`` (xem ExportImages).
+    """
+    phases = PhaseTimer("pdf")
+    phases.switch("layout")
+    buffer = output or io.BytesIO()
+    with ExportImages("pdf", count_export_images(audit_data), memory_mb) as images:
+        font_name = pdf_font()
     
-    subtitle_style = ParagraphStyle(
-        'Subtitle',
-        parent=styles['Heading2'],
-        fontName=font_name,
-        fontSize=14,
-        alignment=1,
-        spaceAfter=10
-    )
+        doc = pdf.SimpleDocTemplate(buffer, pagesize=pdf.landscape(pdf.A4))
+        styles = pdf.getSampleStyleSheet()
     
-    normal_style = ParagraphStyle(
-        'Normal',
-        parent=styles['Normal'],
-        fontName=font_name,
-        fontSize=10,
-        spaceAfter=6
-    )
+        # Tạo style cho tiêu đề và nội dung
+        title_style = pdf.ParagraphStyle(
+            'Title',
+            parent=styles['Heading1'],
+            fontName=font_name,
+            fontSize=16,
+            alignment=1,
+            spaceAfter=12
+        )
     
-    content = []
+        subtitle_style = pdf.ParagraphStyle(
+            'Subtitle',
+            parent=styles['Heading2'],
+            fontName=font_name,
+            fontSize=14,
+            alignment=1,
+            spaceAfter=10
+        )
     
-    # Tiêu đề
-    content.append(Paragraph(f"BÁO CÁO ĐÁNH GIÁ ISO", title_style))
-    content.append(Paragraph(f"Công ty: {company_name}", subtitle_style))
-    content.append(Spacer(1, 10))
+        normal_style = pdf.ParagraphStyle(
+            'Normal',
+            parent=styles['Normal'],
+            fontName=font_name,
+            fontSize=10,
+            spaceAfter=6
+        )
     
-    # Thông tin chung
-    if audit_data and len(audit_data) > 0:
-        general_info = [
-            ["Bộ phận được đánh giá:", audit_data[0]['department']],
-            ["Người đối ứng:", audit_data[0]['person']],
-            ["Thời gian đánh giá:", audit_data[0]['audit_time']],
-            ["Địa chỉ:", audit_data[0]['address']]
-        ]
-        
-        t = Table(general_info, colWidths=[150, 400])
-        t.setStyle(TableStyle([
-            ('FONT', (0, 0), (-1, -1), font_name, 10),
-            ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-        ]))
-        content.append(t)
-        content.append(Spacer(1, 10))
-    
-    # Danh sách thành viên tham gia và đánh giá viên
-    if participants_data:
-        content.append(Paragraph("THÀNH VIÊN THAM GIA", subtitle_style))
+        content = []
+    
+        # Tiêu đề
+        content.append(pdf.Paragraph(f"BÁO CÁO ĐÁNH GIÁ ISO", title_style))
+        content.append(pdf.Paragraph(f"Công ty: {company_name}", subtitle_style))
+        content.append(pdf.Spacer(1, 10))
+    
+        # Thông tin chung
+        if audit_data and len(audit_data) > 0:
+            general_info = [
+                ["Bộ phận được đánh giá:", audit_data[0]['department']],
+                ["Người đối ứng:", audit_data[0]['person']],
+                ["Thời gian đánh giá:", audit_data[0]['audit_time']],
+                ["Địa chỉ:", audit_data[0]['address']]
+            ]
         
-        company_participants = [p for p in participants_data if p['role'] == 'company']
-        if company_participants:
-            participant_data = [["Họ và tên", "Chức vụ"]]
-            for p in company_participants:
-                participant_data.append([p['fullname'], p['position']])
-            
-            t = Table(participant_data, colWidths=[275, 275])
-            t.setStyle(TableStyle([
+            t = pdf.Table(general_info, colWidths=[150, 400])
+            t.setStyle(pdf.TableStyle([
                 ('FONT', (0, 0), (-1, -1), font_name, 10),
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+                ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
                 ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+                ('GRID', (0, 0), (-1, -1), 0.5, pdf.colors.black),
             ]))
             content.append(t)
+            content.append(pdf.Spacer(1, 10))
+    
+        # Danh sách thành viên tham gia và đánh giá viên
+        if participants_data:
+            content.append(pdf.Paragraph("THÀNH VIÊN THAM GIA", subtitle_style))
         
-        content.append(Spacer(1, 10))
-        content.append(Paragraph("ĐÁNH GIÁ VIÊN", subtitle_style))
-        
-        auditor_participants = [p for p in participants_data if p['role'] == 'auditor']
-        if auditor_participants:
-            auditor_data = [["Họ và tên", "Chức vụ"]]
-            for p in auditor_participants:
-                auditor_data.append([p['fullname'], p['position']])
+            company_participants = [p for p in participants_data if p['role'] == 'company']
+            if company_participants:
+                participant_data = [["Họ và tên", "Chức vụ"]]
+                for p in company_participants:
+                    participant_data.append([p['fullname'], p['position']])
             
-            t = Table(auditor_data, colWidths=[275, 275])
-            t.setStyle(TableStyle([
-                ('FONT', (0, 0), (-1, -1), font_name, 10),
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ]))
-            content.append(t)
+                t = pdf.Table(participant_data, colWidths=[275, 275])
+                t.setStyle(pdf.TableStyle([
+                    ('FONT', (0, 0), (-1, -1), font_name, 10),
+                    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                    ('GRID', (0, 0), (-1, -1), 0.5, pdf.colors.black),
+                    ('BACKGROUND', (0, 0), (-1, 0), pdf.colors.lightgrey),
+                ]))
+                content.append(t)
         
-        content.append(Spacer(1, 15))
-    
-    # Phân tích theo Frame
-    if audit_data:
-        frames = {}
-        for item in audit_data:
-            frame_id = item['frame_id']
-            if frame_id not in frames:
-                frames[frame_id] = []
-            frames[frame_id].append(item)
+            content.append(pdf.Spacer(1, 10))
+            content.append(pdf.Paragraph("ĐÁNH GIÁ VIÊN", subtitle_style))
         
-        for frame_id, frame_items in frames.items():
-            content.append(Paragraph(f"FRAME {frame_id}", subtitle_style))
+            auditor_participants = [p for p in participants_data if p['role'] == 'auditor']
+            if auditor_participants:
+                auditor_data = [["Họ và tên", "Chức vụ"]]
+                for p in auditor_participants:
+                    auditor_data.append([p['fullname'], p['position']])
             
-            # Thống kê kết quả
-            results = {'NCA': 0, 'NCB': 0, 'PI': 0, 'CM': 0}
-            for item in frame_items:
-                if item['result'] in results:
-                    results[item['result']] += 1
+                t = pdf.Table(auditor_data, colWidths=[275, 275])
+                t.setStyle(pdf.TableStyle([
+                    ('FONT', (0, 0), (-1, -1), font_name, 10),
+                    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                    ('GRID', (0, 0), (-1, -1), 0.5, pdf.colors.black),
+                    ('BACKGROUND', (0, 0), (-1, 0), pdf.colors.lightgrey),
+                ]))
+                content.append(t)
+        
+            content.append(pdf.Spacer(1, 15))
+    
+        # Phân tích theo Frame
+        if audit_data:
+            phases.switch("data_prep")
+            frames = group_records(audit_data, 'frame_id')
+            phases.switch("layout")
+        
+            for frame_id, frame_items in frames:
+                content.append(pdf.Paragraph(f"FRAME {frame_id}", subtitle_style))
             
-            result_data = [["NCA", "NCB", "PI", "CM"]]
-            result_data.append([str(results['NCA']), str(results['NCB']), str(results['PI']), str(results['CM'])])
+                # Thống kê kết quả
+                with phases.phase("data_prep"):
+                    results = frame_result_counts(company_name, frame_id, frame_items, aggregates)
             
-            t = Table(result_data, colWidths=[137.5, 137.5, 137.5, 137.5])
-            t.setStyle(TableStyle([
-                ('FONT', (0, 0), (-1, -1), font_name, 10),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ]))
-            content.append(t)
-            content.append(Spacer(1, 10))
+                result_data = [["NCA", "NCB", "PI", "CM"]]
+                result_data.append([str(results['NCA']), str(results['NCB']), str(results['PI']), str(results['CM'])])
             
-            # Dữ liệu chi tiết
-            for item in frame_items:
-                data = [
-                    ["Điều khoản", "Tên điều khoản", "Các yêu cầu Tiêu chuẩn/Chuẩn mực đánh giá", "Bằng chứng đánh giá", "Kết quả đánh giá"],
-                    [item['clause'], item['clause_name'], item['requirements'], item['evidence'], item['result']]
-                ]
-                
-                t = Table(data, colWidths=[70, 100, 150, 150, 80])
-                t.setStyle(TableStyle([
-                    ('FONT', (0, 0), (-1, -1), font_name, 9),
-                    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+                t = pdf.Table(result_data, colWidths=[137.5, 137.5, 137.5, 137.5])
+                t.setStyle(pdf.TableStyle([
+                    ('FONT', (0, 0), (-1, -1), font_name, 10),
+                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                    ('GRID', (0, 0), (-1, -1), 0.5, pdf.colors.black),
+                    ('BACKGROUND', (0, 0), (-1, 0), pdf.colors.lightgrey),
                 ]))
                 content.append(t)
-                content.append(Spacer(1, 5))
+                content.append(pdf.Spacer(1, 10))
+            
+                # Dữ liệu chi tiết
+                for item in frame_items:
+                    data = [
+                        ["Điều khoản", "Tên điều khoản", "Các yêu cầu Tiêu chuẩn/Chuẩn mực đánh giá", "Bằng chứng đánh giá", "Kết quả đánh giá"],
+                        [item['clause'], item['clause_name'], item['requirements'], item['evidence'], item['result']]
+                    ]
                 
-                # Thêm hình ảnh nếu có
-                if item['image_url']:
-                    try:
-                        img = process_image_for_export(item['image_url'])
-                        if img:
-                            img_data = io.BytesIO()
-                            img.save(img_data, format='JPEG')
-                            img_data.seek(0)
-                            
-                            # Resize image to fit in PDF
-                            width, height = img.size
-                            aspect = width / height
-                            if width > 300:
-                                width = 300
-                                height = width / aspect
+                    t = pdf.Table(data, colWidths=[70, 100, 150, 150, 80])
+                    t.setStyle(pdf.TableStyle([
+                        ('FONT', (0, 0), (-1, -1), font_name, 9),
+                        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+                        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                        ('GRID', (0, 0), (-1, -1), 0.5, pdf.colors.black),
+                        ('BACKGROUND', (0, 0), (-1, 0), pdf.colors.lightgrey),
+                    ]))
+                    content.append(t)
+                    content.append(pdf.Spacer(1, 5))
+                
+                    # Thêm hình ảnh nếu có
+                    if item['image_url']:
+                        try:
+                            with phases.phase("image_fetch"):
+                                spooled = images.add(item['image_url'])
+                            if spooled:
+                                # Resize image to fit in PDF
+                                img_path, (width, height) = spooled
+                                aspect = width / height
+                                if width > 300:
+                                    width = 300
+                                    height = width / aspect
                             
-                            content.append(Paragraph(f"Hình ảnh bằng chứng:", normal_style))
-                            content.append(RLImage(img_data, width=width, height=height))
-                            content.append(Spacer(1, 10))
-                    except Exception as e:
-                        content.append(Paragraph(f"[Không thể hiển thị hình ảnh: {e}]", normal_style))
+                                content.append(pdf.Paragraph(f"Hình ảnh bằng chứng:", normal_style))
+                                content.append(pdf.Image(img_path, width=width, height=height))
+                                content.append(pdf.Spacer(1, 10))
+                        except Exception as e:
+                            content.append(pdf.Paragraph(f"[Không thể hiển thị hình ảnh: {e}]", normal_style))
             
-            content.append(Spacer(1, 20))
+                content.append(pdf.Spacer(1, 20))
     
-    # Thêm ngày xuất báo cáo
-    current_date = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-    content.append(Spacer(1, 10))
-    content.append(Paragraph(f"Báo cáo được xuất ngày: {current_date}", normal_style))
+        # Thêm ngày xuất báo cáo
+        current_date = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        content.append(pdf.Spacer(1, 10))
+        content.append(pdf.Paragraph(f"Báo cáo được xuất ngày: {current_date}", normal_style))
     
-    doc.build(content)
-    pdf = buffer.getvalue()
+        phases.switch("serialize")
+        doc.build(content)
+    phases.record()
+    if output:
+        return output
+    pdf_data = buffer.getvalue()
     buffer.close()
-    return pdf
+    return pdf_data
+
+class DocxBodyWriter:
+    """Ghi nối tiếp nội dung vào thân tài liệu Word bằng XML trực tiếp.
+
+    Các hàm ``add_*`` của python-docx dò lại toàn bộ body để tìm ``w:sectPr``,
+    tính id hình bằng XPath trên cả tài liệu và so SHA1 với mọi ảnh đã chèn,
+    nên thời gian tạo báo cáo tăng theo bình phương số mục. Writer này giữ sẵn
+    vị trí chèn, bảng mẫu và các bộ đếm nên mỗi mục chỉ tốn chi phí cố định,
+    trong khi XML sinh ra giống hệt cách dùng API thông thường.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self._body = doc.element.body
+        self._sect_pr = self._body.find(word.qn('w:sectPr'))
+        self._templates = {}
+        self._next_shape_id = doc.part.next_id
+        self._image_parts = {part.sha1: part for part in doc.part.package.image_parts}
+        self._next_image_idx = len(self._image_parts) + 1
+
+    def _append(self, element):
+        if self._sect_pr is None:
+            self._body.append(element)
+        else:
+            self._sect_pr.addprevious(element)
+        return element
+
+    def paragraph(self, text=""):
+        p = word.OxmlElement('w:p')
+        if text:
+            p.add_r().text = text
+        return self._append(p)
 
-def export_to_word(company_name, audit_data, participants_data):
-    """Tạo file Word từ dữ liệu audit."""
-    doc = Document()
+    def heading(self, text, level=1):
+        p = self.paragraph(text)
+        word.Paragraph(p, self.doc._body).style = f"Heading {level}"
+        return p
+
+    def _table_template(self, header, cols, style):
+        key = (header, cols, style)
+        if key not in self._templates:
+            table = self.doc.add_table(rows=2 if header else 1, cols=cols)
+            table.style = style
+            tbl = table._tbl
+            tbl.getparent().remove(tbl)
+            if header:
+                for tc, text in zip(tbl.tr_lst[0].tc_lst, header):
+                    _docx_set_cell_text(tc, text)
+            row = tbl.tr_lst[-1]
+            tbl.remove(row)
+            self._templates[key] = (tbl, row)
+        return self._templates[key]
+
+    def table(self, rows, header=None, style='Table Grid'):
+        """Thêm bảng; các bảng cùng tiêu đề được nhân bản từ một mẫu dựng sẵn."""
+        cols = len(header) if header else len(rows[0])
+        tbl_template, row_template = self._table_template(tuple(header or ()), cols, style)
+        tbl = copy.deepcopy(tbl_template)
+        for values in rows:
+            tr = copy.deepcopy(row_template)
+            for tc, text in zip(tr.tc_lst, values):
+                _docx_set_cell_text(tc, text)
+            tbl.append(tr)
+        return self._append(tbl)
+
+    def picture(self, image_stream, width=None):
+        image = word.Image.from_file(image_stream)
+        image_part = self._image_parts.get(image.sha1)
+        if image_part is None:
+            partname = word.PackURI(f"/word/media/image{self._next_image_idx}.{image.ext}")
+            image_part = word.ImagePart.from_image(image, partname)
+            self.doc.part.package.image_parts.append(image_part)
+            self._image_parts[image.sha1] = image_part
+            self._next_image_idx += 1
+        rId = self.doc.part.relate_to(image_part, word.RT.IMAGE)
+        cx, cy = image_part.image.scaled_dimensions(width, None)
+        inline = word.CT_Inline.new_pic_inline(self._next_shape_id, rId, image_part.image.filename, cx, cy)
+        self._next_shape_id += 1
+        p = self.paragraph()
+        p.add_r().add_drawing(inline)
+        return p
+
+def _docx_set_cell_text(tc, text):
+    """Tương đương ``_Cell.text = text`` nhưng thao tác thẳng trên ``w:tc``."""
+    tc.clear_content()
+    tc.add_p().add_r().text = text
+
+@profile_calls("export_docx")
+def export_to_word(company_name, audit_data, participants_data, aggregates=None, output=None, memory_mb=None):
+    """Tạo file Word từ dữ liệu audit (các tham số còn lại như export_to_pdf)."""
+    phases = PhaseTimer("docx")
+    phases.switch("layout")
+    with ExportImages("docx", count_export_images(audit_data), memory_mb) as images:
+        doc = word.Document()
     
-    # Thiết lập font và cỡ chữ mặc định
-    style = doc.styles['Normal']
-    style.font.name = 'Times New Roman'
-    style.font.size = Pt(11)
+        # Thiết lập font và cỡ chữ mặc định
+        style = doc.styles['Normal']
+        style.font.name = 'Times New Roman'
+        style.font.size = word.Pt(11)
     
-    # Tiêu đề
-    heading = doc.add_heading('BÁO CÁO ĐÁNH GIÁ ISO', level=1)
-    heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        # Tiêu đề
+        heading = doc.add_heading('BÁO CÁO ĐÁNH GIÁ ISO', level=1)
+        heading.alignment = word.WD_ALIGN_PARAGRAPH.CENTER
     
-    company_heading = doc.add_heading(f'Công ty: {company_name}', level=2)
-    company_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        company_heading = doc.add_heading(f'Công ty: {company_name}', level=2)
+        company_heading.alignment = word.WD_ALIGN_PARAGRAPH.CENTER
     
-    # Thông tin chung
-    if audit_data and len(audit_data) > 0:
-        doc.add_heading('Thông tin chung', level=3)
-        table = doc.add_table(rows=4, cols=2)
-        table.style = 'Table Grid'
-        
-        cells = table.rows[0].cells
-        cells[0].text = 'Bộ phận được đánh giá:'
-        cells[1].text = audit_data[0]['department']
-        
-        cells = table.rows[1].cells
-        cells[0].text = 'Người đối ứng:'
-        cells[1].text = audit_data[0]['person']
-        
-        cells = table.rows[2].cells
-        cells[0].text = 'Thời gian đánh giá:'
-        cells[1].text = audit_data[0]['audit_time']
-        
-        cells = table.rows[3].cells
-        cells[0].text = 'Địa chỉ:'
-        cells[1].text = audit_data[0]['address']
-    
-    # Danh sách thành viên tham gia và đánh giá viên
-    if participants_data:
-        doc.add_heading('THÀNH VIÊN THAM GIA', level=3)
-        company_participants = [p for p in participants_data if p['role'] == 'company']
-        if company_participants:
-            table = doc.add_table(rows=1, cols=2)
-            table.style = 'Table Grid'
-            hdr_cells = table.rows[0].cells
-            hdr_cells[0].text = 'Họ và tên'
-            hdr_cells[1].text = 'Chức vụ'
-            
-            for p in company_participants:
-                row_cells = table.add_row().cells
-                row_cells[0].text = p['fullname']
-                row_cells[1].text = p['position']
+        writer = DocxBodyWriter(doc)
+    
+        # Thông tin chung
+        if audit_data and len(audit_data) > 0:
+            writer.heading('Thông tin chung', level=3)
+            writer.table([
+                ['Bộ phận được đánh giá:', audit_data[0]['department']],
+                ['Người đối ứng:', audit_data[0]['person']],
+                ['Thời gian đánh giá:', audit_data[0]['audit_time']],
+                ['Địa chỉ:', audit_data[0]['address']]
+            ])
+    
+        # Danh sách thành viên tham gia và đánh giá viên
+        if participants_data:
+            writer.heading('THÀNH VIÊN THAM GIA', level=3)
+            company_participants = [p for p in participants_data if p['role'] == 'company']
+            if company_participants:
+                writer.table(
+                    [[p['fullname'], p['position']] for p in company_participants],
+                    header=['Họ và tên', 'Chức vụ']
+                )
         
-        doc.add_heading('ĐÁNH GIÁ VIÊN', level=3)
-        auditor_participants = [p for p in participants_data if p['role'] == 'auditor']
-        if auditor_participants:
-            table = doc.add_table(rows=1, cols=2)
-            table.style = 'Table Grid'
-            hdr_cells = table.rows[0].cells
-            hdr_cells[0].text = 'Họ và tên'
-            hdr_cells[1].text = 'Chức vụ'
-            
-            for p in auditor_participants:
-                row_cells = table.add_row().cells
-                row_cells[0].text = p['fullname']
-                row_cells[1].text = p['position']
-    
-    # Phân tích theo Frame
-    if audit_data:
-        frames = {}
-        for item in audit_data:
-            frame_id = item['frame_id']
-            if frame_id not in frames:
-                frames[frame_id] = []
-            frames[frame_id].append(item)
+            writer.heading('ĐÁNH GIÁ VIÊN', level=3)
+            auditor_participants = [p for p in participants_data if p['role'] == 'auditor']
+            if auditor_participants:
+                writer.table(
+                    [[p['fullname'], p['position']] for p in auditor_participants],
+                    header=['Họ và tên', 'Chức vụ']
+                )
+    
+        # Phân tích theo Frame
+        if audit_data:
+            phases.switch("data_prep")
+            frames = group_records(audit_data, 'frame_id')
+            phases.switch("layout")
         
-        for frame_id, frame_items in frames.items():
-            doc.add_heading(f'FRAME {frame_id}', level=3)
-            
-            # Thống kê kết quả
-            results = {'NCA': 0, 'NCB': 0, 'PI': 0, 'CM': 0}
-            for item in frame_items:
-                if item['result'] in results:
-                    results[item['result']] += 1
+            for frame_id, frame_items in frames:
+                writer.heading(f'FRAME {frame_id}', level=3)
             
-            table = doc.add_table(rows=2, cols=4)
-            table.style = 'Table Grid'
+                # Thống kê kết quả
+                with phases.phase("data_prep"):
+                    results = frame_result_counts(company_name, frame_id, frame_items, aggregates)
             
-            hdr_cells = table.rows[0].cells
-            hdr_cells[0].text = 'NCA'
-            hdr_cells[1].text = 'NCB'
-            hdr_cells[2].text = 'PI'
-            hdr_cells[3].text = 'CM'
-            
-            result_cells = table.rows[1].cells
-            result_cells[0].text = str(results['NCA'])
-            result_cells[1].text = str(results['NCB'])
-            result_cells[2].text = str(results['PI'])
-            result_cells[3].text = str(results['CM'])
+                writer.table(
+                    [[str(results['NCA']), str(results['NCB']), str(results['PI']), str(results['CM'])]],
+                    header=['NCA', 'NCB', 'PI', 'CM']
+                )
             
-            doc.add_paragraph()
+                writer.paragraph()
             
-            # Dữ liệu chi tiết
-            for idx, item in enumerate(frame_items):
-                doc.add_paragraph(f"Điều mục {idx+1}:")
+                # Dữ liệu chi tiết
+                for idx, item in enumerate(frame_items):
+                    writer.paragraph(f"Điều mục {idx+1}:")
                 
-                table = doc.add_table(rows=2, cols=5)
-                table.style = 'Table Grid'
-                
-                hdr_cells = table.rows[0].cells
-                hdr_cells[0].text = 'Điều khoản'
-                hdr_cells[1].text = 'Tên điều khoản'
-                hdr_cells[2].text = 'Các yêu cầu Tiêu chuẩn/Chuẩn mực đánh giá'
-                hdr_cells[3].text = 'Bằng chứng đánh giá'
-                hdr_cells[4].text = 'Kết quả đánh giá'
-                
-                data_cells = table.rows[1].cells
-                data_cells[0].text = item['clause']
-                data_cells[1].text = item['clause_name']
-                data_cells[2].text = item['requirements']
-                data_cells[3].text = item['evidence']
-                data_cells[4].text = item['result']
+                    writer.table(
+                        [[item['clause'], item['clause_name'], item['requirements'], item['evidence'], item['result']]],
+                        header=['Điều khoản', 'Tên điều khoản', 'Các yêu cầu Tiêu chuẩn/Chuẩn mực đánh giá',
+                                'Bằng chứng đánh giá', 'Kết quả đánh giá']
+                    )
                 
-                # Thêm hình ảnh nếu có
-                if item['image_url']:
-                    try:
-                        doc.add_paragraph("Hình ảnh bằng chứng:")
-                        img = process_image_for_export(item['image_url'])
-                        if img:
-                            with io.BytesIO() as img_stream:
-                                img.save(img_stream, format='JPEG')
-                                img_stream.seek(0)
-                                doc.add_picture(img_stream, width=Inches(4))
-                    except Exception as e:
-                        doc.add_paragraph(f"[Không thể hiển thị hình ảnh: {e}]")
+                    # Thêm hình ảnh nếu có
+                    if item['image_url']:
+                        try:
+                            writer.paragraph("Hình ảnh bằng chứng:")
+                            with phases.phase("image_fetch"):
+                                spooled = images.add(item['image_url'])
+                            if spooled:
+                                writer.picture(spooled[0], width=word.Inches(4))
+                        except Exception as e:
+                            writer.paragraph(f"[Không thể hiển thị hình ảnh: {e}]")
                 
-                doc.add_paragraph()
+                    writer.paragraph()
     
-    # Thêm ngày xuất báo cáo
-    current_date = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-    doc.add_paragraph(f"Báo cáo được xuất ngày: {current_date}")
+        # Thêm ngày xuất báo cáo
+        current_date = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        writer.paragraph(f"Báo cáo được xuất ngày: {current_date}")
     
+    phases.switch("serialize")
+    if output:
+        doc.save(output)
+        phases.record()
+        return output
     # Lưu vào memory buffer
     buffer = io.BytesIO()
     doc.save(buffer)
     docx = buffer.getvalue()
     buffer.close()
+    phases.record()
     return docx
+# ============ Admin ============
+def is_admin():
+    return st.session_state.get("user", {}).get("email") == "admin"
+
+def display_metrics_panel():
+    """Bảng metrics cho admin: thời gian lời gọi từ xa và các pha xuất báo cáo."""
+    with st.sidebar.expander("📈 Metrics hệ thống"):
+        rows = metrics().snapshot()
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
+        else:
+            st.caption("Chưa có số liệu.")
+        st.download_button(
+            "Tải metrics (Prometheus)",
+            metrics().to_prometheus(),
+            file_name="auditnote_metrics.prom",
+            mime="text/plain"
+        )
+
+def display_profiling_panel():
+    """Bật profiling cho phiên admin và xem các hàm tốn thời gian nhất của các hồ sơ gần đây."""
+    with st.sidebar.expander("🔥 Profiling"):
+        if PROFILE_ENV in PROFILE_MODES:
+            st.caption(f"Đang bật cho cả tiến trình (AUDITNOTE_PROFILE={PROFILE_ENV}).")
+        else:
+            choice = st.radio("Chế độ", ["Tắt", *PROFILE_MODES], horizontal=True, key="profile_choice")
+            st.session_state.profile_mode = None if choice == "Tắt" else choice
+        
+        profiles = list(profile_log())
+        if not profiles:
+            st.caption("Chưa có hồ sơ nào.")
+            return
+        labels = [f"{p['when']} {p['label']} ({p['mode']}, {p['seconds']}s)" for p in reversed(profiles)]
+        chosen = profiles[-1 - labels.index(st.selectbox("Hồ sơ", labels, key="profile_pick"))]
+        st.dataframe(pd.DataFrame(chosen["top"]), hide_index=True)
+        st.caption(chosen["path"])
+        if os.path.exists(chosen["path"]):
+            with open(chosen["path"], "rb") as f:
+                st.download_button("Tải file hồ sơ", f.read(), file_name=os.path.basename(chosen["path"]),
+                                   key="profile_download")
+
 # ============ Trang Chính ============
 def page_main():
     display_logos()
@@ -813,6 +2920,10 @@ def page_main():
             st.session_state.clear()
             st.rerun()
     
+    if is_admin():
+        display_metrics_panel()
+        display_profiling_panel()
+    
     # Initialize session state for audit data if needed
     if "audit_frames" not in st.session_state:
         st.session_state.audit_frames = {}
@@ -828,66 +2939,65 @@ def page_main():
             "auditors": []
         }
     
-    # Tab navigation
-    tab1, tab2, tab3 = st.tabs(["Ghi chép đánh giá", "Xem lại đánh giá", "Xuất báo cáo"])
-    
-    with tab1:
-        page_audit_entry()
-    
-    with tab2:
-        page_audit_review()
-    
-    with tab3:
-        page_export()
+    # Chỉ chạy trang đang xem (st.tabs chạy cả ba trang ở mỗi lần rerun)
+    views = {
+        "Ghi chép đánh giá": page_audit_entry,
+        "Xem lại đánh giá": page_audit_review,
+        "Xuất báo cáo": page_export,
+    }
+    view = st.radio("Trang", list(views), horizontal=True, key="main_view",
+                    label_visibility="collapsed")
+    views[view]()
 
-# ============ Trang Chính ============
-def page_main():
-    display_logos()
-    st.title("Hệ thống Đánh giá ISO")
-    
-    # Sidebar
-    with st.sidebar:
-        st.subheader(f"Xin chào, {st.session_state.user['fullname']}")
-        st.write(f"Chức vụ: {st.session_state.user['position']}")
-        
-        if st.button("Đổi mật khẩu"):
-            st.session_state.page = "change_password"
-            st.rerun()
-        
-        if st.button("Đăng xuất"):
-            st.session_state.clear()
-            st.rerun()
-    
-    # Initialize session state for audit data if needed
-    if "audit_frames" not in st.session_state:
-        st.session_state.audit_frames = {}
-    
-    if "current_frame" not in st.session_state:
-        st.session_state.current_frame = "1"
+# ============ Trang Nhập liệu đánh giá ============
+def page_audit_entry():
+    # Display the company information form at the top
+    company_info_form()
     
-    if "company_info" not in st.session_state:
-        st.session_state.company_info = {
-            "company_name": "",
-            "address": "",
-            "participants": [],
-            "auditors": []
+    # Frame management
+    st.subheader("Khung đánh giá")
+    
+    # Frame selector
+    available_frames = list(st.session_state.audit_frames.keys())
+    if not available_frames:
+        available_frames = ["1"]
+        st.session_state.audit_frames["1"] = {
+            "department": "",
+            "person": "",
+            "audit_time": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "panels": {}
         }
     
-    # Tab navigation
-    tab1, tab2, tab3 = st.tabs(["Ghi chép đánh giá", "Xem lại đánh giá", "Xuất báo cáo"])
+    frame_cols = st.columns([2, 1])
+    with frame_cols[0]:
+        selected_frame = st.selectbox(
+            "Chọn khung đánh giá", 
+            options=available_frames,
+            index=available_frames.index(st.session_state.current_frame)
+        )
+    
+    with frame_cols[1]:
+        if st.button("➕ Thêm khung đánh giá mới"):
+            new_frame_id = str(len(available_frames) + 1)
+            st.session_state.audit_frames[new_frame_id] = {
+                "department": "",
+                "person": "",
+                "audit_time": datetime.now().strftime("%Y-%m-%d %H:%M"),
+                "panels": {}
+            }
+            st.session_state.current_frame = new_frame_id
+            st.rerun()
     
-    with tab1:
-        page_audit_entry()
+    st.session_state.current_frame = selected_frame
     
-    with tab2:
-        page_audit_review()
+    # Frame details
+    frame_details_form(selected_frame)
     
-    with tab3:
-        page_export()
+    # Panel management for the current frame
+    handle_panel_management(selected_frame)
 
-# ============ Trang Nhập liệu đánh giá ============
-def page_audit_entry():
-    # Display the company information form at the top
+def company_info_form():
+    """Thông tin công ty, người tham gia và đánh giá viên (lưu vào session_state)."""
     with st.expander("Thông tin công ty", expanded=True):
         col1, col2 = st.columns(2)
         
@@ -979,45 +3089,11 @@ def page_audit_entry():
         if st.button("➕ Thêm đánh giá viên"):
             st.session_state.company_info["auditors"].append({"fullname": "", "position": ""})
             st.rerun()
-    
-    # Frame management
-    st.subheader("Khung đánh giá")
-    
-    # Frame selector
-    available_frames = list(st.session_state.audit_frames.keys())
-    if not available_frames:
-        available_frames = ["1"]
-        st.session_state.audit_frames["1"] = {
-            "department": "",
-            "person": "",
-            "audit_time": datetime.now().strftime("%Y-%m-%d %H:%M"),
-            "panels": {}
-        }
-    
-    frame_cols = st.columns([2, 1])
-    with frame_cols[0]:
-        selected_frame = st.selectbox(
-            "Chọn khung đánh giá", 
-            options=available_frames,
-            index=available_frames.index(st.session_state.current_frame)
-        )
-    
-    with frame_cols[1]:
-        if st.button("➕ Thêm khung đánh giá mới"):
-            new_frame_id = str(len(available_frames) + 1)
-            st.session_state.audit_frames[new_frame_id] = {
-                "department": "",
-                "person": "",
-                "audit_time": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                "panels": {}
-            }
-            st.session_state.current_frame = new_frame_id
-            st.rerun()
-    
-    st.session_state.current_frame = selected_frame
+
+def frame_details_form(selected_frame):
+    """Bộ phận, người đối ứng và thời gian của khung đang chọn."""
     current_frame_data = st.session_state.audit_frames[selected_frame]
     
-    # Frame details
     with st.expander(f"Chi tiết khung đánh giá #{selected_frame}", expanded=True):
         department = st.text_input(
             "Bộ phận được đánh giá",
@@ -1036,9 +3112,6 @@ def page_audit_entry():
             value=current_frame_data.get("audit_time", datetime.now().strftime("%Y-%m-%d %H:%M"))
         )
         st.session_state.audit_frames[selected_frame]["audit_time"] = audit_time
-    
-    # Panel management for the current frame
-    handle_panel_management(selected_frame)
 
 # ============ Panel Management ============
 def handle_panel_management(frame_id):
@@ -1079,6 +3152,15 @@ def handle_panel_management(frame_id):
     handle_panel_items(frame_id, selected_panel)
     
     # Add new item to the panel
+    new_item_form(frame_id, selected_panel)
+    
+    # Display statistics for this panel
+    display_panel_statistics(current_frame["panels"][selected_panel]["items"])
+
+def new_item_form(frame_id, selected_panel):
+    """Form thêm mục đánh giá mới vào panel đang chọn."""
+    current_frame = st.session_state.audit_frames[frame_id]
+    
     with st.expander("Thêm mục đánh giá mới", expanded=True):
         with st.form(key=f"new_item_form_{frame_id}_{selected_panel}"):
             cols1 = st.columns(3)
@@ -1110,54 +3192,45 @@ def handle_panel_management(frame_id):
             submit_button = st.form_submit_button("Thêm mục đánh giá")
             
             if submit_button:
-                # Handle file upload if present
-                image_url = None
-                if uploaded_file:
-                    creds = None
-                    if os.path.exists("credentials.json"):
-                        creds = Credentials.from_service_account_file("credentials.json", scopes=SCOPE)
-                    else:
-                        creds = Credentials.from_service_account_info(
-                            st.secrets["gcp_service_account"], scopes=SCOPE
-                        )
-                    
-                    drive_service = get_gdrive_service(creds)
-                    folder_id = st.secrets["google_drive"]["folder_id"]
-                    
-                    with st.spinner("Đang tải ảnh lên..."):
-                        image_url = upload_image_to_drive(drive_service, uploaded_file, folder_id)
-                
-                # Add the new item to the panel
                 new_item = {
                     "clause": new_clause,
                     "clause_name": new_clause_name,
                     "requirements": new_requirements,
                     "evidence": new_evidence,
-                    "image_url": image_url,
+                    "image_url": None,
                     "result": new_result,
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 }
                 
-                current_frame["panels"][selected_panel]["items"].append(new_item)
+                # Upload ảnh (nếu có) rồi ghi Notes, song song với ghi Participants
+                progress_bar = show_progress = None
+                if uploaded_file:
+                    progress_bar = st.progress(0.0, text="Đang tải ảnh lên...")
+                    show_progress = lambda done: progress_bar.progress(done, text=f"Đang tải ảnh lên... {done:.0%}")
+                with st.spinner("Đang lưu mục đánh giá..."):
+                    asyncio.run(submit_item_async(
+                        st.session_state.company_info["company_name"],
+                        st.session_state.company_info["address"],
+                        current_frame["department"],
+                        current_frame["person"],
+                        current_frame["audit_time"],
+                        frame_id,
+                        selected_panel,
+                        new_item,
+                        st.session_state.user["email"],
+                        uploaded_file,
+                        st.session_state.company_info["participants"],
+                        st.session_state.company_info["auditors"],
+                        show_progress,
+                    ))
+                if progress_bar:
+                    progress_bar.empty()
                 
-                # Save to Google Sheets
-                save_item_to_sheets(
-                    st.session_state.company_info["company_name"],
-                    st.session_state.company_info["address"],
-                    current_frame["department"],
-                    current_frame["person"],
-                    current_frame["audit_time"],
-                    frame_id,
-                    selected_panel,
-                    new_item,
-                    st.session_state.user["email"]
-                )
+                # Add the new item to the panel
+                current_frame["panels"][selected_panel]["items"].append(new_item)
                 
                 st.success("Đã thêm mục đánh giá mới!")
                 st.rerun()
-    
-    # Display statistics for this panel
-    display_panel_statistics(current_frame["panels"][selected_panel]["items"])
 
 def handle_panel_items(frame_id, panel_id):
     """Display and manage items in a panel"""
@@ -1187,27 +3260,64 @@ def handle_panel_items(frame_id, panel_id):
             
             st.write(f"*Thời gian ghi nhận: {item['timestamp']}*")
             
+            # Edit form (chỉ với mục đã lưu và có id)
+            if item.get("id") and st.checkbox("Sửa mục này", key=f"edit_toggle_{frame_id}_{panel_id}_{idx}"):
+                handle_item_edit(frame_id, panel_id, idx, item)
+            
             # Delete button
             if st.button("Xóa mục này", key=f"del_{frame_id}_{panel_id}_{idx}"):
-                current_panel["items"].pop(idx)
-                st.success("Đã xóa mục đánh giá!")
+                if item.get("id") and not delete_note(item["id"]):
+                    st.error("Không tìm thấy mục này trên Google Sheets!")
+                else:
+                    current_panel["items"].pop(idx)
+                    st.success("Đã xóa mục đánh giá!")
+                    st.rerun()
+
+def handle_item_edit(frame_id, panel_id, idx, item):
+    """Form sửa một mục đã lưu; ghi lại các cột thay đổi theo id."""
+    key = f"{frame_id}_{panel_id}_{idx}"
+    with st.form(key=f"edit_item_form_{key}"):
+        cols = st.columns(3)
+        with cols[0]:
+            clause = st.text_input("Điều khoản", value=item['clause'], key=f"edit_clause_{key}")
+        with cols[1]:
+            clause_name = st.text_input("Tên điều khoản", value=item['clause_name'], key=f"edit_clause_name_{key}")
+        with cols[2]:
+            result = st.selectbox(
+                "Kết quả đánh giá",
+                options=list(AUDIT_RESULTS),
+                index=list(AUDIT_RESULTS).index(item['result']) if item['result'] in AUDIT_RESULTS else 0,
+                key=f"edit_result_{key}"
+            )
+        requirements = st.text_area("Các yêu cầu Tiêu chuẩn/Chuẩn mực đánh giá",
+                                    value=item['requirements'], key=f"edit_requirements_{key}")
+        evidence = st.text_area("Bằng chứng đánh giá", value=item['evidence'], key=f"edit_evidence_{key}")
+        
+        if st.form_submit_button("Lưu thay đổi"):
+            edited = {
+                "clause": clause,
+                "clause_name": clause_name,
+                "requirements": requirements,
+                "evidence": evidence,
+                "result": result
+            }
+            changes = {k: v for k, v in edited.items() if v != item[k]}
+            if changes and not update_note(item["id"], changes):
+                st.error("Không tìm thấy mục này trên Google Sheets!")
+            else:
+                item.update(changes)
+                st.success("Đã cập nhật mục đánh giá!")
                 st.rerun()
 
 def display_panel_statistics(items):
-    """Display statistics for panel items"""
+    """Display statistics for the panel items of the current audit session"""
     st.subheader("Thống kê kết quả đánh giá")
     
-    results = {
-        "NCA": 0,
-        "NCB": 0,
-        "PI": 0,
-        "CM": 0
-    }
-    
-    for item in items:
-        result = item["result"]
-        if result in results:
-            results[result] += 1
+    # Chỉ đếm các mục của phiên đánh giá này: frame/panel id bắt đầu lại từ "1"
+    # ở mỗi cuộc đánh giá, nên bộ đếm toàn bảng (ResultAggregates) sẽ lẫn các
+    # lần đánh giá trước của cùng công ty.
+    counts = Counter(item["result"] for item in items)
+    results = {r: counts.get(r, 0) for r in AUDIT_RESULTS}
     
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("NCA", results["NCA"])
@@ -1217,12 +3327,12 @@ def display_panel_statistics(items):
     
     return results
 
-def save_item_to_sheets(company, address, department, person, audit_time, 
-                       frame_id, panel_id, item, auditor_email):
-    """Save an audit item to Google Sheets"""
-    notes_ws = gws()["notes"]
-    
-    row = [
+def note_row(company, address, department, person, audit_time,
+             frame_id, panel_id, item, auditor_email):
+    """Dòng Notes của một mục đánh giá; cấp id ổn định cho item nếu chưa có."""
+    # Id ổn định để sửa/xóa đúng dòng về sau
+    item.setdefault("id", new_note_id())
+    return [
         company,
         address,
         department,
@@ -1237,54 +3347,337 @@ def save_item_to_sheets(company, address, department, person, audit_time,
         item["image_url"] if item["image_url"] else "",
         item["result"],
         auditor_email,
-        item["timestamp"]
+        item["timestamp"],
+        item["id"]
     ]
-    
-    notes_ws.append_row(row)
+
+def save_item_to_sheets(company, address, department, person, audit_time, 
+                       frame_id, panel_id, item, auditor_email,
+                       participants=None, auditors=None):
+    """Save an audit item to Google Sheets
+
+    participants/auditors mặc định lấy từ st.session_state.company_info.
+    """
+    save_items_to_sheets(company, address, department, person, audit_time,
+                         frame_id, [(panel_id, item)], auditor_email, participants, auditors)
+
+def save_items_to_sheets(company, address, department, person, audit_time,
+                         frame_id, panel_items, auditor_email,
+                         participants=None, auditors=None):
+    """Ghi nhiều mục [(panel_id, item)] của một khung bằng một lời gọi append_rows."""
+    append_notes(company, address, department, person, audit_time,
+                 frame_id, panel_items, auditor_email)
     
     # Also save participants if not already saved
-    save_participants_to_sheets(company, frame_id)
+    save_participants_to_sheets(company, frame_id, participants, auditors)
+
+def append_notes(company, address, department, person, audit_time,
+                 frame_id, panel_items, auditor_email, invalidate=True):
+    """Append các dòng Notes của [(panel_id, item)] và cập nhật các chỉ mục.
+
+    ``invalidate=False`` khi người gọi tự làm mới ảnh chụp sau cả lượt ghi.
+    """
+    rows = [
+        note_row(company, address, department, person, audit_time,
+                 frame_id, panel_id, item, auditor_email)
+        for panel_id, item in panel_items
+    ]
+    if rows:
+        gws()["notes"].append_rows(rows)
+        for row in rows:
+            append_to_note_indexes(dict(zip(NOTES_HEADER, row)))
+        # Làm mới sau khi ghi: xóa trước thì lần đọc xen giữa sẽ lưu lại ảnh chụp cũ
+        if invalidate:
+            df_notes.clear()
+
+class SavedParticipants:
+    """Người tham gia đã có trên sheet Participants, theo (company, frame_id, role, fullname).
+
+    Sheet này chỉ được append nên số dòng của mỗi người không đổi: lần ghi sau
+    chỉ cần so danh sách trên form với chỉ mục (O(1) mỗi người) để biết ai mới
+    và ai đổi chức vụ, không phải tải và lọc cả bảng.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.people = {}  # khóa -> [số dòng trên sheet (None khi đang ghi), chức vụ]
+        self.df_rows = 0
+        self.synced = False
+
+    @staticmethod
+    def _key(row):
+        return tuple(str(row[f]) for f in ("company", "frame_id", "role", "fullname"))
+
+    def sync(self, part_df):
+        """Thêm các dòng mới của DataFrame Participants; dựng lại nếu bảng bị rút ngắn."""
+        with self._lock:
+            if len(part_df) < self.df_rows:
+                self.people.clear()
+                self.df_rows = 0
+            if len(part_df) > self.df_rows:
+                rows = part_df.iloc[self.df_rows:].to_dict("records")
+                for pos, row in enumerate(rows, self.df_rows + 2):  # dòng 1 là tiêu đề
+                    self.people[self._key(row)] = [pos, str(row["position"])]
+                self.df_rows = len(part_df)
+            self.synced = True
+
+    def diff(self, rows):
+        """Tách ``rows`` thành (dòng mới, [(số dòng, chức vụ mới)]).
+
+        Dòng mới được đánh dấu ngay là đã lưu để hai lần ghi đồng thời không
+        append trùng; gọi saved() sau khi ghi xong hoặc forget() nếu lỗi.
+        """
+        new, changed = [], []
+        with self._lock:
+            for row in rows:
+                entry = dict(zip(PARTICIPANTS_HEADER, row))
+                known = self.people.get(self._key(entry))
+                if known is None:
+                    self.people[self._key(entry)] = [None, entry["position"]]
+                    new.append(row)
+                elif known[1] != entry["position"] and known[0] is not None:
+                    known[1] = entry["position"]
+                    changed.append((known[0], entry["position"]))
+        return new, changed
+
+    def saved(self, rows, first_row):
+        with self._lock:
+            for offset, row in enumerate(rows):
+                known = self.people.get(self._key(dict(zip(PARTICIPANTS_HEADER, row))))
+                if known is not None and known[0] is None:
+                    known[0] = None if first_row is None else first_row + offset
+
+    def locate(self, rows, part_df):
+        """Lấy số dòng của ``rows`` từ bảng Participants vừa đọc lại; trả về các dòng vẫn chưa thấy."""
+        positions = {}
+        for pos, row in enumerate(part_df.to_dict("records"), 2):  # dòng 1 là tiêu đề
+            positions[self._key(row)] = pos
+        missing = []
+        with self._lock:
+            for row in rows:
+                key = self._key(dict(zip(PARTICIPANTS_HEADER, row)))
+                known = self.people.get(key)
+                if known is not None and known[0] is None:
+                    known[0] = positions.get(key)
+                    if known[0] is None:
+                        missing.append(row)
+        return missing
 
-def save_participants_to_sheets(company, frame_id):
-    """Save participants to Google Sheets"""
+    def forget(self, rows):
+        with self._lock:
+            for row in rows:
+                self.people.pop(self._key(dict(zip(PARTICIPANTS_HEADER, row))), None)
+
+@st.cache_resource
+def saved_participants():
+    return SavedParticipants()
+
+def appended_first_row(response):
+    """Số dòng đầu tiên của vùng vừa append, theo updatedRange trong phản hồi của API."""
+    updated = ((response or {}).get("updates") or {}).get("updatedRange", "")
+    match = re.search(r"![A-Z]+(\d+)", updated)
+    return int(match.group(1)) if match else None
+
+def save_participants_to_sheets(company, frame_id, participants=None, auditors=None, invalidate=True):
+    """Ghi người tham gia mới và chức vụ đã đổi của một khung lên Google Sheets."""
     part_ws = gws()["participants"]
     
-    # First, check if participants for this company and frame already exist
-    part_df = df_participants()
-    company_frame_parts = part_df[
-        (part_df['company'] == company) & 
-        (part_df['frame_id'] == frame_id)
-    ]
+    index = saved_participants()
+    if not index.synced:
+        index.sync(df_participants())
+    else:
+        # Ảnh chụp còn hạn (có thể do replica khác tải) mang theo dòng replica khác đã ghi
+        tables = snapshots().peek("tables")
+        if tables is not None:
+            index.sync(tables["participants"])
     
-    if not company_frame_parts.empty:
-        return  # Already saved
+    if participants is None:
+        participants = st.session_state.company_info["participants"]
+    if auditors is None:
+        auditors = st.session_state.company_info["auditors"]
     
-    # Add company participants
-    for participant in st.session_state.company_info["participants"]:
-        if participant["fullname"] and participant["position"]:
-            part_ws.append_row([
-                company,
-                frame_id,
-                participant["fullname"],
-                participant["position"],
-                "company"
-            ])
+    # Company participants và auditors, ghi chung một lời gọi append_rows
+    rows = [
+        [company, frame_id, person["fullname"], person["position"], role]
+        for people, role in ((participants, "company"), (auditors, "auditor"))
+        for person in people
+        if person["fullname"] and person["position"]
+    ]
+    new, changed = index.diff(rows)
+    if not new and not changed:
+        return  # Already saved
     
-    # Add auditors
-    for auditor in st.session_state.company_info["auditors"]:
-        if auditor["fullname"] and auditor["position"]:
-            part_ws.append_row([
-                company,
-                frame_id,
-                auditor["fullname"],
-                auditor["position"],
-                "auditor"
-            ])
+    if new:
+        try:
+            response = part_ws.append_rows(new)
+        except Exception:
+            index.forget(new)
+            raise
+        first_row = appended_first_row(response)
+        index.saved(new, first_row)
+        if first_row is None:
+            # Phản hồi không có updatedRange: đọc lại bảng để biết số dòng, nếu
+            # không lần đổi chức vụ sau của những người này sẽ không được ghi
+            part_df = read_columns(("participants", ["company", "frame_id", "fullname", "role"]))[0]
+            missing = index.locate(new, part_df)
+            if missing:
+                st.warning(f"Không xác định được số dòng của {len(missing)} người tham gia vừa lưu; "
+                           "đổi chức vụ của họ sẽ cần tải lại trang.")
+    if changed:
+        position_col = PARTICIPANTS_HEADER.index("position") + 1
+        part_ws.batch_update([
+            {"range": gspread.utils.rowcol_to_a1(row, position_col), "values": [[position]]}
+            for row, position in changed
+        ])
     
     # Clear cache
-    df_participants.clear()
+    if invalidate:
+        df_participants.clear()
+
+# ------------ Ghi dữ liệu bất đồng bộ ------------
+# Số lời gọi đồng thời tới mỗi dịch vụ, chung cho mọi phiên của tiến trình
+REMOTE_SLOTS = {"sheets": threading.BoundedSemaphore(8), "drive": threading.BoundedSemaphore(4)}
+
+def script_run_ctx():
+    """ScriptRunContext của phiên Streamlit đang chạy (None khi chạy dòng lệnh/API)."""
+    if HEADLESS:
+        return None
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    return get_script_run_ctx(suppress_warning=True)
+
+async def remote(kind, fn, *args, **kwargs):
+    """Chạy lời gọi chặn ``fn`` trong luồng phụ, giữ một suất của dịch vụ ``kind``.
+
+    Luồng phụ mượn ScriptRunContext của phiên gọi (để st.error hay
+    st.session_state vẫn dùng được) và trả lại khi xong.
+    """
+    ctx = script_run_ctx()
+
+    def run():
+        if ctx is not None:
+            from streamlit.runtime.scriptrunner import add_script_run_ctx
+            add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            with REMOTE_SLOTS[kind]:
+                return fn(*args, **kwargs)
+        finally:
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), None)
+    return await asyncio.to_thread(run)
+
+class NoteIdClaims:
+    """Id ghi chép mà tiến trình này đã nhận ghi (đang ghi hoặc đã ghi xong).
+
+    Kiểm tra "id đã có chưa" và việc nhận id diễn ra dưới cùng một khóa, nên
+    hai lần ghi đồng thời cùng id (gửi lại lô, hai request song song) chỉ có
+    một lần append. Chỉ có tác dụng trong một tiến trình: hai replica vẫn có
+    thể cùng ghi một id chưa có trên sheet.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ids = set()
+
+    def known(self, note_id):
+        with self._lock:
+            return note_id in self.ids or note_row_index().sheet_row(note_id) is not None
+
+    def claim(self, note_ids):
+        """Nhận các id chưa có (trên sheet hay đang ghi); trả về tập id đã nhận."""
+        index = note_row_index()
+        fresh = set()
+        with self._lock:
+            for note_id in note_ids:
+                if note_id not in self.ids and index.sheet_row(note_id) is None:
+                    self.ids.add(note_id)
+                    fresh.add(note_id)
+        return fresh
+
+    def release(self, note_ids):
+        """Trả lại id của lần ghi bị lỗi để gửi lại được."""
+        with self._lock:
+            self.ids.difference_update(note_ids)
+
+@st.cache_resource
+def note_id_claims():
+    return NoteIdClaims()
+
+async def save_items_async(company, address, department, person, audit_time,
+                           frame_id, panel_items, auditor_email,
+                           participants, auditors, before_notes=None):
+    """Như save_items_to_sheets nhưng ghi Notes và Participants song song.
+
+    ``before_notes`` (coroutine, vd. upload ảnh) được chờ xong trước khi
+    append Notes, vẫn chạy song song với phần Participants. Ảnh chụp bảng
+    được làm mới một lần, sau khi cả hai phần ghi đã xong (kể cả khi lỗi).
+    Mục có id đã ghi (hoặc đang được ghi) trong tiến trình bị bỏ qua
+    (NoteIdClaims); trả về danh sách id bị bỏ qua.
+    """
+    ids = [item.setdefault("id", new_note_id()) for _, item in panel_items]
+    claims = note_id_claims()
+    fresh = claims.claim(ids)
+    panel_items = [(panel_id, item) for panel_id, item in panel_items if item["id"] in fresh]
+
+    async def notes():
+        if not panel_items:
+            return
+        if before_notes is not None:
+            await before_notes
+        await remote("sheets", append_notes, company, address, department, person,
+                     audit_time, frame_id, panel_items, auditor_email, invalidate=False)
+    results = await asyncio.gather(
+        notes(),
+        remote("sheets", save_participants_to_sheets, company, frame_id, participants, auditors,
+               invalidate=False),
+        return_exceptions=True,
+    )
+    clear_tables()
+    if isinstance(results[0], BaseException):
+        claims.release(fresh)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return [note_id for note_id in ids if note_id not in fresh]
+
+async def submit_item_async(company, address, department, person, audit_time,
+                            frame_id, panel_id, item, auditor_email,
+                            uploaded_file, participants, auditors, progress=None):
+    """Đường lưu của form: upload ảnh -> append Notes, song song với ghi Participants."""
+    async def upload():
+        if uploaded_file:
+            item["image_url"] = await remote(
+                "drive", lambda: upload_image_to_drive(drive_service(), uploaded_file, drive_folder_id(), progress)
+            )
+    await save_items_async(company, address, department, person, audit_time,
+                           frame_id, [(panel_id, item)], auditor_email,
+                           participants, auditors, before_notes=upload())
 
 # ============ Review Audit Data ============
+def review_panels(frame_data):
+    """Nhóm dữ liệu một khung đánh giá theo panel: [(panel_id, panel_data)]."""
+    return [
+        (panel, frame_data[frame_data['panel_id'] == panel])
+        for panel in frame_data['panel_id'].unique()
+    ]
+
+def display_search_results(search_index, query, limit=20):
+    """Hiển thị kết quả tìm kiếm đã xếp hạng."""
+    start = time.perf_counter()
+    hits = search_index.search(query, limit=limit)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    st.caption(f"{len(hits)} kết quả ({elapsed_ms:.1f} ms)")
+    
+    for rank, (score, row) in enumerate(hits):
+        title = (f"{row['company']} · Khung {row['frame_id']} · Panel #{row['panel_id']} · "
+                 f"{row['clause']} - {row['clause_name']} ({row['result']})")
+        with st.expander(title, expanded=rank == 0):
+            st.write(f"**Bộ phận được đánh giá:** {row['department']} — **Người đối ứng:** {row['person']}")
+            st.write(f"**Các yêu cầu Tiêu chuẩn/Chuẩn mực đánh giá:** {row['requirements']}")
+            st.write(f"**Bằng chứng đánh giá:** {row['evidence']}")
+            if row.get('image_url'):
+                st.image(row['image_url'])
+            st.write(f"*Đánh giá bởi: {row['auditor']} — {row['timestamp']}*")
+
 def page_audit_review():
     """Page for reviewing past audit data"""
     st.subheader("Xem lại đánh giá")
@@ -1296,6 +3689,24 @@ def page_audit_review():
         st.info("Chưa có dữ liệu đánh giá nào.")
         return
     
+    sync_note_indexes(notes_df)
+    
+    review_search()
+    review_frame(notes_df)
+
+def review_search():
+    """Tìm kiếm toàn văn trên toàn bộ lịch sử ghi chép."""
+    query = st.text_input(
+        "🔎 Tìm trong yêu cầu, bằng chứng, tên điều khoản, bộ phận, người đối ứng",
+        key="review_search"
+    )
+    if query:
+        display_search_results(search_index(), query)
+
+def review_frame(notes_df):
+    """Chọn công ty/khung và hiển thị các panel của khung đó."""
+    aggregates = result_aggregates()
+    
     # Get unique companies
     companies = notes_df['company'].unique()
     selected_company = st.selectbox("Chọn công ty", options=companies)
@@ -1319,23 +3730,15 @@ def page_audit_review():
         st.write(f"**Thời gian đánh giá:** {first_row['audit_time']}")
         st.write(f"**Địa chỉ:** {first_row['address']}")
         
-        # Get panels for this frame
-        panels = frame_data['panel_id'].unique()
+        # Văn bản dài chỉ tải cho các mục của khung đang xem
+        texts = note_texts(frame_data['id'].tolist())
+        empty_texts = dict.fromkeys(NOTE_TEXT_COLUMNS, "")
         
-        for panel in panels:
+        for panel, panel_data in review_panels(frame_data):
             st.subheader(f"Panel #{panel}")
             
-            # Get items for this panel
-            panel_data = frame_data[frame_data['panel_id'] == panel]
-            
             # Display panel statistics
-            results = {
-                "NCA": sum(panel_data['result'] == "NCA"),
-                "NCB": sum(panel_data['result'] == "NCB"),
-                "PI": sum(panel_data['result'] == "PI"),
-                "CM": sum(panel_data['result'] == "CM")
-            }
-            
+            results = aggregates.counts_for(selected_company, selected_frame, panel)
             col1, col2, col3, col4 = st.columns(4)
             col1.metric("NCA", results["NCA"])
             col2.metric("NCB", results["NCB"])
@@ -1344,6 +3747,7 @@ def page_audit_review():
             
             # Display items
             for idx, item in panel_data.iterrows():
+                item = dict(item, **texts.get(item['id'], empty_texts))
                 with st.expander(f"Mục đánh giá: {item['clause']} - {item['clause_name']}", expanded=False):
                     cols = st.columns(3)
                     cols[0].write(f"**Điều khoản:** {item['clause']}")
@@ -1364,6 +3768,31 @@ def page_audit_review():
                     st.write(f"*Thời gian ghi nhận: {item['timestamp']}*")
 
 # ============ Export Page ============
+def filename_part(text):
+    """Phần tên file an toàn: mọi ký tự ngoài chữ, số, ``_``, ``.`` và ``-`` thành ``_``."""
+    return re.sub(r"[^\w.-]+", "_", str(text)).strip("._") or "_"
+
+def report_filename(company, ext, frame_id=None, when=None):
+    """Tên file báo cáo (không chứa dấu phân cách thư mục, dùng được cho dòng lệnh ghi ra đĩa)."""
+    company_name_safe = filename_part(company)
+    date_str = (when or datetime.now()).strftime("%Y%m%d_%H%M%S")
+    frame_part = f"_khung_{filename_part(frame_id)}" if frame_id is not None else ""
+    return f"bao_cao_danh_gia_iso_{company_name_safe}{frame_part}_{date_str}.{ext}"
+
+def export_records(filtered_data, filtered_participants):
+    """RecordBatch cho các hàm xuất; văn bản dài chỉ tải cho các dòng được xuất."""
+    prep = PhaseTimer("records")
+    prep.switch("data_prep")
+    audit_data = RecordBatch.from_frame(filtered_data, NOTE_CATEGORICAL, datetimes=("timestamp",))
+    ids = audit_data.column('id')
+    texts = note_texts(ids)
+    empty = dict.fromkeys(NOTE_TEXT_COLUMNS, "")
+    for name in NOTE_TEXT_COLUMNS:
+        audit_data.set_column(name, [texts.get(i, empty)[name] for i in ids])
+    participants_data = RecordBatch.from_frame(filtered_participants, PARTICIPANT_CATEGORICAL)
+    prep.record()
+    return audit_data, participants_data
+
 def page_export():
     """Page for exporting audit data"""
     st.subheader("Xuất báo cáo đánh giá")
@@ -1376,6 +3805,9 @@ def page_export():
         st.info("Chưa có dữ liệu đánh giá nào để xuất báo cáo.")
         return
     
+    sync_note_indexes(notes_df)
+    aggregates = result_aggregates()
+    
     # Get unique companies
     companies = notes_df['company'].unique()
     selected_company = st.selectbox("Chọn công ty", options=companies, key="export_company")
@@ -1401,72 +3833,345 @@ def page_export():
             filtered_data = company_data[company_data['frame_id'] == selected_frame]
             filtered_participants = company_participants[company_participants['frame_id'] == selected_frame]
         
-        # Prepare data for export
-        audit_data = []
-        for _, row in filtered_data.iterrows():
-            audit_data.append({
-                'company': row['company'],
-                'address': row['address'],
-                'department': row['department'],
-                'person': row['person'],
-                'audit_time': row['audit_time'],
-                'frame_id': row['frame_id'],
-                'panel_id': row['panel_id'],
-                'clause': row['clause'],
-                'clause_name': row['clause_name'],
-                'requirements': row['requirements'],
-                'evidence': row['evidence'],
-                'image_url': row['image_url'],
-                'result': row['result'],
-                'auditor': row['auditor'],
-                'timestamp': row['timestamp']
-            })
-        
-        participants_data = []
-        for _, row in filtered_participants.iterrows():
-            participants_data.append({
-                'company': row['company'],
-                'frame_id': row['frame_id'],
-                'fullname': row['fullname'],
-                'position': row['position'],
-                'role': row['role']
-            })
-        
         # Add export buttons
         col1, col2 = st.columns(2)
         
         with col1:
             if st.button("Xuất PDF"):
                 with st.spinner("Đang tạo file PDF..."):
-                    pdf_data = export_to_pdf(selected_company, audit_data, participants_data)
-                    company_name_safe = selected_company.replace(' ', '_')
-                    date_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"bao_cao_danh_gia_iso_{company_name_safe}_{date_str}.pdf"
+                    audit_data, participants_data = export_records(filtered_data, filtered_participants)
+                    pdf_data = export_to_pdf(selected_company, audit_data, participants_data, aggregates)
+                    filename = report_filename(selected_company, "pdf")
                     
-                    st.markdown(
-                        get_download_link(pdf_data, filename, "📥 Tải xuống file PDF"),
-                        unsafe_allow_html=True
-                    )
+                    st.download_button("📥 Tải xuống file PDF", pdf_data, file_name=filename,
+                                       mime="application/pdf")
         
         with col2:
             if st.button("Xuất Word"):
                 with st.spinner("Đang tạo file Word..."):
-                    docx_data = export_to_word(selected_company, audit_data, participants_data)
-                    company_name_safe = selected_company.replace(' ', '_')
-                    date_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"bao_cao_danh_gia_iso_{company_name_safe}_{date_str}.docx"
+                    audit_data, participants_data = export_records(filtered_data, filtered_participants)
+                    docx_data = export_to_word(selected_company, audit_data, participants_data, aggregates)
+                    filename = report_filename(selected_company, "docx")
                     
-                    st.markdown(
-                        get_download_link(docx_data, filename, "📥 Tải xuống file Word"),
-                        unsafe_allow_html=True
+                    st.download_button(
+                        "📥 Tải xuống file Word", docx_data, file_name=filename,
+                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
                     )
     else:
         st.warning("Không có khung đánh giá nào cho công ty này.")
 
+# ============ API nhận dữ liệu từ thiết bị (ingest) ============
+# POST /api/findings, header "Authorization: Bearer <token>". Thân là JSON, hoặc
+# multipart với trường "payload" (JSON) và các file ảnh. Một khung đánh giá:
+#   {"company", "address", "department", "person", "audit_time", "frame_id",
+#    "participants": [{"fullname", "position"}], "auditors": [...],
+#    "findings": [{"panel_id", "clause", "requirements", "evidence", "result",
+#                  "timestamp"?, "id"?, "photo"?}]}
+# hoặc {"frames": [<khung>, ...]}. "photo" là tên trường file (multipart) hoặc
+# {"name", "content_type", "data": base64}. Mục có "id" đã tồn tại được bỏ qua,
+# nên thiết bị gửi lại cả lô sau khi lỗi mạng không tạo bản ghi trùng; hai mục
+# cùng "id" trong một lô bị từ chối. Chống trùng chỉ trong một tiến trình
+# (NoteIdClaims): hai replica nhận cùng lô cùng lúc vẫn có thể ghi trùng.
+INGEST_FRAME_FIELDS = ("company", "address", "department", "person", "audit_time", "frame_id")
+
+def ingest_tokens():
+    """{token: email đánh giá viên} từ AUDITNOTE_INGEST_TOKENS ("tok=email,...") hoặc secrets."""
+    raw = os.environ.get("AUDITNOTE_INGEST_TOKENS")
+    if raw:
+        return dict(pair.strip().split("=", 1) for pair in raw.split(",") if "=" in pair)
+    try:
+        return dict(st.secrets.get("ingest_tokens", {}))
+    except Exception:
+        return {}
+
+def ingest_auditor(authorization):
+    """Email đánh giá viên ứng với header Authorization, hoặc None."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    for known, email in ingest_tokens().items():
+        if hmac.compare_digest(known.encode(), token.strip().encode()):
+            return email
+    return None
+
+def _ingest_photo(photo, files, where, errors):
+    if not photo:
+        return None
+    if isinstance(photo, str):
+        if photo not in files:
+            errors.append(f"{where}: không có file '{photo}' trong request")
+            return None
+        return files[photo]
+    if isinstance(photo, dict) and photo.get("data") and photo.get("name"):
+        try:
+            data = base64.b64decode(photo["data"], validate=True)
+        except (ValueError, TypeError):
+            errors.append(f"{where}: photo.data không phải base64")
+            return None
+        return UploadedPhoto(data, photo["name"], photo.get("content_type") or "image/jpeg")
+    errors.append(f"{where}: photo không hợp lệ")
+    return None
+
+def validate_ingest(payload, files=None):
+    """Kiểm tra lô dữ liệu theo cấu trúc Notes; trả về (frames, errors)."""
+    files = files or {}
+    if not isinstance(payload, dict):
+        return [], ["payload phải là object JSON"]
+    raw_frames = payload["frames"] if "frames" in payload else [payload]
+    if not isinstance(raw_frames, list):
+        return [], ["frames phải là danh sách"]
+    frames, errors, seen_ids = [], [], set()
+    for f_idx, raw in enumerate(raw_frames):
+        where = f"frames[{f_idx}]"
+        if not isinstance(raw, dict):
+            errors.append(f"{where}: phải là object")
+            continue
+        frame = {k: str(raw.get(k) or "").strip() for k in INGEST_FRAME_FIELDS}
+        for k in ("company", "frame_id"):
+            if not frame[k]:
+                errors.append(f"{where}.{k}: bắt buộc")
+        frame["participants"] = [p for p in raw.get("participants") or [] if isinstance(p, dict)]
+        frame["auditors"] = [p for p in raw.get("auditors") or [] if isinstance(p, dict)]
+        for people in (frame["participants"], frame["auditors"]):
+            for p in people:
+                p["fullname"], p["position"] = str(p.get("fullname") or ""), str(p.get("position") or "")
+        findings = raw.get("findings")
+        if not isinstance(findings, list) or not findings:
+            errors.append(f"{where}.findings: cần ít nhất một mục")
+            findings = []
+        frame["findings"] = []
+        for i_idx, item in enumerate(findings):
+            at = f"{where}.findings[{i_idx}]"
+            if not isinstance(item, dict):
+                errors.append(f"{at}: phải là object")
+                continue
+            clause = str(item.get("clause") or "").strip()
+            result = str(item.get("result") or "").strip()
+            panel_id = str(item.get("panel_id") or "").strip()
+            if clause not in ISO_CLAUSE_DATA:
+                errors.append(f"{at}.clause: '{clause}' không có trong ISO 50001")
+            if result not in AUDIT_RESULTS:
+                errors.append(f"{at}.result: phải là một trong {', '.join(AUDIT_RESULTS)}")
+            if not panel_id:
+                errors.append(f"{at}.panel_id: bắt buộc")
+            timestamp = str(item.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            try:
+                datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                errors.append(f"{at}.timestamp: định dạng YYYY-MM-DD HH:MM:SS")
+            finding = {
+                "panel_id": panel_id,
+                "clause": clause,
+                "clause_name": str(item.get("clause_name") or ISO_CLAUSE_DATA.get(clause, "")),
+                "requirements": str(item.get("requirements") or ""),
+                "evidence": str(item.get("evidence") or ""),
+                "image_url": None,
+                "result": result,
+                "timestamp": timestamp,
+                "photo": _ingest_photo(item.get("photo"), files, at, errors),
+            }
+            if item.get("id"):
+                finding["id"] = str(item["id"])
+                if finding["id"] in seen_ids:
+                    errors.append(f"{at}.id: '{finding['id']}' trùng với một mục khác trong lô")
+                seen_ids.add(finding["id"])
+            frame["findings"].append(finding)
+        frames.append(frame)
+    return frames, errors
+
+async def ingest_frames(frames, auditor_email):
+    """Upload ảnh đồng thời rồi ghi mỗi khung bằng một append_rows; trả về tóm tắt."""
+    index = note_row_index()
+    claims = note_id_claims()
+    if not index.synced:
+        await remote("sheets", lambda: sync_note_indexes(df_notes()))
+    folder_id = drive_folder_id() if any(f["photo"] for fr in frames for f in fr["findings"]) else None
+    failed = []
+
+    uploads = DriveUploads(folder_id)
+
+    def fail(finding, error):
+        failed.append({"id": finding.get("id"), "clause": finding["clause"], "error": f"ảnh: {error}"})
+        finding["failed"] = True
+
+    async def upload(finding):
+        try:
+            finding["image_url"] = await remote(
+                "drive", lambda: store_image_on_drive(drive_service(), finding["photo"], folder_id, uploads)
+            )
+        except Exception as e:
+            fail(finding, e)
+
+    pending = [
+        f for fr in frames for f in fr["findings"]
+        if f["photo"] is not None and not (f.get("id") and claims.known(f["id"]))
+    ]
+    await asyncio.gather(*(upload(f) for f in pending))
+    # Quyền xem của mọi ảnh mới trong một batch request (hoặc theo thư mục)
+    if uploads.pending:
+        new_urls = [drive_image_url(file_id) for file_id, _, _ in uploads.pending.values()]
+        try:
+            errors = await remote("drive", lambda: uploads.commit(drive_service()))
+        except Exception as e:
+            errors = dict.fromkeys(new_urls, e)
+        for finding in pending:
+            if finding.get("image_url") in errors:
+                fail(finding, errors[finding["image_url"]])
+
+    saved, skipped, writes = [], [], []
+    for frame in frames:
+        panel_items = []
+        for finding in frame["findings"]:
+            if finding.get("failed"):
+                continue
+            if finding.get("id") and claims.known(finding["id"]):
+                skipped.append(finding["id"])
+                continue
+            item = {k: v for k, v in finding.items() if k not in ("panel_id", "photo")}
+            item.setdefault("id", new_note_id())
+            panel_items.append((finding["panel_id"], item))
+        if panel_items:
+            writes.append(save_items_async(
+                *(frame[k] for k in INGEST_FRAME_FIELDS),
+                panel_items, auditor_email, frame["participants"], frame["auditors"],
+            ))
+            saved.extend(item["id"] for _, item in panel_items)
+    # Request khác cùng id có thể đã nhận id giữa lần kiểm tra ở trên và lúc ghi
+    for raced in await asyncio.gather(*writes):
+        skipped.extend(raced)
+    raced = set(skipped)
+    saved = [note_id for note_id in saved if note_id not in raced]
+    return {"saved": saved, "skipped": skipped, "failed": failed}
+
+def ingest_app():
+    """Ứng dụng Tornado của API ingest (Tornado có sẵn cùng Streamlit)."""
+    import tornado.web
+
+    class FindingsHandler(tornado.web.RequestHandler):
+        async def post(self):
+            auditor = ingest_auditor(self.request.headers.get("Authorization"))
+            if not auditor:
+                self.set_status(401)
+                self.write({"errors": ["token không hợp lệ"]})
+                return
+            try:
+                if self.request.headers.get("Content-Type", "").startswith("multipart/"):
+                    payload = json.loads(self.get_body_argument("payload"))
+                    files = {
+                        name: UploadedPhoto(parts[0].body, parts[0].filename, parts[0].content_type)
+                        for name, parts in self.request.files.items() if parts
+                    }
+                else:
+                    payload, files = json.loads(self.request.body or b"null"), {}
+            except (ValueError, tornado.web.MissingArgumentError) as e:
+                self.set_status(400)
+                self.write({"errors": [f"không đọc được dữ liệu: {e}"]})
+                return
+            frames, errors = validate_ingest(payload, files)
+            if errors:
+                self.set_status(400)
+                self.write({"errors": errors})
+                return
+            with remote_call("ingest", "api"):
+                result = await ingest_frames(frames, auditor)
+            self.set_status(207 if result["failed"] else 200)
+            self.write(result)
+
+    return tornado.web.Application([(r"/api/findings", FindingsHandler)], log_function=lambda handler: None)
+
+# Mặc định chỉ nghe trên máy này (như /metrics); mở ra mạng phải đặt host rõ ràng
+INGEST_DEFAULT_HOST = "127.0.0.1"
+
+def serve_ingest(port, host=INGEST_DEFAULT_HOST):
+    """Chạy API ingest (chặn) trên event loop của luồng hiện tại."""
+    max_body = int(os.environ.get("AUDITNOTE_INGEST_MAX_MB", "64")) * 2**20
+
+    async def serve():
+        ingest_app().listen(port, address=host, max_body_size=max_body)
+        await asyncio.Event().wait()
+    asyncio.run(serve())
+
+@st.cache_resource
+def ingest_server():
+    """Mở API ingest trong luồng nền nếu đặt AUDITNOTE_INGEST_PORT (một lần mỗi tiến trình)."""
+    port = os.environ.get("AUDITNOTE_INGEST_PORT")
+    if not port:
+        return None
+    host = os.environ.get("AUDITNOTE_INGEST_HOST", INGEST_DEFAULT_HOST)
+    thread = threading.Thread(target=serve_ingest, args=(int(port), host), name="auditnote-ingest", daemon=True)
+    thread.start()
+    return thread
+
+# ============ Làm nóng khi khởi động ============
+class WarmUp:
+    """Chạy các bước làm nóng (trong luồng nền); ``ready`` được bật khi mọi bước đã chạy xong.
+
+    Lỗi của một bước được ghi lại và không chặn các bước sau: người dùng đầu
+    tiên khi đó chỉ phải trả lại đúng phần còn thiếu.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.ready = threading.Event()
+        self.results = {}
+
+    def start(self):
+        threading.Thread(target=self.run, name="auditnote-warmup", daemon=True).start()
+        return self
+
+    def run(self):
+        for name, step in self.steps:
+            start = time.perf_counter()
+            try:
+                step()
+                self.results[name] = {"seconds": round(time.perf_counter() - start, 3)}
+            except Exception as e:
+                self.results[name] = {"seconds": round(time.perf_counter() - start, 3),
+                                      "error": f"{type(e).__name__}: {e}"}
+        self.ready.set()
+        return self
+
+    @property
+    def failed(self):
+        return [name for name, result in self.results.items() if "error" in result]
+
+def _warm_indexes():
+    sync_note_indexes(df_notes())
+    saved_participants().sync(df_participants())
+
+WARMUP_STEPS = (
+    ("sheets", lambda: gws()),                  # mở AuditNote_DB, kiểm tra tiêu đề
+    ("tables", lambda: load_tables()),          # ảnh chụp bảng, dùng chung với replica khác
+    ("indexes", lambda: _warm_indexes()),       # thống kê, vị trí dòng, người tham gia đã lưu
+    ("fonts", lambda: pdf_font()),
+    ("logos", lambda: logo_images()),
+)
+
+@st.cache_resource
+def warm_up():
+    """Bắt đầu làm nóng một lần mỗi tiến trình (tắt bằng AUDITNOTE_WARMUP=0)."""
+    if os.environ.get("AUDITNOTE_WARMUP") == "0":
+        return None
+    return WarmUp(WARMUP_STEPS).start()
+
 # ============ Main App ============
 def main():
+    # Mỗi rerun là một hồ sơ khi profiling bật
+    with profiled("rerun"):
+        route()
+
+def route():
     # Load CSS
     load_css()
+    # Một lần mỗi tiến trình (st.cache_resource), nhưng Streamlit chỉ chạy script
+    # khi phiên đầu tiên kết nối nên không có chỗ nào chạy sớm hơn; phần làm nóng
+    # trước khi mở dịch vụ là `python auditnote.py warm-up`
+    state = warm_up()
+    metrics_server()
+    ingest_server()
+    
+    if state is not None and not state.ready.is_set():
+        st.caption("⏳ Máy chủ đang khởi động, lần tải đầu có thể chậm hơn.")
     
     # Initialize session state variables if they don't exist
     if "is_logged_in" not in st.session_state:
@@ -1487,5 +4192,179 @@ def main():
         else:
             page_main()
 
+# ============ Dòng lệnh (không cần Streamlit) ============
+REPORT_FORMATS = {"pdf": export_to_pdf, "docx": export_to_word}
+
+def select_report_data(notes_df, participants_df, company, frame_id=None, date_from=None, date_to=None):
+    """Lọc Notes/Participants của một công ty theo khung và khoảng ngày đánh giá (audit_time)."""
+    notes = notes_df[notes_df['company'] == company]
+    participants = participants_df[participants_df['company'] == company]
+    if frame_id is not None:
+        notes = notes[notes['frame_id'] == frame_id]
+        participants = participants[participants['frame_id'] == frame_id]
+    if date_from is not None or date_to is not None:
+        day = pd.to_datetime(notes['audit_time'].astype(str), errors="coerce").dt.date
+        keep = day.notna()
+        if date_from is not None:
+            keep &= day >= date_from
+        if date_to is not None:
+            keep &= day <= date_to
+        notes = notes[keep]
+        participants = participants[participants['frame_id'].isin(notes['frame_id'].unique())]
+    return notes, participants
+
+def plan_reports(companies=None, frames=None, per_frame=False, date_from=None, date_to=None):
+    """Danh sách công việc (company, frame_id|None) cần xuất, bỏ qua phần không có dữ liệu."""
+    notes_df, participants_df = df_notes(), df_participants()
+    jobs = []
+    for company in companies or notes_df['company'].unique().tolist():
+        notes, _ = select_report_data(notes_df, participants_df, company, None, date_from, date_to)
+        available = [f for f in notes['frame_id'].unique().tolist() if not frames or f in frames]
+        if not available:
+            continue
+        if per_frame or frames:
+            jobs.extend((company, f) for f in available)
+        else:
+            jobs.append((company, None))
+    return jobs
+
+def build_report(job):
+    """Tạo các file báo cáo của một công việc. Chạy được trong tiến trình con.
+
+    Trả về [(tên file, nội dung)], hoặc [(tên file, đường dẫn)] khi công việc có
+    ``out_dir``: khi đó báo cáo được ghi thẳng ra đĩa, ảnh theo ngân sách ``memory_mb``.
+    """
+    company, frame_id, formats, date_from, date_to, out_dir, memory_mb = job
+    notes_df, participants_df = df_notes(), df_participants()
+    notes, participants = select_report_data(notes_df, participants_df, company, frame_id, date_from, date_to)
+    aggregates = None
+    if date_from is None and date_to is None:
+        # Bộ đếm theo khung chỉ đúng khi xuất trọn khung (không lọc theo ngày)
+        sync_note_indexes(notes_df)
+        aggregates = result_aggregates()
+    audit_data, participants_data = export_records(notes, participants)
+    when = datetime.now()
+    files = []
+    for fmt in formats:
+        name = report_filename(company, fmt, frame_id, when)
+        output = os.path.join(out_dir, name) if out_dir else None
+        files.append((name, REPORT_FORMATS[fmt](company, audit_data, participants_data, aggregates,
+                                                output=output, memory_mb=memory_mb)))
+    return files
+
+def _build_report_safe(job):
+    try:
+        return job, build_report(job), None
+    except Exception as e:
+        return job, [], f"{type(e).__name__}: {e}"
+
+def run_reports(jobs, workers=1):
+    """Chạy các công việc xuất báo cáo, song song bằng tiến trình khi workers > 1."""
+    if workers <= 1 or len(jobs) <= 1:
+        yield from map(_build_report_safe, jobs)
+        return
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    os.environ["AUDITNOTE_HEADLESS"] = "1"
+    # spawn: tiến trình con không thừa hưởng kết nối SQLite/HTTP của tiến trình cha
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_build_report_safe, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+def _parse_date(text):
+    return datetime.strptime(text, "%Y-%m-%d").date()
+
+def cli_report(args):
+    import zipfile
+    date_from = _parse_date(args.date_from) if args.date_from else None
+    date_to = _parse_date(args.date_to) if args.date_to else None
+    plans = plan_reports(args.company, args.frame, args.per_frame, date_from, date_to)
+    if not plans:
+        print("Không có dữ liệu phù hợp để xuất báo cáo.", file=sys.stderr)
+        return 1
+    archive = zipfile.ZipFile(args.zip, "w", zipfile.ZIP_DEFLATED) if args.zip else None
+    # Báo cáo luôn được ghi thẳng ra đĩa; với --zip thì qua thư mục tạm rồi nén từ file
+    staging = tempfile.TemporaryDirectory(prefix="auditnote_report_") if archive is not None else None
+    out_dir = staging.name if staging is not None else args.out
+    os.makedirs(out_dir, exist_ok=True)
+    memory_mb = export_memory_mb(args.memory_mb)
+    jobs = [(company, frame_id, args.format, date_from, date_to, out_dir, memory_mb) for company, frame_id in plans]
+    failed = 0
+    try:
+        for job, files, error in run_reports(jobs, args.workers):
+            label = job[0] + (f" / khung {job[1]}" if job[1] is not None else "")
+            if error:
+                failed += 1
+                print(f"LỖI {label}: {error}", file=sys.stderr)
+                continue
+            for name, path in files:
+                size = os.path.getsize(path)
+                if archive is not None:
+                    archive.write(path, name)
+                    os.remove(path)
+                print(f"{label}: {name} ({size} bytes)")
+    finally:
+        if archive is not None:
+            archive.close()
+            staging.cleanup()
+    return 1 if failed else 0
+
+def cli_migrate(args):
+    gws()  # tạo AuditNote_DB và chép dữ liệu từ các workbook cũ nếu cần
+    tables = load_tables()
+    for key in TABLE_COLUMNS:
+        print(f"{TABLES[key][0]}: {len(tables[key])} dòng")
+    # Images không nằm trong load_tables(): đọc riêng qua chỉ mục ảnh
+    print(f"{TABLES['images'][0]}: {len(drive_image_index())} ảnh")
+    return 0
+
+def cli_backfill_ids(args):
+    backfill_note_ids(gws()["notes"])
+    clear_tables()
+    print(f"Notes: {len(df_notes())} dòng, đã cấp id cho các dòng còn thiếu")
+    return 0
+
+def cli_warm_up(args):
+    state = WarmUp(WARMUP_STEPS).run()
+    for name, result in state.results.items():
+        print(f"{name}: {result['seconds']}s" + (f" LỖI {result['error']}" if "error" in result else ""))
+    return 1 if state.failed else 0
+
+def cli_main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="auditnote", description="Xuất báo cáo và bảo trì dữ liệu (không cần Streamlit)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    report = sub.add_parser("report", help="xuất báo cáo PDF/Word")
+    report.add_argument("--company", action="append", help="tên công ty (lặp lại được; mặc định: tất cả)")
+    report.add_argument("--frame", action="append", help="khung đánh giá (lặp lại được); mỗi khung một báo cáo")
+    report.add_argument("--per-frame", action="store_true", help="tách mỗi khung thành một báo cáo")
+    report.add_argument("--from", dest="date_from", help="từ ngày đánh giá YYYY-MM-DD")
+    report.add_argument("--to", dest="date_to", help="đến ngày đánh giá YYYY-MM-DD")
+    report.add_argument("--format", nargs="+", choices=sorted(REPORT_FORMATS), default=["pdf", "docx"])
+    report.add_argument("--workers", type=int, default=1, help="số tiến trình chạy song song")
+    report.add_argument("--memory-mb", type=float, help=f"ngân sách bộ nhớ mỗi báo cáo, thu nhỏ ảnh cho vừa (mặc định: {EXPORT_MEMORY_ENV})")
+    dest = report.add_mutually_exclusive_group()
+    dest.add_argument("--out", default="reports", help="thư mục ghi file (mặc định: reports)")
+    dest.add_argument("--zip", help="ghi tất cả vào một file ZIP")
+    report.set_defaults(handler=cli_report)
+
+    sub.add_parser("migrate", help="tạo AuditNote_DB và chuyển dữ liệu từ các workbook cũ").set_defaults(handler=cli_migrate)
+    sub.add_parser("backfill-ids", help="cấp id cho các dòng Notes còn thiếu").set_defaults(handler=cli_backfill_ids)
+
+    sub.add_parser("warm-up", help="làm nóng cache dùng chung (bảng, chỉ mục) trước khi mở dịch vụ").set_defaults(handler=cli_warm_up)
+
+    ingest = sub.add_parser("serve-ingest", help="chạy API nhận dữ liệu từ thiết bị")
+    ingest.add_argument("--port", type=int, default=int(os.environ.get("AUDITNOTE_INGEST_PORT", "8600")))
+    ingest.add_argument("--host", default=os.environ.get("AUDITNOTE_INGEST_HOST", INGEST_DEFAULT_HOST),
+                        help=f"địa chỉ nghe (mặc định {INGEST_DEFAULT_HOST}; 0.0.0.0 để nhận từ mạng)")
+    ingest.set_defaults(handler=lambda args: serve_ingest(args.port, args.host))
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
 if __name__ == "__main__":
+    if HEADLESS:
+        sys.exit(cli_main())
     main()
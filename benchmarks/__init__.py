@@ -0,0 +1,22 @@
+"""Benchmark chạy offline cho auditnote.
+
+Các đường nóng của ứng dụng (``_df``, ``load_tables``, lọc dữ liệu ở trang xem lại,
+``save_item_to_sheets``, ``export_to_pdf``, ``export_to_word``,
+``convert_heic_to_jpeg``) vốn cần Google Sheets/Drive thật. Gói này cung cấp:
+
+- ``datagen``: sinh bộ dữ liệu đánh giá giả lập (công ty × khung × panel × mục,
+  có hoặc không kèm ảnh).
+- ``fakes``: worksheet/spreadsheet/client ``gspread`` và Drive service chạy
+  trong tiến trình, có độ trễ cấu hình được.
+- ``run``: đo thời gian/bộ nhớ lặp lại được, xuất kết quả JSON và so sánh với
+  một lần chạy trước để phát hiện hồi quy.
+- ``imports``: ngân sách thời gian import của auditnote và kiểm tra các thư
+  viện nặng vẫn được import lười.
+- ``loadtest``: N phiên đồng thời trên một bản thay Sheets/Drive qua HTTP có
+  quota và độ trễ, báo cáo throughput, p50/p95/p99 và tỉ lệ lỗi theo thao tác.
+
+Chạy từ thư mục gốc của repo::
+
+    python -m benchmarks.run --companies 3 --frames 4 --panels 3 --findings 10 \\
+        --images --out bench.json --baseline previous.json
+"""
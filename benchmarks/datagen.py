@@ -0,0 +1,127 @@
+"""Sinh bộ dữ liệu đánh giá giả lập với kích thước và nội dung giống thực tế."""
+import io
+import random
+import hashlib
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+import auditnote
+
+DEPARTMENTS = ["Phòng Kỹ thuật", "Phòng Năng lượng", "Xưởng sản xuất", "Phòng Hành chính", "Kho vận"]
+PEOPLE = ["Nguyễn Văn An", "Trần Thị Bình", "Lê Hoàng Cường", "Phạm Thu Dung", "Đỗ Minh Đức"]
+POSITIONS = ["Trưởng phòng", "Phó phòng", "Kỹ sư năng lượng", "Quản đốc", "Chuyên viên"]
+WORDS = (
+    "đánh giá hồ sơ năng lượng thiết bị đo lường kiểm soát vận hành bảo trì "
+    "chỉ số hiệu suất đường cơ sở mục tiêu kế hoạch đào tạo nhận thức tài liệu "
+    "lưu trữ phê duyệt biên bản khắc phục cải tiến rủi ro cơ hội lãnh đạo chính sách"
+).split()
+AUDITOR_PASSWORD = "auditor123"
+
+
+def _sentence(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def jpeg_bytes(rng, size=(800, 600), quality=85):
+    """Ảnh JPEG ngẫu nhiên có nhiễu để kích thước mã hóa gần với ảnh chụp thật."""
+    w, h = size
+    noise = bytes(rng.getrandbits(8) for _ in range((w // 8) * (h // 8) * 3))
+    img = Image.frombytes("RGB", (w // 8, h // 8), noise).resize(size)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def heic_bytes(rng, size=(800, 600)):
+    """Ảnh HEIC mã hóa từ một ảnh JPEG ngẫu nhiên (dùng cho convert_heic_to_jpeg)."""
+    import pillow_heif
+    img = Image.open(io.BytesIO(jpeg_bytes(rng, size)))
+    buf = io.BytesIO()
+    pillow_heif.from_pillow(img).save(buf, quality=80)
+    return buf.getvalue()
+
+
+class AuditDataset:
+    """Các bảng Auditors/Notes/Participants (gồm dòng tiêu đề) và ảnh theo URL."""
+
+    def __init__(self, auditors, notes, participants, images):
+        self.auditors = auditors
+        self.notes = notes
+        self.participants = participants
+        self.images = images
+
+    @property
+    def n_findings(self):
+        return len(self.notes) - 1
+
+    def records(self, company=None, frame_id=None):
+        """Dữ liệu dạng danh sách dict như page_export truyền cho các hàm xuất."""
+        header = self.notes[0]
+        notes = [dict(zip(header, row)) for row in self.notes[1:]]
+        parts = [dict(zip(self.participants[0], row)) for row in self.participants[1:]]
+        if company is not None:
+            notes = [n for n in notes if n["company"] == company]
+            parts = [p for p in parts if p["company"] == company]
+        if frame_id is not None:
+            notes = [n for n in notes if n["frame_id"] == frame_id]
+            parts = [p for p in parts if p["frame_id"] == frame_id]
+        return notes, parts
+
+
+def generate_dataset(companies=3, frames=4, panels=3, findings=10, with_images=False,
+                     image_ratio=0.5, image_size=(800, 600), seed=0):
+    """Sinh companies × frames × panels × findings mục đánh giá.
+
+    Với ``with_images``, khoảng ``image_ratio`` số mục có ``image_url`` trỏ tới
+    ảnh JPEG trong ``AuditDataset.images`` (phục vụ bởi ``fakes.FakeDriveService``).
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 8, 8, 0)
+    clauses = [c for c in auditnote.ISO_CLAUSE_DATA if "." in c]
+    results = list(auditnote.AUDIT_RESULTS)
+
+    auditors = [list(auditnote.AUDITORS_HEADER)]
+    for i in range(max(3, companies)):
+        email = f"auditor{i}@example.com"
+        auditors.append([PEOPLE[i % len(PEOPLE)], "Đánh giá viên", email,
+                         auditnote.hash_pw(AUDITOR_PASSWORD), ""])
+
+    notes = [list(auditnote.NOTES_HEADER)]
+    participants = [list(auditnote.PARTICIPANTS_HEADER)]
+    images = {}
+    for c in range(companies):
+        company = f"Công ty Cổ phần Năng lượng {c + 1}"
+        address = f"Lô {c + 1}, KCN Tân Bình, TP. Hồ Chí Minh"
+        for f in range(1, frames + 1):
+            frame_id = str(f)
+            day = start + timedelta(days=c * frames + f)
+            department = rng.choice(DEPARTMENTS)
+            person = rng.choice(PEOPLE)
+            for p in range(3):
+                participants.append([company, frame_id, rng.choice(PEOPLE), rng.choice(POSITIONS), "company"])
+            participants.append([company, frame_id, auditors[1 + c % (len(auditors) - 1)][0], "Trưởng đoàn", "auditor"])
+            for panel in range(1, panels + 1):
+                for n in range(findings):
+                    clause = rng.choice(clauses)
+                    image_url = ""
+                    if with_images and rng.random() < image_ratio:
+                        data = jpeg_bytes(rng, image_size)
+                        file_id = hashlib.sha1(data).hexdigest()[:28]
+                        image_url = f"https://drive.google.com/uc?export=view&id={file_id}"
+                        images[image_url] = data
+                    ts = day + timedelta(minutes=panel * 60 + n * 3)
+                    note = {
+                        "company": company, "address": address, "department": department,
+                        "person": person, "audit_time": day.strftime("%Y-%m-%d %H:%M"),
+                        "frame_id": frame_id, "panel_id": str(panel), "clause": clause,
+                        "clause_name": auditnote.ISO_CLAUSE_DATA[clause],
+                        "requirements": _sentence(rng, rng.randint(15, 60)),
+                        "evidence": _sentence(rng, rng.randint(30, 150)),
+                        "image_url": image_url, "result": rng.choice(results),
+                        "auditor": auditors[1 + c % (len(auditors) - 1)][2],
+                        "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+                        "id": "%032x" % rng.getrandbits(128),
+                    }
+                    notes.append([note.get(col, "") for col in notes[0]])
+    return AuditDataset(auditors, notes, participants, images)
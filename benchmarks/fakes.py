@@ -0,0 +1,560 @@
+"""Bản thay thế chạy trong tiến trình cho gspread và Google Drive.
+
+Các lớp ở đây hiện thực đúng phần API mà auditnote sử dụng, lưu dữ liệu trong
+bộ nhớ và mô phỏng độ trễ mạng bằng ``Latency``. Mỗi lời gọi "từ xa" được đếm
+trong ``CallStats`` để benchmark báo cáo số round trip.
+"""
+import io
+import json
+import time
+import random
+import threading
+import itertools
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import gspread
+import httplib2
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+import auditnote
+
+
+class Latency:
+    """Độ trễ mỗi lời gọi: ``mean`` ± ``jitter`` giây (phân phối đều, có seed)."""
+
+    def __init__(self, mean=0.0, jitter=0.0, seed=0):
+        self.mean = mean
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self):
+        if self.mean <= 0 and self.jitter <= 0:
+            return
+        with self._lock:
+            delay = self.mean + self._rng.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, delay))
+
+
+class CallStats(Counter):
+    """Đếm số lời gọi theo tên thao tác, an toàn khi dùng từ nhiều luồng."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def hit(self, op):
+        with self._lock:
+            self[op] += 1
+
+
+class FakeResponse:
+    """Đủ giống ``requests.Response`` cho ``gspread.exceptions.APIError`` và ``process_image_for_export``."""
+
+    def __init__(self, status_code=200, content=b"", payload=None):
+        self.status_code = status_code
+        self.content = content
+        self._payload = payload
+
+    @property
+    def text(self):
+        return json.dumps(self._payload) if self._payload is not None else self.content.decode("utf-8", "replace")
+
+    def json(self):
+        if self._payload is None:
+            raise ValueError("no JSON body")
+        return self._payload
+
+
+def api_error(code, message):
+    """APIError giống lỗi Google trả về (ví dụ 429 khi vượt quota)."""
+    return gspread.exceptions.APIError(FakeResponse(code, payload={
+        "error": {"code": code, "message": message, "status": "RESOURCE_EXHAUSTED" if code == 429 else "ERROR"}
+    }))
+
+
+class FakeWorksheet:
+    """Worksheet trong bộ nhớ với các phương thức gspread mà ứng dụng dùng."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, title, values=None, rows=1000, cols=26, latency=None, stats=None):
+        self.title = title
+        self.id = next(self._ids)
+        self._values = [list(r) for r in (values or [])]
+        self.row_count = max(rows, len(self._values))
+        self.col_count = max([cols] + [len(r) for r in self._values])
+        self.latency = latency or Latency()
+        self.stats = stats if stats is not None else CallStats()
+        self._lock = threading.RLock()
+        self.spreadsheet = None
+
+    def _remote(self, op):
+        self.stats.hit(op)
+        self.latency.sleep()
+
+    def _touch(self):
+        if self.spreadsheet is not None:
+            self.spreadsheet._touch()
+
+    # --- đọc ---
+    def get_all_values(self, **kwargs):
+        self._remote("get_all_values")
+        with self._lock:
+            return [list(r) for r in self._values]
+
+    def row_values(self, row, **kwargs):
+        self._remote("row_values")
+        with self._lock:
+            return list(self._values[row - 1]) if row <= len(self._values) else []
+
+    def cell(self, row, col, **kwargs):
+        self._remote("cell")
+        with self._lock:
+            values = self._values[row - 1] if row <= len(self._values) else []
+            return gspread.cell.Cell(row, col, values[col - 1] if col <= len(values) else "")
+
+    def get_range(self, a1):
+        """Giá trị của một vùng A1 (không tính vào round trip, dùng cho values_batch_get)."""
+        grid = a1_range_to_grid_range(a1)
+        with self._lock:
+            r0 = grid.get("startRowIndex", 0)
+            r1 = grid.get("endRowIndex", len(self._values))
+            c0 = grid.get("startColumnIndex", 0)
+            c1 = grid.get("endColumnIndex", self.col_count)
+            rows = [r[c0:c1] for r in self._values[r0:r1]]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return [self._trim(r) for r in rows]
+
+    @staticmethod
+    def _trim(row):
+        row = list(row)
+        while row and row[-1] == "":
+            row.pop()
+        return row
+
+    def batch_get(self, ranges, **kwargs):
+        self._remote("batch_get")
+        return [self.get_range(r) for r in ranges]
+
+    # --- ghi ---
+    def append_row(self, values, **kwargs):
+        self._remote("append_row")
+        self._touch()
+        with self._lock:
+            self._values.append([str(v) if v is not None else "" for v in values])
+            self.row_count = max(self.row_count, len(self._values))
+
+    def append_rows(self, values, **kwargs):
+        self._remote("append_rows")
+        self._touch()
+        with self._lock:
+            first = len(self._values) + 1
+            for row in values:
+                self._values.append([str(v) if v is not None else "" for v in row])
+            self.row_count = max(self.row_count, len(self._values))
+            last = len(self._values)
+        width = max((len(row) for row in values), default=1)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:{rowcol_to_a1(last, width)}",
+                            "updatedRows": last - first + 1}}
+
+    def _write(self, a1, values):
+        grid = a1_range_to_grid_range(a1)
+        r0, c0 = grid.get("startRowIndex", 0), grid.get("startColumnIndex", 0)
+        for i, row in enumerate(values):
+            while len(self._values) <= r0 + i:
+                self._values.append([])
+            target = self._values[r0 + i]
+            for j, v in enumerate(row):
+                while len(target) <= c0 + j:
+                    target.append("")
+                target[c0 + j] = str(v) if v is not None else ""
+
+    def update(self, range_name, values=None, **kwargs):
+        self._remote("update")
+        self._touch()
+        with self._lock:
+            self._write(range_name, values or [])
+
+    def batch_update(self, data, **kwargs):
+        self._remote("batch_update")
+        self._touch()
+        with self._lock:
+            for entry in data:
+                self._write(entry["range"], entry["values"])
+
+    def update_cell(self, row, col, value):
+        self._remote("update_cell")
+        self._touch()
+        with self._lock:
+            self._write(rowcol_to_a1(row, col), [[value]])
+
+    def delete_rows(self, start_index, end_index=None):
+        self._remote("delete_rows")
+        self._touch()
+        with self._lock:
+            del self._values[start_index - 1:(end_index or start_index)]
+
+    def resize(self, rows=None, cols=None):
+        self._remote("resize")
+        self._touch()
+        with self._lock:
+            if rows is not None:
+                self.row_count = rows
+                del self._values[rows:]
+            if cols is not None:
+                self.col_count = cols
+
+    def update_title(self, title):
+        self._remote("update_title")
+        if self.spreadsheet is not None:
+            self.spreadsheet._rename(self.title, title)
+        self.title = title
+
+
+class FakeSpreadsheet:
+    """Spreadsheet gồm nhiều FakeWorksheet, hỗ trợ values_batch_get."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, title, latency=None, stats=None):
+        self.title = title
+        self.id = f"fake-spreadsheet-{next(self._ids)}"
+        self.latency = latency or Latency()
+        self.stats = stats if stats is not None else CallStats()
+        self._sheets = {}
+        self._modified = datetime.now(timezone.utc)
+        self.lastUpdateTime = self._modified.isoformat()
+
+    def _remote(self, op):
+        self.stats.hit(op)
+        self.latency.sleep()
+
+    def _touch(self):
+        """Ghi vào một worksheet cập nhật modifiedTime (tăng nghiêm ngặt như Drive)."""
+        self._modified = max(datetime.now(timezone.utc), self._modified + timedelta(microseconds=1))
+        self.lastUpdateTime = self._modified.isoformat()
+
+    def get_lastUpdateTime(self):
+        self._remote("get_lastUpdateTime")
+        return self.lastUpdateTime
+
+    def _attach(self, ws):
+        ws.spreadsheet = self
+        ws.latency, ws.stats = self.latency, self.stats
+        self._sheets[ws.title] = ws
+        return ws
+
+    def _rename(self, old, new):
+        self._sheets[new] = self._sheets.pop(old)
+
+    @property
+    def sheet1(self):
+        return next(iter(self._sheets.values()))
+
+    def worksheets(self):
+        return list(self._sheets.values())
+
+    def worksheet(self, title):
+        self._remote("worksheet")
+        try:
+            return self._sheets[title]
+        except KeyError:
+            raise gspread.exceptions.WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows=1000, cols=26, values=None):
+        self._remote("add_worksheet")
+        return self._attach(FakeWorksheet(title, values, rows=rows, cols=cols))
+
+    def values_batch_get(self, ranges, params=None):
+        self._remote("values_batch_get")
+        value_ranges = []
+        for r in ranges:
+            title, _, a1 = r.partition("!")
+            ws = self._sheets[title.strip("'")]
+            values = ws.get_range(a1 or f"A1:{rowcol_to_a1(max(ws.row_count, 1), ws.col_count)}")
+            value_ranges.append({"range": r, "majorDimension": "ROWS", "values": values})
+        return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+
+class FakeClient:
+    """Thay cho ``gspread.Client``: mở/tạo spreadsheet theo tên."""
+
+    def __init__(self, latency=None, stats=None):
+        self.latency = latency or Latency()
+        self.stats = stats if stats is not None else CallStats()
+        self.spreadsheets = {}
+
+    def _remote(self, op):
+        self.stats.hit(op)
+        self.latency.sleep()
+
+    def open(self, title):
+        self._remote("open")
+        try:
+            return self.spreadsheets[title]
+        except KeyError:
+            raise gspread.exceptions.SpreadsheetNotFound(title)
+
+    def create(self, title):
+        self._remote("create")
+        sh = FakeSpreadsheet(title, self.latency, self.stats)
+        sh._attach(FakeWorksheet("Sheet1"))
+        self.spreadsheets[title] = sh
+        return sh
+
+    def add_table(self, spreadsheet, worksheet, values):
+        """Nạp sẵn dữ liệu (không tính round trip)."""
+        sh = self.spreadsheets.get(spreadsheet)
+        if sh is None:
+            sh = self.spreadsheets[spreadsheet] = FakeSpreadsheet(spreadsheet, self.latency, self.stats)
+        return sh._attach(FakeWorksheet(worksheet, values, rows=len(values)))
+
+    @classmethod
+    def from_dataset(cls, dataset, latency=None, stats=None, legacy=False):
+        """Client có sẵn dữ liệu trong spreadsheet gộp ``auditnote.DB_NAME``.
+
+        Với ``legacy``, dữ liệu nằm ở ba workbook cũ
+        Auditors_DB/Audit_Notes/Audit_Participants (để thử chuyển đổi).
+        """
+        cli = cls(latency, stats)
+        tables = {"auditors": dataset.auditors, "notes": dataset.notes, "participants": dataset.participants}
+        for key, (title, header, legacy_name) in auditnote.TABLES.items():
+            if legacy and not legacy_name:
+                continue  # bảng mới, gws() tự tạo
+            cli.add_table(legacy_name if legacy else auditnote.DB_NAME, title, tables.get(key, [list(header)]))
+        return cli
+
+    def worksheets_dict(self):
+        """Dict giống kết quả ``auditnote.gws()`` mà không chạy ensure_header."""
+        db = self.spreadsheets[auditnote.DB_NAME]
+        sheets = {key: db.worksheet(title) for key, (title, _, _) in auditnote.TABLES.items()}
+        return {"db": db, "notes_wb": db, **sheets}
+
+
+class _Request:
+    """Request Drive giả: ``execute`` tính một round trip, trừ khi nằm trong batch."""
+
+    def __init__(self, drive, op, fn):
+        self._drive, self.op, self.fn = drive, op, fn
+
+    def execute(self, **kwargs):
+        self._drive._remote(self.op)
+        return self.fn()
+
+
+class _Batch:
+    """Giống ``BatchHttpRequest``: mọi request con đi chung một round trip."""
+
+    def __init__(self, drive, callback=None):
+        self._drive = drive
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((str(request_id or len(self._requests) + 1), request, callback))
+
+    def execute(self, **kwargs):
+        self._drive._remote("batch")
+        for request_id, request, callback in self._requests:
+            self._drive.stats.hit(request.op)
+            try:
+                response, exception = request.fn(), None
+            except Exception as e:
+                response, exception = None, e
+            (callback or self._callback)(request_id, response, exception)
+
+
+class _UploadProgress:
+    def __init__(self, resumable_progress, total_size):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self):
+        return self.resumable_progress / self.total_size if self.total_size else 1.0
+
+
+class _Upload:
+    """``files().create`` với media resumable: ``next_chunk`` gửi từng phần như googleapiclient.
+
+    Phiên upload (URI -> byte đã nhận) nằm trong ``FakeDriveService.sessions``
+    nên một request mới có thể tiếp tục phiên cũ qua ``resumable_uri``; ``http``
+    trả lời truy vấn trạng thái phiên (PUT ``bytes */size``) như Drive.
+    """
+
+    def __init__(self, drive, metadata, media):
+        self._drive = drive
+        self._metadata = metadata
+        self._media = media
+        self.http = _UploadHttp(drive)
+        self.resumable_uri = None
+        self.resumable_progress = 0
+
+    @staticmethod
+    def postproc(resp, content):
+        return json.loads(content)
+
+    def next_chunk(self, num_retries=0):
+        drive, media = self._drive, self._media
+        size = media.size()
+        if self.resumable_uri is None:
+            drive._remote("files.create")
+            self.resumable_uri = drive.start_session()
+        chunksize = media.chunksize() if media.chunksize() > 0 else size
+        data = media.getbytes(self.resumable_progress, chunksize)
+        drive._remote("upload.chunk")
+        drive.receive(self.resumable_uri, self.resumable_progress, data)
+        self.resumable_progress += len(data)
+        if self.resumable_progress < size:
+            return _UploadProgress(self.resumable_progress, size), None
+        return None, drive.finish_session(self.resumable_uri, self._metadata, media.mimetype())
+
+    def execute(self, **kwargs):
+        response = None
+        while response is None:
+            _, response = self.next_chunk()
+        return response
+
+
+class _UploadHttp:
+    """Phần ``http`` của request upload: chỉ trả lời truy vấn trạng thái phiên."""
+
+    def __init__(self, drive):
+        self._drive = drive
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        drive = self._drive
+        drive._remote("upload.status")
+        with drive._lock:
+            received = drive.sessions.get(uri)
+            done = drive.completed.get(uri)
+        if done is not None:
+            return httplib2.Response({"status": 200}), json.dumps(done).encode()
+        if received is None:
+            return httplib2.Response({"status": 404}), b"Not Found"
+        info = {"status": 308}
+        if received:
+            info["range"] = f"bytes=0-{len(received) - 1}"
+        return httplib2.Response(info), b""
+
+
+class _Files:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        if media_body is not None:
+            return _Upload(self._drive, body or {}, media_body)
+        return _Request(self._drive, "files.create", lambda: self._drive.add_file(body or {}, b""))
+
+    def get(self, fileId=None, fields=None, **kwargs):
+        def run():
+            meta = self._drive.stored[fileId]
+            return {k: v for k, v in meta.items() if k != "data"}
+        return _Request(self._drive, "files.get", run)
+
+
+class _Permissions:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def create(self, fileId=None, body=None, **kwargs):
+        def run():
+            self._drive.item(fileId).setdefault("permissions", []).append(body)
+            return {"id": f"perm-{fileId}"}
+        return _Request(self._drive, "permissions.create", run)
+
+    def list(self, fileId=None, fields=None, **kwargs):
+        def run():
+            return {"permissions": list(self._drive.item(fileId).get("permissions", []))}
+        return _Request(self._drive, "permissions.list", run)
+
+
+class FakeDriveService:
+    """Thay cho ``googleapiclient.discovery.build('drive', 'v3')`` và kho ảnh công khai."""
+
+    def __init__(self, latency=None, stats=None, images=None):
+        self.latency = latency or Latency()
+        self.stats = stats if stats is not None else CallStats()
+        self.stored = {}
+        self.sessions = {}     # URI phiên upload resumable -> byte đã nhận
+        self.completed = {}    # URI phiên đã upload xong -> phản hồi cuối
+        self.interrupt = None  # hook giả lập lỗi mạng giữa các phần upload
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        for url, data in (images or {}).items():
+            self.stored[url.rsplit("id=", 1)[-1]] = {"name": url, "data": data, "mimeType": "image/jpeg"}
+
+    def _remote(self, op):
+        self.stats.hit(op)
+        self.latency.sleep()
+
+    def add_file(self, metadata, data, mimetype=None):
+        with self._lock:
+            file_id = f"fake{next(self._ids):024d}"
+            self.stored[file_id] = dict(metadata, id=file_id, data=data, mimeType=mimetype,
+                                       version="1", modifiedTime=datetime.now(timezone.utc).isoformat())
+        return {"id": file_id}
+
+    def start_session(self):
+        with self._lock:
+            uri = f"https://fake-upload/{next(self._ids):024d}"
+            self.sessions[uri] = bytearray()
+        return uri
+
+    def receive(self, uri, offset, data):
+        """Nhận một phần của phiên ``uri``; ``interrupt(uri, offset)`` (nếu có) giả lập mất mạng."""
+        if self.interrupt is not None:
+            self.interrupt(uri, offset)
+        with self._lock:
+            received = self.sessions[uri]
+            del received[offset:]
+            received.extend(data)
+
+    def finish_session(self, uri, metadata, mimetype=None):
+        with self._lock:
+            data = bytes(self.sessions.pop(uri))
+        response = self.add_file(metadata, data, mimetype)
+        with self._lock:
+            self.completed[uri] = response
+        return response
+
+    def item(self, file_id):
+        """File hoặc thư mục theo id; thư mục upload (chưa có trong kho) được tạo khi cần."""
+        with self._lock:
+            meta = self.stored.get(file_id)
+            if meta is None:
+                if not file_id or file_id.startswith("fake"):
+                    raise KeyError(file_id)
+                meta = self.stored[file_id] = {"id": file_id, "data": b"",
+                                               "mimeType": "application/vnd.google-apps.folder"}
+            return meta
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    def files(self):
+        return _Files(self)
+
+    def permissions(self):
+        return _Permissions(self)
+
+    def get(self, url, **kwargs):
+        """Tải ảnh qua URL ``uc?export=view&id=...`` như ``requests.get``."""
+        self._remote("http.get")
+        file_id = url.rsplit("id=", 1)[-1]
+        meta = self.stored.get(file_id)
+        if meta is None:
+            return FakeResponse(404, b"not found")
+        return FakeResponse(200, meta["data"])
+
+
+class UploadedFile(io.BytesIO):
+    """Giống ``UploadedFile`` của Streamlit: BytesIO kèm ``name`` và ``type``."""
+
+    def __init__(self, data, name, mime_type):
+        super().__init__(data)
+        self.name = name
+        self.type = mime_type
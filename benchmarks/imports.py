@@ -0,0 +1,106 @@
+"""Ngân sách thời gian import của auditnote.
+
+Chạy ``python -X importtime -c "import auditnote"`` trong tiến trình mới nhiều
+lần, lấy median thời gian import tích lũy và kiểm tra các thư viện nặng
+(xuất báo cáo, ảnh, Drive) vẫn chỉ được import lười::
+
+    python -m benchmarks.imports --budget-ms 1000 --out imports.json
+    python -m benchmarks.imports --baseline imports.json --threshold 1.25
+
+Mã thoát khác 0 nếu vượt ngân sách, chậm hơn baseline quá ``threshold`` lần,
+hoặc một module trong ``DEFERRED`` bị import ngay khi nạp auditnote.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Chỉ được import khi xuất báo cáo/xử lý ảnh/upload (qua các LazyNames của auditnote)
+DEFERRED = ("reportlab", "docx", "plotly", "pillow_heif", "PIL.Image",
+            "googleapiclient.discovery", "googleapiclient.http")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE = "import sys, json, auditnote; print(json.dumps([m for m in %r if m in sys.modules]))" % (DEFERRED,)
+
+
+def parse_importtime(stderr):
+    """[(tự thân µs, tích lũy µs, độ sâu, tên)] từ đầu ra của ``-X importtime``."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, total, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # dòng tiêu đề
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((int(own), int(total), depth, name.strip()))
+    return rows
+
+
+def measure_once():
+    env = dict(os.environ, AUDITNOTE_HEADLESS="1", PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+    rows = parse_importtime(proc.stderr)
+    total = next(t for _, t, depth, name in reversed(rows) if name == "auditnote")
+    return total, rows, json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def measure(repeat):
+    measure_once()  # khởi động: biên dịch .pyc
+    runs = [measure_once() for _ in range(repeat)]
+    totals = [r[0] for r in runs]
+    _, rows, eager = runs[totals.index(sorted(totals)[len(totals) // 2])]
+    # Các module import trực tiếp bởi auditnote, tốn nhiều nhất
+    direct = sorted(((t, name) for _, t, depth, name in rows if depth == 1), reverse=True)[:10]
+    return {
+        "median_ms": statistics.median(totals) / 1000,
+        "min_ms": min(totals) / 1000,
+        "max_ms": max(totals) / 1000,
+        "repeat": repeat,
+        "top_imports_ms": {name: t / 1000 for t, name in direct},
+        "eager_deferred": eager,
+    }
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Kiểm tra thời gian import auditnote")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--budget-ms", type=float, default=1000.0, help="ngân sách median (ms)")
+    p.add_argument("--baseline", help="file JSON của lần chạy trước để so sánh")
+    p.add_argument("--threshold", type=float, default=1.25)
+    p.add_argument("--out", help="ghi kết quả JSON ra file (mặc định: stdout)")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = measure(args.repeat)
+    regressions = []
+    if result["median_ms"] > args.budget_ms:
+        regressions.append(f"import auditnote {result['median_ms']:.0f} ms > ngân sách {args.budget_ms:.0f} ms")
+    for name in result["eager_deferred"]:
+        regressions.append(f"{name} bị import ngay khi nạp auditnote")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            previous = json.load(f)
+        ratio = result["median_ms"] / previous["median_ms"] if previous.get("median_ms") else 0.0
+        result["baseline_ratio"] = ratio
+        if ratio > args.threshold:
+            regressions.append(f"import auditnote chậm hơn baseline {ratio:.2f} lần")
+    result["regressions"] = regressions
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    for message in regressions:
+        print(f"REGRESSION: {message}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
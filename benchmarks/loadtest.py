@@ -0,0 +1,542 @@
+"""Kiểm thử tải: N phiên đánh giá viên đồng thời trên một bản thay Sheets/Drive qua HTTP.
+
+Bản thay (``StandIn``) là một máy chủ HTTP cục bộ giữ dữ liệu trong các lớp
+của ``fakes``, thêm độ trễ mỗi request và áp quota theo phút giống Google
+(vượt quota trả về 429 ``RESOURCE_EXHAUSTED``). Phía ứng dụng, ``gws()``,
+Drive service và ``requests`` của auditnote được thay bằng các proxy gọi HTTP
+tới bản thay, nên mọi phiên chạy đúng mã ứng dụng: ``login_auditor``,
+``save_item_to_sheets``, upload ảnh, làm mới ``df_notes`` và xuất PDF.
+
+Ví dụ::
+
+    python -m benchmarks.loadtest --sessions 1 5 10 20 --duration 30 \\
+        --latency-ms 80 --sheets-read-per-min 60 --sheets-write-per-min 60
+
+Mỗi mức số phiên chạy trên dữ liệu mới và báo cáo throughput, p50/p95/p99
+và tỉ lệ lỗi theo thao tác, cùng số request/429 theo nhóm quota.
+"""
+import os
+
+# Các phiên dùng chung cache cấp tiến trình như khi chạy thật, không cần Streamlit
+os.environ.setdefault("AUDITNOTE_HEADLESS", "1")
+
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+import statistics
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gspread
+import httplib2
+import requests
+from googleapiclient.errors import HttpError
+
+import auditnote
+from benchmarks import datagen
+from benchmarks.fakes import FakeClient, FakeDriveService, FakeResponse, Latency, UploadedFile
+
+SHEETS_READS = {"get_all_values", "row_values", "cell", "batch_get", "values_batch_get", "worksheets", "worksheet"}
+SHEETS_WRITES = {"append_row", "append_rows", "update", "batch_update", "update_cell",
+                 "delete_rows", "resize", "update_title", "add_worksheet"}
+
+
+# ------------ Bản thay Sheets/Drive ------------
+class Quota:
+    """Token bucket ``per_minute`` request/phút (0: không giới hạn)."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        if self.per_minute <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60.0)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def _encode(value):
+    if isinstance(value, gspread.cell.Cell):
+        return {"__cell__": [value.row, value.col, value.value]}
+    return value
+
+
+class StandIn:
+    """Máy chủ HTTP cục bộ đóng vai Google Sheets/Drive cho một bộ dữ liệu."""
+
+    def __init__(self, dataset, latency=None, sheets_read_per_min=60, sheets_write_per_min=60,
+                 drive_per_min=12000, host="127.0.0.1", port=0):
+        self.client = FakeClient.from_dataset(dataset)
+        self.drive = FakeDriveService(images=dataset.images)
+        self.latency = latency or Latency()
+        self.quotas = {
+            "sheets.read": Quota(sheets_read_per_min),
+            "sheets.write": Quota(sheets_write_per_min),
+            "drive": Quota(drive_per_min),
+        }
+        self.requests = Counter()
+        self.throttled = Counter()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = "http://%s:%d" % self.server.server_address
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _admit(self, bucket):
+        """Đếm request, áp quota; False nếu phải trả 429."""
+        with self._lock:
+            self.requests[bucket] += 1
+        if self.quotas[bucket].take():
+            self.latency.sleep()
+            return True
+        with self._lock:
+            self.throttled[bucket] += 1
+        return False
+
+    def _sheets(self, spreadsheet, worksheet, op, args, kwargs):
+        sh = self.client.spreadsheets[spreadsheet]
+        target = sh._sheets[worksheet] if worksheet else sh
+        if op == "get_lastUpdateTime":  # metadata của file: quota Drive
+            bucket = "drive"
+        else:
+            bucket = "sheets.read" if op in SHEETS_READS else "sheets.write"
+        return bucket, lambda: getattr(target, op)(*args, **kwargs)
+
+    def _drive(self, op, body):
+        if op == "files.create":
+            data = base64.b64decode(body.get("data", ""))
+            return "drive", lambda: self.drive.add_file(body.get("metadata") or {}, data, body.get("mimetype"))
+
+        if op == "permissions.list":
+            return "drive", lambda: {"permissions": list(self.drive.item(body["fileId"]).get("permissions", []))}
+
+        def permission():
+            self.drive.item(body["fileId"]).setdefault("permissions", []).append(body.get("body"))
+            return {"id": "perm-" + body["fileId"]}
+        return "drive", permission
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload=None, content=None, content_type="application/json"):
+                data = content if content is not None else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _throttled(self):
+                self._reply(429, {"error": {
+                    "code": 429, "status": "RESOURCE_EXHAUSTED",
+                    "message": "Quota exceeded for quota metric 'Requests' per minute per user.",
+                }})
+
+            def do_GET(self):
+                # /download/<file_id>: ảnh công khai (uc?export=view)
+                file_id = self.path.rsplit("/", 1)[-1]
+                if not stand_in._admit("drive"):
+                    return self._throttled()
+                meta = stand_in.drive.stored.get(file_id)
+                if meta is None:
+                    return self._reply(404, {"error": {"code": 404, "message": "not found"}})
+                self._reply(200, content=meta["data"], content_type=meta.get("mimeType") or "image/jpeg")
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                parts = self.path.strip("/").split("/")
+                try:
+                    if parts[0] == "sheets":
+                        bucket, run = stand_in._sheets(body["spreadsheet"], body.get("worksheet"), parts[1],
+                                                       body.get("args", []), body.get("kwargs", {}))
+                    else:
+                        bucket, run = stand_in._drive(parts[1], body)
+                except KeyError as e:
+                    return self._reply(404, {"error": {"code": 404, "message": f"not found: {e}"}})
+                if not stand_in._admit(bucket):
+                    return self._throttled()
+                try:
+                    result = run()
+                except Exception as e:
+                    return self._reply(400, {"error": {"code": 400, "message": str(e)}})
+                self._reply(200, {"result": _encode(result)})
+
+        return Handler
+
+
+# ------------ Proxy phía ứng dụng ------------
+class Connection:
+    """Phiên HTTP tới bản thay (mỗi luồng một requests.Session)."""
+
+    def __init__(self, url):
+        self.url = url
+        self._local = threading.local()
+
+    @property
+    def http(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def post(self, path, payload):
+        # Số numpy (vd. số dòng lấy từ DataFrame) gửi như số Python
+        data = json.dumps(payload, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+        return self.http.post(self.url + path, data=data, timeout=60)
+
+    def sheets(self, spreadsheet, worksheet, op, *args, **kwargs):
+        response = self.post(f"/sheets/{op}", {"spreadsheet": spreadsheet, "worksheet": worksheet,
+                                                "args": list(args), "kwargs": kwargs})
+        if response.status_code != 200:
+            raise gspread.exceptions.APIError(response)
+        result = response.json()["result"]
+        if isinstance(result, dict) and "__cell__" in result:
+            return gspread.cell.Cell(*result["__cell__"])
+        return result
+
+    def drive(self, op, payload):
+        response = self.post(f"/drive/{op}", payload)
+        if response.status_code != 200:
+            raise HttpError(httplib2.Response({"status": response.status_code}), response.content)
+        return response.json()["result"]
+
+
+class RemoteWorksheet:
+    def __init__(self, conn, spreadsheet, title, row_count, col_count):
+        self._conn = conn
+        self._spreadsheet = spreadsheet
+        self.title = title
+        self.row_count = row_count
+        self.col_count = col_count
+
+    def __getattr__(self, op):
+        return lambda *args, **kwargs: self._conn.sheets(self._spreadsheet, self.title, op, *args, **kwargs)
+
+
+class RemoteSpreadsheet:
+    def __init__(self, conn, title):
+        self._conn = conn
+        self.title = title
+
+    def values_batch_get(self, ranges, params=None):
+        return self._conn.sheets(self.title, None, "values_batch_get", ranges, params=params)
+
+    def get_lastUpdateTime(self):
+        return self._conn.sheets(self.title, None, "get_lastUpdateTime")
+
+
+class _Request:
+    resumable_uri = None
+
+    def __init__(self, conn, op, payload):
+        self._conn, self._op, self._payload = conn, op, payload
+
+    def execute(self, **kwargs):
+        return self._conn.drive(self._op, self._payload)
+
+    def next_chunk(self, num_retries=0):
+        # Bản thay không mô phỏng từng phần: cả file đi trong một request
+        return None, self.execute()
+
+
+class RemoteDrive:
+    """Đủ giống Drive service v3 cho store_image_on_drive, và requests.get cho ảnh xuất báo cáo."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def files(self):
+        return self
+
+    def permissions(self):
+        return _Permissions(self._conn)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        data = media_body.getbytes(0, media_body.size()) if media_body is not None else b""
+        return _Request(self._conn, "files.create", {
+            "metadata": body, "mimetype": media_body.mimetype() if media_body is not None else None,
+            "data": base64.b64encode(data).decode("ascii"),
+        })
+
+    def get(self, url, **kwargs):
+        response = self._conn.http.get(f"{self._conn.url}/download/{url.rsplit('id=', 1)[-1]}", timeout=60)
+        return FakeResponse(response.status_code, response.content)
+
+
+class _Permissions:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def create(self, fileId=None, body=None, **kwargs):
+        return _Request(self._conn, "permissions.create", {"fileId": fileId, "body": body})
+
+    def list(self, fileId=None, fields=None, **kwargs):
+        return _Request(self._conn, "permissions.list", {"fileId": fileId})
+
+
+def remote_sheets(stand_in, conn):
+    """Dict giống ``auditnote.gws()`` trỏ tới bản thay."""
+    db = stand_in.client.spreadsheets[auditnote.DB_NAME]
+    proxy = RemoteSpreadsheet(conn, db.title)
+    sheets = {
+        key: RemoteWorksheet(conn, db.title, title, db._sheets[title].row_count, db._sheets[title].col_count)
+        for key, (title, _, _) in auditnote.TABLES.items()
+    }
+    return {"db": proxy, "notes_wb": proxy, **sheets}
+
+
+def reset_app_state():
+    """Xóa chỉ mục và cache cấp tiến trình của auditnote giữa các mức tải."""
+    for name in ("notes_search_index", "result_aggregates", "note_row_index",
+                 "note_text_cache", "saved_participants"):
+        getattr(auditnote, name).clear()
+
+
+# ------------ Kịch bản ------------
+OPERATIONS = {}
+
+
+def operation(name, weight):
+    """Đăng ký một thao tác của phiên với trọng số chọn ngẫu nhiên."""
+    def register(fn):
+        OPERATIONS[name] = (weight, fn)
+        return fn
+    return register
+
+
+class Session:
+    """Một đánh giá viên: đăng nhập, ghi mục vào khung của mình, upload ảnh, xem lại, xuất báo cáo."""
+
+    def __init__(self, n, dataset, seed):
+        self.n = n
+        self.rng = random.Random(seed * 1000 + n)
+        self.email = dataset.auditors[1 + n % (len(dataset.auditors) - 1)][2]
+        self.company = f"Công ty tải {n + 1}"
+        self.frame_id = "1"
+        self.saved = 0
+        self.photo = datagen.jpeg_bytes(self.rng, (640, 480))
+
+    def item(self):
+        clause = self.rng.choice([c for c in auditnote.ISO_CLAUSE_DATA if "." in c])
+        return {
+            "clause": clause, "clause_name": auditnote.ISO_CLAUSE_DATA[clause],
+            "requirements": "Yêu cầu " * self.rng.randint(5, 20),
+            "evidence": "Bằng chứng " * self.rng.randint(10, 60),
+            "image_url": None, "result": self.rng.choice(list(auditnote.AUDIT_RESULTS)),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+@operation("login", 1)
+def op_login(session):
+    user, error = auditnote.login_auditor(session.email, datagen.AUDITOR_PASSWORD)
+    if user is None:
+        raise RuntimeError(error)
+
+
+@operation("save_item_to_sheets", 6)
+def op_save(session):
+    auditnote.save_item_to_sheets(
+        session.company, "Địa chỉ", "Phòng Kỹ thuật", "Người đối ứng", "2024-01-01 08:00",
+        session.frame_id, "1", session.item(), session.email,
+        participants=[{"fullname": "Nguyễn Văn An", "position": "Trưởng phòng"}],
+        auditors=[{"fullname": "Trần Thị Bình", "position": "Trưởng đoàn"}],
+    )
+    session.saved += 1
+    if session.saved % 20 == 0:
+        session.frame_id = str(int(session.frame_id) + 1)
+
+
+@operation("upload_image_to_drive", 2)
+def op_upload(session):
+    # store_image_on_drive là phần ném lỗi của upload_image_to_drive. Mỗi lần một
+    # ảnh khác nhau (thêm byte sau EOI) để đo upload thật, không trúng chỉ mục trùng lặp.
+    photo = session.photo + os.urandom(16)
+    auditnote.store_image_on_drive(auditnote.drive_service(), UploadedFile(photo, "photo.jpg", "image/jpeg"),
+                                   auditnote.drive_folder_id())
+
+
+@operation("df_notes", 3)
+def op_refresh(session):
+    notes_df = auditnote.df_notes()
+    auditnote.sync_note_indexes(notes_df)
+
+
+@operation("export_to_pdf", 0.2)
+def op_export(session):
+    notes_df, participants_df = auditnote.df_notes(), auditnote.df_participants()
+    company = session.company if (notes_df['company'] == session.company).any() else notes_df['company'].iloc[0]
+    audit_data, participants_data = auditnote.export_records(
+        notes_df[notes_df['company'] == company], participants_df[participants_df['company'] == company]
+    )
+    auditnote.export_to_pdf(company, audit_data, participants_data, auditnote.result_aggregates())
+
+
+def _error_kind(exc):
+    if isinstance(exc, gspread.exceptions.APIError):
+        return str(exc.response.status_code)
+    if isinstance(exc, HttpError):
+        return str(exc.resp.status)
+    return type(exc).__name__
+
+
+def run_level(args, sessions):
+    """Chạy ``sessions`` phiên đồng thời trong ``args.duration`` giây trên dữ liệu mới."""
+    dataset = datagen.generate_dataset(companies=args.companies, frames=args.frames, panels=args.panels,
+                                       findings=args.findings, with_images=args.images, seed=args.seed)
+    latency = Latency(args.latency_ms / 1000.0, args.jitter_ms / 1000.0, seed=args.seed)
+    samples = defaultdict(list)
+    errors = defaultdict(Counter)
+    lock = threading.Lock()
+    with StandIn(dataset, latency, args.sheets_read_per_min, args.sheets_write_per_min,
+                 args.drive_per_min) as stand_in:
+        conn = Connection(stand_in.url)
+        sheets = remote_sheets(stand_in, conn)
+        drive = RemoteDrive(conn)
+        store = auditnote.SnapshotStore(":memory:")
+        reset_app_state()
+        saved = {k: getattr(auditnote, k) for k in ("gws", "snapshots", "drive_service", "drive_folder_id", "requests")}
+        auditnote.gws = lambda: sheets
+        auditnote.snapshots = lambda: store
+        auditnote.drive_service = lambda: drive
+        auditnote.drive_folder_id = lambda: "load-test-folder"
+        auditnote.requests = drive
+        names = list(OPERATIONS)
+        weights = [OPERATIONS[n][0] for n in names]
+        deadline = time.monotonic() + args.duration
+
+        def worker(n):
+            session = Session(n, dataset, args.seed)
+            while time.monotonic() < deadline:
+                name = session.rng.choices(names, weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    OPERATIONS[name][1](session)
+                    kind = None
+                except Exception as e:
+                    kind = _error_kind(e)
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    samples[name].append(elapsed)
+                    if kind:
+                        errors[name][kind] += 1
+                if args.think_ms:
+                    time.sleep(session.rng.expovariate(1000.0 / args.think_ms))
+
+        started = time.monotonic()
+        try:
+            threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(sessions)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            for k, v in saved.items():
+                setattr(auditnote, k, v)
+        wall = time.monotonic() - started
+        backend = {b: {"requests": stand_in.requests[b], "throttled": stand_in.throttled[b]}
+                   for b in stand_in.quotas}
+    return summarize(sessions, wall, samples, errors, backend)
+
+
+def _percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def summarize(sessions, wall, samples, errors, backend):
+    operations = {}
+    for name, times in sorted(samples.items()):
+        failed = sum(errors[name].values())
+        operations[name] = {
+            "count": len(times),
+            "ok_per_s": (len(times) - failed) / wall,
+            "error_rate": failed / len(times),
+            "errors": dict(errors[name]),
+            "p50_ms": _percentile(times, 50) * 1000,
+            "p95_ms": _percentile(times, 95) * 1000,
+            "p99_ms": _percentile(times, 99) * 1000,
+        }
+    total = sum(len(t) for t in samples.values())
+    failed = sum(sum(e.values()) for e in errors.values())
+    return {
+        "sessions": sessions,
+        "wall_s": wall,
+        "ops_per_s": (total - failed) / wall if wall else 0.0,
+        "error_rate": failed / total if total else 0.0,
+        "operations": operations,
+        "backend": backend,
+    }
+
+
+def format_table(levels):
+    lines = [f"{'phiên':>5} {'thao tác':<22} {'n':>6} {'ok/s':>7} {'lỗi %':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"]
+    for level in levels:
+        for name, op in level["operations"].items():
+            lines.append(f"{level['sessions']:>5} {name:<22} {op['count']:>6} {op['ok_per_s']:>7.2f} "
+                         f"{op['error_rate'] * 100:>6.1f} {op['p50_ms']:>8.1f} {op['p95_ms']:>8.1f} {op['p99_ms']:>8.1f}")
+        throttled = ", ".join(f"{b} {v['throttled']}/{v['requests']}" for b, v in level["backend"].items())
+        lines.append(f"{'':>5} {'(429/request)':<22} {throttled}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Kiểm thử tải auditnote trên bản thay Sheets/Drive cục bộ")
+    p.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10], help="các mức số phiên đồng thời")
+    p.add_argument("--duration", type=float, default=20.0, help="số giây chạy mỗi mức")
+    p.add_argument("--think-ms", type=float, default=500.0, help="thời gian nghĩ trung bình giữa hai thao tác")
+    p.add_argument("--latency-ms", type=float, default=80.0, help="độ trễ mỗi request tới bản thay")
+    p.add_argument("--jitter-ms", type=float, default=20.0)
+    p.add_argument("--sheets-read-per-min", type=int, default=60, help="quota đọc Sheets mỗi phút (0: không giới hạn)")
+    p.add_argument("--sheets-write-per-min", type=int, default=60, help="quota ghi Sheets mỗi phút")
+    p.add_argument("--drive-per-min", type=int, default=12000, help="quota Drive mỗi phút")
+    p.add_argument("--companies", type=int, default=3)
+    p.add_argument("--frames", type=int, default=4)
+    p.add_argument("--panels", type=int, default=3)
+    p.add_argument("--findings", type=int, default=10)
+    p.add_argument("--images", action="store_true", help="gắn ảnh cho khoảng một nửa số mục có sẵn")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", help="ghi kết quả JSON ra file")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    levels = [run_level(args, n) for n in args.sessions]
+    print(format_table(levels))
+    if args.out:
+        report = {"meta": {k: v for k, v in vars(args).items() if k != "out"}, "levels": levels}
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""Chạy benchmark thời gian/bộ nhớ trên dữ liệu giả lập và xuất JSON.
+
+Ví dụ::
+
+    python -m benchmarks.run --findings 20 --images --out bench.json
+    python -m benchmarks.run --baseline bench.json --threshold 1.25
+
+Với ``--baseline``, mã thoát khác 0 nếu median của một benchmark chậm hơn
+baseline quá ``threshold`` lần.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+
+import auditnote
+from benchmarks import datagen
+from benchmarks.fakes import CallStats, FakeClient, FakeDriveService, Latency, UploadedFile
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Đăng ký một benchmark: hàm nhận (ctx) và trả về callable được đo."""
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+@contextmanager
+def patched(obj, **attrs):
+    saved = {k: getattr(obj, k) for k in attrs}
+    for k, v in attrs.items():
+        setattr(obj, k, v)
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            setattr(obj, k, v)
+
+
+class Context:
+    """Dữ liệu và các bản giả dùng chung cho mọi benchmark trong một lần chạy."""
+
+    def __init__(self, args):
+        self.args = args
+        self.dataset = datagen.generate_dataset(
+            companies=args.companies, frames=args.frames, panels=args.panels,
+            findings=args.findings, with_images=args.images, seed=args.seed,
+        )
+        self.stats = CallStats()
+        self.latency = Latency(args.latency_ms / 1000.0, args.jitter_ms / 1000.0, seed=args.seed)
+        self.client = FakeClient.from_dataset(self.dataset, self.latency, self.stats)
+        self.drive = FakeDriveService(self.latency, self.stats, images=self.dataset.images)
+        self.sheets = self.client.worksheets_dict()
+        self.notes_df = auditnote._df(self.sheets["notes"])
+        self.company = self.dataset.notes[1][0]
+        self.snapshots = auditnote.SnapshotStore(":memory:")
+        # Ngoài Streamlit st.cache_resource không nhớ giá trị: các chỉ mục dùng
+        # chung được giữ ở đây, như trong một tiến trình phục vụ thật
+        self.search_index = auditnote.NotesSearchIndex()
+        self.aggregates = auditnote.ResultAggregates()
+        self.row_index = auditnote.NoteRowIndex()
+        self.participants = auditnote.SavedParticipants()
+        self.claims = auditnote.NoteIdClaims()
+
+    def app(self):
+        """Thay gws()/requests/cache dùng chung của auditnote bằng bản giả trong thời gian đo."""
+        return patched(auditnote, gws=lambda: self.sheets, requests=self.drive,
+                       snapshots=lambda: self.snapshots,
+                       notes_search_index=lambda: self.search_index,
+                       result_aggregates=lambda: self.aggregates,
+                       note_row_index=lambda: self.row_index,
+                       saved_participants=lambda: self.participants,
+                       note_id_claims=lambda: self.claims)
+
+
+@benchmark("df_notes")
+def bench_df_notes(ctx):
+    ws = ctx.sheets["notes"]
+    return lambda: auditnote._df(ws)
+
+
+@benchmark("load_tables")
+def bench_load_tables(ctx):
+    def run():
+        with ctx.app():
+            auditnote.clear_tables()
+            auditnote.load_tables()
+    return run
+
+
+@benchmark("review_filter")
+def bench_review_filter(ctx):
+    notes_df = ctx.notes_df
+    aggregates = auditnote.ResultAggregates()
+    aggregates.sync(notes_df)
+
+    def run():
+        # Giống page_audit_review: lọc công ty -> khung -> nhóm theo panel
+        for company in notes_df['company'].unique():
+            company_data = notes_df[notes_df['company'] == company]
+            for frame in company_data['frame_id'].unique():
+                frame_data = company_data[company_data['frame_id'] == frame]
+                for panel, _ in auditnote.review_panels(frame_data):
+                    aggregates.counts_for(company, frame, panel)
+    return run
+
+
+@benchmark("note_indexes_build")
+def bench_note_indexes(ctx):
+    notes_df = ctx.notes_df
+
+    def run():
+        auditnote.NotesSearchIndex().sync(notes_df)
+        auditnote.ResultAggregates().sync(notes_df)
+    return run
+
+
+@benchmark("save_item_to_sheets")
+def bench_save_item(ctx):
+    participants = [{"fullname": "Nguyễn Văn An", "position": "Trưởng phòng"}]
+    auditors = [{"fullname": "Trần Thị Bình", "position": "Trưởng đoàn"}]
+    item = {
+        "clause": "4.1", "clause_name": auditnote.ISO_CLAUSE_DATA["4.1"],
+        "requirements": "Yêu cầu", "evidence": "Bằng chứng", "image_url": None,
+        "result": "CM", "timestamp": "2024-01-01 08:00:00",
+    }
+
+    def run():
+        with ctx.app():
+            auditnote.df_participants.clear()
+            for i in range(ctx.args.saves):
+                auditnote.save_item_to_sheets(
+                    ctx.company, "Địa chỉ", "Phòng Kỹ thuật", "Người đối ứng", "2024-01-01 08:00",
+                    str(1 + i % ctx.args.frames), "1", item, "auditor0@example.com",
+                    participants=participants, auditors=auditors,
+                )
+    return run
+
+
+@benchmark("records_build")
+def bench_records_build(ctx):
+    notes_df = ctx.notes_df[ctx.notes_df['company'] == ctx.company]
+    return lambda: auditnote.RecordBatch.from_frame(notes_df, auditnote.NOTE_CATEGORICAL, ("timestamp",))
+
+
+def _export(ctx, fn):
+    audit_data, participants_data = ctx.dataset.records(company=ctx.company)
+
+    def run():
+        with ctx.app():
+            fn(ctx.company, audit_data, participants_data)
+    return run
+
+
+@benchmark("export_to_pdf")
+def bench_export_pdf(ctx):
+    return _export(ctx, auditnote.export_to_pdf)
+
+
+@benchmark("export_to_word")
+def bench_export_word(ctx):
+    return _export(ctx, auditnote.export_to_word)
+
+
+@benchmark("convert_heic_to_jpeg")
+def bench_heic(ctx):
+    import random
+    data = datagen.heic_bytes(random.Random(ctx.args.seed), (1600, 1200))
+
+    def run():
+        auditnote.convert_heic_to_jpeg(UploadedFile(data, "photo.heic", "image/heic"))
+    return run
+
+
+def measure(ctx, name, repeat):
+    run = BENCHMARKS[name](ctx)
+    run()  # khởi động: import lười, cache của thư viện
+    times = []
+    calls_before = dict(ctx.stats)
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    calls = {k: (v - calls_before.get(k, 0)) / repeat for k, v in ctx.stats.items() if v != calls_before.get(k, 0)}
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "name": name,
+        "repeat": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        "max_s": max(times),
+        "peak_alloc_bytes": peak,
+        "remote_calls_per_run": calls,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Trả về danh sách benchmark có median chậm hơn baseline quá threshold lần."""
+    previous = {r["name"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        old = previous.get(r["name"])
+        if old and old["median_s"] > 0:
+            ratio = r["median_s"] / old["median_s"]
+            r["baseline_ratio"] = ratio
+            if ratio > threshold:
+                regressions.append(r["name"])
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark offline cho auditnote")
+    p.add_argument("--companies", type=int, default=3)
+    p.add_argument("--frames", type=int, default=4)
+    p.add_argument("--panels", type=int, default=3)
+    p.add_argument("--findings", type=int, default=10, help="số mục mỗi panel")
+    p.add_argument("--images", action="store_true", help="gắn ảnh cho khoảng một nửa số mục")
+    p.add_argument("--saves", type=int, default=20, help="số lần save_item_to_sheets mỗi lượt đo")
+    p.add_argument("--latency-ms", type=float, default=0.0, help="độ trễ mỗi lời gọi Sheets/Drive giả")
+    p.add_argument("--jitter-ms", type=float, default=0.0)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="chỉ chạy các benchmark này")
+    p.add_argument("--out", help="ghi kết quả JSON ra file (mặc định: stdout)")
+    p.add_argument("--baseline", help="file JSON của lần chạy trước để so sánh")
+    p.add_argument("--threshold", type=float, default=1.25)
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ctx = Context(args)
+    results = [measure(ctx, name, args.repeat) for name in (args.only or BENCHMARKS)]
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "revision": _git_revision(),
+            "dataset": {
+                "companies": args.companies, "frames": args.frames, "panels": args.panels,
+                "findings_per_panel": args.findings, "findings": ctx.dataset.n_findings,
+                "images": len(ctx.dataset.images),
+            },
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+        },
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report["regressions"] = regressions
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    for name in regressions:
+        print(f"REGRESSION: {name}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())